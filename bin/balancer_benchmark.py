@@ -0,0 +1,309 @@
+#!/usr/bin/env python
+
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import time
+from argparse import ArgumentParser
+from datetime import datetime, timezone
+
+import factorio_balancers
+from py_factorio_blueprints import Blueprint
+from factorio_balancers import Balancer
+from factorio_balancers.entity_mixins import entity_prototypes
+from factorio_balancers.generator import generate_string
+from factorio_balancers.prototypes import load_prototype_data
+
+
+CORPUS = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', 'tests',
+    'blueprint_strings')
+PACKAGE_ROOT = os.path.dirname(os.path.dirname(
+    os.path.abspath(factorio_balancers.__file__)))
+
+# The methods timed on every balancer, with the arguments they are called
+# with
+TESTS = {
+    'test_output_balance': ('test_output_balance', {}),
+    'test_output_balance.trickle': ('test_output_balance', {'trickle': True}),
+    'test_input_balance': ('test_input_balance', {}),
+    'test_input_balance.trickle': ('test_input_balance', {'trickle': True}),
+    'test_throughput': ('test_throughput', {}),
+    'test_throughput_unlimited': ('test_throughput_unlimited', {}),
+    'throughput_sweep': ('throughput_sweep', {}),
+    'throughput_sweep.extensive': ('throughput_sweep', {'extensive': True}),
+}
+# The throughput tests try exponentially many combinations of inputs and
+# outputs, so they are skipped for generated balancers larger than this, and
+# for those with lane balancers
+MAX_SWEEP_SIZE = 4
+SWEEPS = [name for name in TESTS if 'throughput' in name]
+
+
+logger = logging.getLogger('factorio_balancers.benchmark')
+logger.setLevel(logging.INFO)
+console_handler = logging.StreamHandler()
+console_handler.setFormatter(logging.Formatter('%(message)s'))
+logger.addHandler(console_handler)
+
+
+parser = ArgumentParser(
+    description="Time parsing, building and testing the balancers of a corpus, and compare the timings to a baseline")
+parser.add_argument(
+    "--corpus", dest="corpus", default=CORPUS, metavar="DIR",
+    help="The directory with the blueprint strings to time")
+parser.add_argument(
+    "-k", "--filter", dest="filter", default=None, metavar="TEXT",
+    help="Only time the balancers whose name contains TEXT")
+parser.add_argument(
+    "--skip", dest="skip", default=[], action='append', metavar="MEASURE",
+    help="Don't time this measure, for example throughput_sweep.extensive. Can be given more than once")
+parser.add_argument(
+    "--size", dest="sizes", default=[], action='append', type=int,
+    metavar="N",
+    help="Also time generated NxN balancers of this size, a power of two. Can be given more than once, defaults to 4, 8, 16 and 32")
+parser.add_argument(
+    "--engine", dest="engine", default='object',
+    choices=['object', 'dyadic', 'worklist', 'float', 'numpy'],
+    help="The engine used to run the simulation")
+parser.add_argument(
+    "-r", "--repeat", dest="repeat", default=3, type=int,
+    help="How often every measure is repeated, the fastest time is kept")
+parser.add_argument(
+    "--budget", dest="budget", default=1.0, type=float, metavar="SECONDS",
+    help="Stop repeating a measure once it took this long in total")
+parser.add_argument(
+    "-o", "--output", dest="output", default=None, metavar="FILE",
+    help="Write the timings to FILE as JSON")
+parser.add_argument(
+    "--compare", dest="baseline", default=None, metavar="FILE",
+    help="Compare the timings to a baseline written with --output, and exit with status 1 when any of them regressed")
+parser.add_argument(
+    "--threshold", dest="threshold", default=0.25, type=float,
+    help="How much slower than the baseline a measure may be before it counts as a regression, as a fraction")
+parser.add_argument(
+    "--min-delta", dest="min_delta", default=0.001, type=float,
+    metavar="SECONDS",
+    help="Differences smaller than this are never counted as a regression")
+
+
+def measure(function, repeat, budget):
+    """
+    The fastest of `repeat` runs of `function`, stopping early once the
+    runs took `budget` seconds in total.
+    """
+    best = None
+    total = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+        total += elapsed
+        if total >= budget:
+            break
+    return best
+
+
+def time_import(repeat):
+    code = (
+        "import time; start = time.perf_counter(); "
+        "import factorio_balancers; "
+        "print(time.perf_counter() - start)")
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [PACKAGE_ROOT] + env.get('PYTHONPATH', '').split(os.pathsep))
+    return min(
+        float(subprocess.run(
+            [sys.executable, '-c', code], env=env, check=True,
+            capture_output=True, text=True).stdout)
+        for _ in range(repeat))
+
+
+def long_belt_blueprint(length):
+    """
+    A splitter whose left output runs `length` tiles before turning.
+    """
+    blueprint = Blueprint()
+    for x in (0, 1):
+        for y in (1, 2):
+            blueprint.entities.make(
+                name='transport-belt', position=(x, y), direction=0)
+    blueprint.entities.make(
+        name='splitter', position=(0.5, 0), direction=0)
+    blueprint.entities.make(
+        name='transport-belt', position=(1, -1), direction=0)
+    for y in range(1, length + 1):
+        blueprint.entities.make(
+            name='transport-belt', position=(0, -y), direction=0)
+    blueprint.entities.make(
+        name='transport-belt', position=(0, -length - 1), direction=6)
+    return blueprint.to_string()
+
+
+def cases(args):
+    for name in sorted(os.listdir(args.corpus)):
+        if not name.endswith('.blueprint') or name.startswith('illegal'):
+            continue
+        with open(os.path.join(args.corpus, name)) as f:
+            yield name[:-len('.blueprint')], f.read(), ()
+    for length in (500, 2000):
+        yield f'generated/long_belt_{length}', long_belt_blueprint(length), ()
+    for size in args.sizes or (4, 8, 16, 32):
+        skip = SWEEPS if size > MAX_SWEEP_SIZE else ()
+        for family in ('butterfly', 'benes'):
+            yield (
+                f'generated/{family}_{size}',
+                generate_string(size, family), skip)
+        yield (
+            f'generated/benes_{size}_mixed_tiers',
+            generate_string(size, 'benes', tiers=('basic', 'fast', 'express')),
+            skip)
+        yield (
+            f'generated/benes_{size}_lane_balanced',
+            generate_string(size, 'benes', lane_balance=True), SWEEPS)
+
+
+def time_case(string, args, skip=()):
+    timings = {}
+    if 'decode' not in args.skip:
+        timings['decode'] = measure(
+            lambda: Blueprint(
+                string=string, custom_entity_prototypes=entity_prototypes),
+            args.repeat, args.budget)
+    phases = {}
+    balancers = []
+
+    def build():
+        balancer = Balancer(string=string, engine=args.engine, stats=True)
+        for phase, times in balancer.construction_stats.items():
+            phases[phase] = min(
+                phases.get(phase, times['wall']), times['wall'])
+        balancers[:] = [balancer]
+
+    timings['init'] = measure(build, args.repeat, args.budget)
+    timings.update(phases)
+    balancer = balancers[0]
+
+    for measure_name, (method, kwargs) in TESTS.items():
+        if measure_name in args.skip or measure_name in skip:
+            continue
+
+        def run():
+            balancer.clear()
+            getattr(balancer, method)(**kwargs)
+
+        timings[measure_name] = measure(run, args.repeat, args.budget)
+    return timings
+
+
+def selected(name, args):
+    """
+    Whether the case `name` is timed with the given arguments.
+    """
+    if name == 'import':
+        return 'import' not in args.skip and args.filter is None
+    return args.filter is None or args.filter in name
+
+
+def compare(results, baseline, threshold, min_delta, selected):
+    """
+    The measures that regressed and improved compared to the baseline, the
+    baseline cases that were `selected` but not timed, and the cases that
+    are not in the baseline.
+    """
+    regressions = []
+    improvements = []
+    missing = [
+        case for case in baseline['results']
+        if selected(case) and case not in results['results']]
+    new = [
+        case for case in results['results']
+        if case not in baseline['results']]
+    for case, timings in results['results'].items():
+        for measure_name, seconds in timings.items():
+            previous = baseline['results'].get(case, {}).get(measure_name)
+            if previous is None:
+                continue
+            change = (seconds - previous) / previous if previous else 0
+            if abs(seconds - previous) < min_delta:
+                continue
+            if change > threshold:
+                regressions.append((case, measure_name, previous, seconds))
+            elif change < -threshold:
+                improvements.append((case, measure_name, previous, seconds))
+    return regressions, improvements, missing, new
+
+
+def report(title, rows):
+    logger.info(f"{title}:")
+    for case, measure_name, previous, seconds in rows:
+        logger.info(
+            f"    {case} {measure_name}: {previous * 1000:.2f}ms -> "
+            f"{seconds * 1000:.2f}ms ({seconds / previous:.2f}x)")
+
+
+def main():
+    args = parser.parse_args()
+    # Only the timings are written, not what the balancers log
+    logging.getLogger('factorio_balancers').propagate = False
+    logger.propagate = False
+    load_prototype_data(Balancer.prototype_data_file)
+
+    results = {
+        'meta': {
+            'date': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'engine': args.engine,
+            'repeat': args.repeat,
+        },
+        'results': {},
+    }
+    if selected('import', args):
+        results['results']['import'] = {
+            'import': time_import(args.repeat)}
+    for name, string, skip in cases(args):
+        if not selected(name, args):
+            continue
+        start = time.perf_counter()
+        results['results'][name] = time_case(string, args, skip)
+        logger.info(f"{name}: {time.perf_counter() - start:.2f}s")
+    if not results['results']:
+        logger.error(f"No cases match --filter {args.filter!r}.")
+        sys.exit(1)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions, improvements, missing, new = compare(
+            results, baseline, args.threshold, args.min_delta,
+            lambda name: selected(name, args))
+        if improvements:
+            report("Improvements", improvements)
+        if regressions:
+            report("Regressions", regressions)
+        # Cases that are missing from this run can't be compared, so they
+        # never count as passing. New cases are only reported, as adding a
+        # case shouldn't fail the comparison with an older baseline.
+        for title, names in [
+                ("Missing from this run", missing),
+                ("Missing from the baseline", new)]:
+            if names:
+                logger.info(f"{title}:")
+                for name in names:
+                    logger.info(f"    {name}")
+        if regressions or missing:
+            sys.exit(1)
+        logger.info("No regressions.")
+
+
+if __name__ == '__main__':
+    main()
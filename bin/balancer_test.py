@@ -2,7 +2,9 @@
 
 import logging
 
-from factorio_balancers import Balancer
+from factorio_balancers.batch import run_batch, to_json
+from factorio_balancers.book import BalancerBook
+from factorio_balancers.cache import GraphCache, ResultCache
 from argparse import ArgumentParser
 from py_factorio_blueprints.exceptions import InvalidExchangeString
 
@@ -18,6 +20,9 @@ formatter = logging.Formatter('%(message)s')
 
 parser = ArgumentParser(
     description="Test a balancer configuration for its properties")
+parser.add_argument(
+    "paths", nargs='*', metavar="PATH",
+    help="Test every blueprint in these files, globs or directories, and write the results as one line of JSON per blueprint. A blueprint book given with --file or --string is tested the same way, one line per blueprint in the book")
 parser.add_argument(
     "-f", "--file", dest="filename",
     metavar="FILE",
@@ -44,6 +49,50 @@ parser.add_argument(
 parser.add_argument(
     "--silent", dest="verbose", default=True, action='store_false',
     help="Tell the script not to write intermediate data to the screen.\nNote: this prints raw function results on exit that are very user-unfriendly.")
+parser.add_argument(
+    "--engine", dest="engine", default='object',
+    choices=['object', 'dyadic', 'worklist', 'float', 'numpy'],
+    help="The engine used to run the simulation. The float and numpy engines are faster, and verify results close to a threshold using exact fractions")
+parser.add_argument(
+    "--margin", dest="margin", default=None, type=float,
+    help="How close to a threshold a result of the float or numpy engine has to be to verify it using exact fractions")
+parser.add_argument(
+    "--solver", dest="solver", default=[], action='append',
+    choices=['linear'],
+    help="Solve the output balance as a linear system when no belt is saturated (linear)")
+parser.add_argument(
+    "-j", "--workers", dest="workers", default=None, type=int,
+    help="The number of processes used to run throughput sweeps")
+parser.add_argument(
+    "--symmetry", dest="symmetry", default=False, action='store_true',
+    help="Skip throughput sweep combinations that are symmetric to one that is already tested")
+parser.add_argument(
+    "--warm-start", dest="warm_start", default=False, action='store_true',
+    help="Order throughput sweep combinations so consecutive ones differ by a single input or output, and start each one from the belt contents of the previous one")
+parser.add_argument(
+    "--order", dest="order", default=None, choices=['flow', 'reverse'],
+    help="Run the splitters along (flow) or against (reverse) the flow of items during throughput tests, instead of all at the same time")
+parser.add_argument(
+    "--cache", dest="cache", default=None, metavar="DIR",
+    help="Store the simulation graphs of tested blueprints in DIR, and reuse them when the same blueprint is tested again")
+parser.add_argument(
+    "--cache-size", dest="cache_size", default=64, type=int, metavar="MB",
+    help="The maximum size of the cache in megabytes, the least recently used graphs are removed first")
+parser.add_argument(
+    "--result-cache", dest="result_cache", default=None, metavar="DIR",
+    help="Store the results of every tested property in DIR, and reuse them when the same balancer is tested again")
+parser.add_argument(
+    "--fingerprint", dest="fingerprint", default=False, action='store_true',
+    help="Print the fingerprint of the balancer's splitter graph instead of testing it. Balancers that only differ in their layout have the same fingerprint")
+parser.add_argument(
+    "--stats", dest="stats", default=False, action='store_true',
+    help="Add the wall and CPU time, simulation cycles, splitter iterations and sweep combinations of every tested property to its result, and the time of every phase of building the balancer to the lane_balancer result")
+parser.add_argument(
+    "-p", "--processes", dest="processes", default=None, type=int,
+    help="The number of processes used to test the blueprints of a batch")
+parser.add_argument(
+    "--pattern", dest="pattern", default='*.blueprint',
+    help="The files to test in the directories of a batch")
 parser.add_argument(
     '--debug', dest='debug', default=False, action='store_true',
     help="Write additional debug info to the screen when parsing and testing")
@@ -59,38 +108,101 @@ console_handler.setFormatter(formatter)
 
 logger.addHandler(console_handler)
 
+def add_property(props, condition, prop):
+    if condition:
+        props.append(prop)
+
+properties = []
+
+add_property(properties, args.balance, 'balance.output')
+add_property(properties, args.balance, 'balance.input')
+add_property(properties, args.trickle, 'balance.output.trickle')
+add_property(properties, args.trickle, 'balance.input.trickle')
+add_property(properties, args.sweep, 'throughput.unlimited.candidate')
+add_property(properties, args.extensive, 'throughput.unlimited')
+
+cache = None
+if args.cache:
+    cache = GraphCache(args.cache, max_size=args.cache_size * 2**20)
+result_cache = None
+if args.result_cache:
+    result_cache = ResultCache(
+        args.result_cache, max_size=args.cache_size * 2**20)
+
+batch_options = dict(
+    processes=args.processes, engine=args.engine, order=args.order,
+    graph_cache=cache, result_cache=result_cache, margin=args.margin,
+    solver=args.solver, workers=args.workers, symmetry=args.symmetry,
+    warm_start=args.warm_start, stats=args.stats,
+    fingerprint=args.fingerprint)
+
+
+def print_records(records):
+    for record in records:
+        if args.fingerprint and 'error' not in record:
+            del record['results']
+        print(to_json(record), flush=True)
+
+
+if args.fingerprint:
+    properties = []
+
+if args.paths:
+    if not args.debug:
+        console_handler.setLevel(logging.WARNING)
+    print_records(run_batch(
+        args.paths, properties, pattern=args.pattern, **batch_options))
+    exit()
+
 if not args.filename and not args.string:
     logger.error("No file or string specified.")
     parser.parse_args(['-h'])
 
 if not args.string:
-    logger.debug("Reading blueprint string from ", args.filename)
+    logger.debug(f"Reading blueprint string from {args.filename}")
     file = open(args.filename, 'r')
     string = file.read()
-    logger.debug("The blueprint string: \n", string)
+    logger.debug(f"The blueprint string: \n{string}")
 else:
     string = args.string
 
 try:
-    balancer = Balancer(string=string, verbose=args.verbose)
-except InvalidExchangeString:
+    book = BalancerBook(string.strip())
+except (InvalidExchangeString, KeyError):
     logger.error("Error - Either the string was formatted wrong, or the blueprint contained non-belt entities.")
     logger.info("Exiting.")
     exit()
 
-def add_property(props, condition, prop):
-    if condition:
-        props.append(prop)
+if book.is_book:
+    if not args.debug:
+        console_handler.setLevel(logging.WARNING)
+    print_records(book.test(properties, **batch_options))
+    exit()
 
-properties = []
+# The string is already decoded, so the balancer is built from its data
+entry = next(iter(book))
+try:
+    if cache is not None and not args.debug:
+        balancer = cache.load(
+            string, order=args.order, data=entry.data,
+            verbose=args.verbose, stats=args.stats)
+    else:
+        balancer = entry.balancer(
+            verbose=args.verbose, order=args.order, stats=args.stats)
+        if cache is not None:
+            cache.put(string, balancer, balancer.prototype_data_file)
+except InvalidExchangeString:
+    logger.error("Error - Either the string was formatted wrong, or the blueprint contained non-belt entities.")
+    logger.info("Exiting.")
+    exit()
 
-add_property(properties, args.balance, 'balance.output')
-add_property(properties, args.balance, 'balance.input')
-add_property(properties, args.trickle, 'balance.output.trickle')
-add_property(properties, args.trickle, 'balance.input.trickle')
-add_property(properties, args.sweep, 'throughput.unlimited.candidate')
-add_property(properties, args.extensive, 'throughput.unlimited')
+if args.fingerprint:
+    print(balancer.fingerprint())
+    exit()
 
 results = balancer.test(
-    properties=properties, verbose=args.verbose)
+    properties=properties, verbose=args.verbose,
+    engine=args.engine, margin=args.margin, solver=args.solver,
+    workers=args.workers, symmetry=args.symmetry,
+    warm_start=args.warm_start, cache=result_cache, stats=args.stats)
 print(results)
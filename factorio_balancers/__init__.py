@@ -1,3 +1,5 @@
 from factorio_balancers.balancer import Balancer
+from factorio_balancers.compiled import CompiledBalancer
+from factorio_balancers.book import BalancerBook
 
 name = "factorio_balancers"
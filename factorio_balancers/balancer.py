@@ -1,91 +1,130 @@
 import logging
 import os
-from itertools import combinations
-from progress.bar import Bar
-from fractions import Fraction
 from py_factorio_blueprints import Blueprint
 from py_factorio_blueprints.util import Vector
-from factorio_balancers.utils import catch, get_nr_of_permutations
+from factorio_balancers.utils import catch, timed
 from factorio_balancers.graph import Splitter, Belt
+from factorio_balancers.engines import get_engine
+from factorio_balancers.grid import GridIndex
+from factorio_balancers.compiled import Simulation
+from factorio_balancers.prototypes import DATA_FILE, load_prototype_data
 from factorio_balancers.entity_mixins import (
     entity_prototypes, Splitter as SplitterMixin,
-    Belt as BeltMixin, Underground as UndergroundMixin)
+    Belt as BeltMixin, Underground as UndergroundMixin, pair_undergrounds)
 from factorio_balancers.exceptions import *
 
 
 logger = logging.getLogger("factorio_balancers.balancer")
 
 
-class MyBar(Bar):
-    def finish(self, clear=True):
-        if clear:
-            self.clearln()
-            print('\x1b[?25h', end='')
-        else:
-            super().finish()
-
-    @property
-    def eta_display(self):
-        return str(self.eta_td)
-
-
-class OptionalBar:
-    def __init__(self, *args, verbose, **kwargs):
-        self.verbose = verbose
-        if kwargs.get('suffix', None) is None:
-            kwargs['suffix'] = '%(percent)d%% - %(eta_display)s'
-        if self.verbose:
-            self.bar = MyBar(*args, **kwargs)
+def _rebuild(args, kwargs, engine, order):
+    return Balancer(*args, engine=engine, order=order, **kwargs)
 
-    def finish(self, *args, **kwargs):
-        if self.verbose:
-            self.bar.finish(*args, **kwargs)
 
-    def next(self, *args, **kwargs):
-        if self.verbose:
-            self.bar.next(*args, **kwargs)
+def _position(entity):
+    return (entity.position.x, entity.position.y)
 
 
-def is_close(a, b, rel_tol=1e-06, abs_tol=0.0):
-    return abs(a - b) <= max(rel_tol * max(abs(a), abs(b)), abs_tol)
-
-
-class Balancer(Blueprint):
-    def __init__(self, *args, **kwargs):
-        Blueprint.import_prototype_data(
-            f"{os.path.dirname(__file__)}/entity_data.json")
-        super().__init__(
-            *args, custom_entity_prototypes=entity_prototypes, **kwargs)
-
-        self.recompile_entities()
-        logger.debug("Before padding")
-        self.print2d(log_level=10)
-        self.pad_connections()
-        self.strip_connections()
-        logger.debug("After padding")
-        self.print2d(log_level=10)
-        inputs, outputs = self._get_external_connections()
-        self.nr_inputs = len(inputs)
-        self.nr_outputs = len(outputs)
-        logger.debug(f"Nr of inputs and outputs: "
-                     f"{self.nr_inputs}, {self.nr_outputs}")
-        logger.debug(f"Inputs: {inputs}")
-        logger.debug(f"Outputs: {outputs}")
+class Balancer(Blueprint, Simulation):
+    # Point this to a different file to use modded entities
+    prototype_data_file = DATA_FILE
+    _entity_grid = None
+    _underground_partners = None
 
-        nodes = self._get_nodes()
-        logger.debug(f"Number of nodes {len(nodes)}")
-        logger.debug(f"Nodes {nodes}")
+    def __init__(
+            self, *args, engine='object', order=None, trace=None, cache=None,
+            stats=False, **kwargs):
+        self._engine_name = get_engine(engine).name
+        self._order = order
+        # Called with a dict for every diagnostic event, see `_emit`
+        self._trace = trace
+        # Used to pickle the balancer, see `__reduce__`
+        self._init_args = (args, dict(kwargs, cache=cache, stats=stats))
+        phases = self.construction_stats = {} if stats else None
+        load_prototype_data(self.prototype_data_file)
 
-        for i, node in enumerate(nodes):
-            node.node_number = i
+        string = kwargs.get('string', args[0] if args else None)
+        compiled = None
+        if cache is not None and isinstance(string, str):
+            with timed(phases, 'cache'):
+                compiled = cache.get(
+                    string, self._engine_name, order,
+                    self.prototype_data_file)
+        else:
+            cache = None
 
-        self.generate_simulation()
-        self.nr_inputs_sim = len(self._input_belts)
-        self.nr_outputs_sim = len(self._output_belts)
+        with timed(phases, 'parse'):
+            if compiled is not None:
+                # The blueprint isn't decoded on a hit, so the balancer has
+                # no entities
+                super().__init__(custom_entity_prototypes=entity_prototypes)
+            else:
+                super().__init__(
+                    *args, custom_entity_prototypes=entity_prototypes,
+                    **kwargs)
+        if compiled is not None:
+            self._load_compiled(compiled)
+            return
 
-    def print2d(self, logger=None, log_level=20):
-        if logger is None:
-            logger = logging.getLogger("factorio_balancers.balancer.print2d")
+        with timed(phases, 'recompile_entities'):
+            self.recompile_entities()
+        self._log_layout("Layout")
+        with timed(phases, 'pad_and_strip'):
+            inputs, outputs = self._pad_and_strip()
+
+        with timed(phases, 'nodes'):
+            nodes = self._get_nodes()
+            for i, node in enumerate(nodes):
+                node.node_number = i
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Nr of inputs and outputs: "
+                         f"{self.nr_inputs}, {self.nr_outputs}")
+            logger.debug(f"Inputs: {inputs}")
+            logger.debug(f"Outputs: {outputs}")
+            logger.debug(f"Number of nodes {len(nodes)}")
+            logger.debug(f"Nodes {nodes}")
+        if self._trace is not None:
+            self._emit(
+                'connections',
+                inputs=[(position.x, position.y)
+                        for _, position in self._input_terminals],
+                outputs=[_position(entity) for entity in outputs],
+                nodes=[_position(node) for node in nodes])
+
+        with timed(phases, 'generate_simulation'):
+            self.generate_simulation()
+        if cache is not None:
+            cache.put(string, self, self.prototype_data_file)
+
+    def _load_compiled(self, compiled):
+        # The simulation graph of a cached balancer, its entities are not
+        # connected to the graph
+        self.has_sideloads = compiled.has_sideloads
+        self.nr_inputs = compiled.nr_inputs
+        self.nr_outputs = compiled.nr_outputs
+        self._load_graph(
+            compiled._splitters, compiled._belts,
+            compiled._input_belts, compiled._output_belts)
+
+    def __reduce__(self):
+        # A balancer is pickled as the arguments it was built from, use
+        # `compile()` to pickle just the simulation graph
+        args, kwargs = self._init_args
+        return (_rebuild, (
+            args, kwargs, self._engine_name, self._order))
+
+    def _log_layout(self, stage, log_level=logging.DEBUG):
+        if self._trace is not None:
+            self._emit('layout', stage=stage, rows=self.render2d())
+        if logger.isEnabledFor(log_level):
+            logger.log(log_level, stage)
+            self.print2d(log_level=log_level)
+
+    def render2d(self):
+        """
+        The balancer as rows of ascii art.
+        """
         maxx, minx, maxy, miny = self.maximum_values
         width = maxx - minx + 1
         height = maxy - miny + 1
@@ -97,9 +136,15 @@ class Balancer(Blueprint):
                 position = coord - offset
                 x, y = position.round()
                 data[y][x] = entity.name.data['ascii'][entity.direction // 2][i]
-        result = "    "
-        for line in data:
-            logger.log(log_level, f"    {''.join(line)}")
+        return [''.join(line) for line in data]
+
+    def print2d(self, logger=None, log_level=20):
+        if logger is None:
+            logger = logging.getLogger("factorio_balancers.balancer.print2d")
+        if not logger.isEnabledFor(log_level):
+            return
+        for line in self.render2d():
+            logger.log(log_level, f"    {line}")
 
     def _get_nodes(self):
         return [
@@ -115,57 +160,64 @@ class Balancer(Blueprint):
 
         if self.has_sideloads:
             self._parse_lane_balancer()
-            return
         else:
             self._parse_balancer()
+        self._load_graph(
+            self._splitters, self._belts,
+            self._input_belts, self._output_belts)
+        if self.has_sideloads:
+            return
 
-        if self._verbose:
+        if self._verbose and logger.isEnabledFor(logging.DEBUG):
             logger.debug(f"Inputs: {self._input_belts}")
             logger.debug(f"Outputs: {self._output_belts}")
             logger.debug(f"Splitters: {self._splitters}")
+        if self._trace is not None:
+            self._emit(
+                'simulation',
+                inputs=len(self._input_belts),
+                outputs=len(self._output_belts),
+                splitters=len(self._splitters),
+                belts=len(self._belts))
         for entity in self._get_nodes():
             if not entity._traversed:
                 raise IllegalConfiguration(
                     message="The balancer is not fully connected")
 
-    def cycle(self):
-        for splitter in self._splitters:
-            splitter.balance()
-        for belt in self._belts:
-            belt.transfer()
-
-    def clear(self):
-        total = 0
-        for belt in self._belts:
-            total += belt.clear()
-            if belt.next:
-                total += belt.next.clear()
-        return total
-
-    def fill(self):
-        total = 0
-        for belt in self._belts:
-            total += belt.supply()
-            if belt.next:
-                total += belt.next.supply()
-        return total
-
-    def supply(self, *args, **kwargs):
-        return [
-            belt.supply(*args, **kwargs)
-            for belt in self._input_belts]
+    @property
+    def entity_grid(self):
+        """
+        An index of the tiles the entities occupy, built when it is first
+        needed after the entities changed.
+        """
+        if self._entity_grid is None:
+            self._entity_grid = GridIndex(self.entities)
+        return self._entity_grid
 
-    def drain(self, **kwargs):
-        return [
-            belt.clear(**kwargs)
-            for belt in self._output_belts]
+    @property
+    def underground_partners(self):
+        """
+        The partner of every underground belt, paired with a single sweep
+        over every row and column, see `pair_undergrounds`.
+        """
+        if self._underground_partners is None:
+            self._underground_partners = pair_undergrounds(
+                [entity for entity in self.entities
+                 if isinstance(entity, UndergroundMixin)],
+                self.entity_grid)
+        return self._underground_partners
 
     def recompile_entities(self):
+        self._entity_grid = self._underground_partners = None
         for entity in self.entities:
             entity.reset()
         exceptions = self.setup_transport_lines()
         nr_exceptions = len(exceptions)
         if nr_exceptions > 0:
+            if self._trace is not None:
+                self._emit(
+                    'illegal configuration', rows=self.render2d(),
+                    errors=[str(e) for e in exceptions])
             self.print2d(log_level=20)
             raise IllegalConfigurations(*exceptions)
 
@@ -194,40 +246,96 @@ class Balancer(Blueprint):
         else:
             return self._input_belt_check(entity._partner_forward)
 
-    def pad_connections(self):
-        inputs, outputs = self._get_external_connections()
-
-        self.pad_entities(inputs, inp=True)
-        self.pad_entities(outputs, out=True)
-
-    def strip_connections(self):
+    def _pad_and_strip(self):
+        """
+        Works out the inputs and outputs of the balancer as if they were
+        padded and stripped, without changing the blueprint. When any of the
+        inputs (or outputs) isn't a straight belt, all of them get a belt in
+        front of (or after) them. Then the straight belts that all inputs
+        (or outputs) have in common are stripped.
+
+        The stripped entities are left out while tracing the graph, and
+        splitters that would have been padded get their output belts
+        directly. Returns the inputs and outputs before padding.
+        """
         inputs, outputs = self._get_external_connections()
-        self.strip_entities(inputs, inp=True)
-        self.strip_entities(outputs, out=True)
+        if not inputs:
+            raise IllegalConfiguration(message="The balancer has no inputs")
+        if not outputs:
+            raise IllegalConfiguration(message="The balancer has no outputs")
+        pad_inputs = self._needs_padding(inputs, inp=True)
+        pad_outputs = self._needs_padding(outputs, out=True)
+        strip_inputs = min(
+            self._strip_length(entity, pad_inputs, inp=True)
+            for entity in inputs)
+        strip_outputs = min(
+            self._strip_length(entity, pad_outputs, out=True)
+            for entity in outputs)
+
+        self._stripped = set()
+        self._padded_outputs = set()
+        # The entity to trace every input from, and the position of the
+        # belt it is fed from
+        self._input_terminals = []
+        for entity in inputs:
+            if pad_inputs and strip_inputs == 0:
+                for position in self._pad_positions(entity):
+                    self._input_terminals.append((entity, position))
+                continue
+            entity = self._strip(
+                entity, strip_inputs - pad_inputs, inp=True)
+            self._input_terminals.append((entity, entity.position))
+        self._input_terminals.sort(
+            key=lambda terminal: (terminal[1].y, terminal[1].x))
+        for entity in outputs:
+            if pad_outputs and strip_outputs == 0:
+                if isinstance(entity, SplitterMixin):
+                    self._padded_outputs.add(entity)
+                continue
+            self._strip(entity, strip_outputs - pad_outputs, out=True)
+
+        self.nr_inputs = len(self._input_terminals)
+        self.nr_outputs = len(outputs) + len(self._padded_outputs)
+        if self._trace is not None:
+            self._emit(
+                'padding', inputs=pad_inputs, outputs=pad_outputs,
+                strip_inputs=strip_inputs, strip_outputs=strip_outputs)
+        return inputs, outputs
 
-    def pad_entities(self, entities, **kwargs):
+    def _needs_padding(self, entities, inp=False, out=False):
         for entity in entities:
             if isinstance(entity, (SplitterMixin, UndergroundMixin)):
-                break
+                return True
             elif entity.has_sideloads:
-                break
-            elif kwargs.get('inp', False):
+                return True
+            elif inp:
                 if entity.forward.entity.direction != entity.direction:
-                    break
-            elif kwargs.get('out', False):
+                    return True
+            elif out:
                 if entity.backward.entities[0].direction != entity.direction:
-                    break
-        else:
-            return
-        for entity in entities:
-            entity.pad_connection(**kwargs)
+                    return True
+        return False
 
-    def strip_entities(self, entities, **kwargs):
-        strip_length = min(
-            [entity.strip_length(**kwargs)
-             for entity in entities])
-        for entity in entities:
-            entity.strip_connection(strip_length, **kwargs)
+    def _pad_positions(self, entity):
+        vector = entity.direction.rotate(2).vector
+        return [coordinate + vector for coordinate in entity.coordinates]
+
+    def _strip_length(self, entity, padded, inp=False, out=False):
+        if not padded:
+            return entity.strip_length(inp=inp, out=out)
+        # The padding belt is a straight belt of the same speed
+        if isinstance(entity, BeltMixin) and not entity.has_sideloads:
+            return 1 + entity.strip_length(inp=inp, out=out)
+        return 0
+
+    def _strip(self, entity, length, inp=False, out=False):
+        for _ in range(length):
+            self._stripped.add(entity)
+            if inp:
+                entity = entity.forward.entity
+            else:
+                entity = entity.backward.entities[0]
+        return entity
 
     def setup_transport_lines(self):
         exceptions = []
@@ -248,15 +356,13 @@ class Balancer(Blueprint):
         for i, entity in enumerate(self._get_nodes()):
             splitter = Splitter(entity=entity, uid=i)
             self._splitters.append(splitter)
-        inputs, outputs = self._get_external_connections()
         self._input_belts = []
         self._output_belts = []
-        for input in inputs:
-            assert isinstance(input, (BeltMixin, UndergroundMixin))
+        for input, position in self._input_terminals:
             belt = input._trace_nodes(
                 Belt(capacity=input.name.data['belt_speed']),
-                input.position)
-            assert len(outputs) == len(self._output_belts)
+                position)
+            assert self.nr_outputs == len(self._output_belts)
             self._input_belts.append(belt)
 
     def _parse_lane_balancer(self):
@@ -310,20 +416,18 @@ class Balancer(Blueprint):
                 self._splitters.append(sideload_right)
             else:
                 raise Exception('what')
-        inputs, outputs = self._get_external_connections()
         self._input_belts = []
         self._output_belts = []
-        for input in inputs:
-            assert isinstance(input, (BeltMixin, UndergroundMixin))
+        for input, position in self._input_terminals:
             belt_left = input._trace_nodes(
                 Belt(capacity=input.name.data['belt_speed']),
-                input.position,
+                position,
                 lane='left')
             belt_right = input._trace_nodes(
                 Belt(capacity=input.name.data['belt_speed']),
-                input.position,
+                position,
                 lane='right')
-            assert len(outputs) * 2 == len(self._output_belts)
+            assert self.nr_outputs * 2 == len(self._output_belts)
             self._input_belts.append(belt_left)
             self._input_belts.append(belt_right)
         for i, splitter in enumerate(self._splitters):
@@ -331,18 +435,22 @@ class Balancer(Blueprint):
 
     def graph_check(self):
         """
-        Recursively traverse all the nodes from a single input, going both
+        Traverse all the nodes from a single input, going both
         forward and backwards through the graph.
         Checks whether all nodes have been traversed. If not, this means the
         graph is not fully connected.
         """
-        logger.debug("All nodes:")
+        debug = logger.isEnabledFor(logging.DEBUG)
+        if debug:
+            logger.debug("All nodes:")
         for node in self._get_nodes():
-            logger.debug(f"    {node}")
+            if debug:
+                logger.debug(f"    {node}")
             node._traversed = False
 
         start_node = self._inputs[0]
-        logger.debug(f"start node: {start_node}")
+        if debug:
+            logger.debug(f"start node: {start_node}")
 
         self._traverse_node(start_node)
         for node in self.nodes:
@@ -351,19 +459,22 @@ class Balancer(Blueprint):
         return True
 
     def _traverse_node(self, node):
-        logger.debug(f"traversing node: {node}")
-        if node is None or node._traversed:
-            return
-        node._traversed = True
-
-        if type(node) is Belt:
-            self._traverse_node(node._input)
-            self._traverse_node(node._output)
-        else:
-            self._traverse_node(node._input_left)
-            self._traverse_node(node._input_right)
-            self._traverse_node(node._output_left)
-            self._traverse_node(node._output_right)
+        debug = logger.isEnabledFor(logging.DEBUG)
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if debug:
+                logger.debug(f"traversing node: {node}")
+            if node is None or node._traversed:
+                continue
+            node._traversed = True
+
+            if type(node) is Belt:
+                stack.extend([node._output, node._input])
+            else:
+                stack.extend([
+                    node._output_right, node._output_left,
+                    node._input_right, node._input_left])
 
     def make_networkx_graph(self):
         import networkx as nx
@@ -375,7 +486,8 @@ class Balancer(Blueprint):
             node_name = f'input {i}'
             if belt.next:
                 belt.next.node.make_networkx_graph(
-                    g, node_name, node_colors, edge_colors)
+                    g, node_name, node_colors, edge_colors,
+                    self._output_belts)
 
         pos = nx.spring_layout(g)
         # nx.draw(g)
@@ -390,244 +502,3 @@ class Balancer(Blueprint):
         # nx.draw_networkx_edges(g, pos, arrows=True)
         filename = f"{os.path.dirname(__file__)}/../graph.png"
         plt.show()
-
-    def test_output_balance(
-            self, verbose=False, trickle=False, debug=False, **kwargs):
-        bar = OptionalBar(
-            '   -- Progress',
-            verbose=verbose,
-            max=len(self._input_belts) + 1)
-
-        amount = Fraction(1, 4) if trickle else None
-        for input in self._input_belts:
-            self.clear()
-            drained = self.drain()
-            supplied = input.supply(amount)
-            while not is_close(sum(drained), supplied):
-                self.cycle()
-                drained = self.drain()
-                supplied = input.supply(amount)
-
-            if len(set(drained)) > 1:
-                bar.finish()
-                return False
-            bar.next()
-
-        self.clear()
-        drained = self.drain()
-        supplied = self.supply(amount)
-        while not is_close(sum(drained), sum(supplied)):
-            self.cycle()
-            drained = self.drain()
-            supplied = self.supply(amount)
-        bar.finish()
-        if len(set(drained)) > 1:
-            return False
-        return True
-
-    def test_input_balance(self, verbose=False, trickle=False, **kwargs):
-        bar = OptionalBar(
-            '   -- Progress',
-            verbose=verbose,
-            max=len(self._output_belts) + 1)
-
-        amount = Fraction(1, 4) if trickle else None
-        for output in self._output_belts:
-            self.fill()
-            drained = output.clear(amount)
-            supplied = self.supply()
-            while not is_close(drained, sum(supplied)):
-                self.cycle()
-                drained = output.clear(amount)
-                supplied = self.supply()
-
-            if len(set(supplied)) > 1:
-                bar.finish()
-                return False
-            bar.next()
-
-        self.fill()
-        drained = self.drain(amount=amount)
-        supplied = self.supply()
-        while not is_close(sum(drained), sum(supplied)):
-            self.cycle()
-            drained = self.drain(amount=amount)
-            supplied = self.supply()
-        bar.finish()
-        if len(set(supplied)) > 1:
-            return False
-        return True
-
-    def test_throughput(
-            self, inputs=None, outputs=None, verbose=False, **kwargs):
-        if inputs is None:
-            inputs = self._input_belts
-        if outputs is None:
-            outputs = self._output_belts
-
-        def drain(a):
-            return [b.clear() for b in a]
-
-        def supply(a):
-            return [b.supply() for b in a]
-
-        self.clear()
-        drained = drain(outputs)
-        supplied = supply(inputs)
-        clean_input = supplied
-        while not is_close(sum(drained), sum(supplied)):
-            drained = drain(outputs)
-            self.cycle()
-            supplied = supply(inputs)
-
-        worst_percentage = 100.0
-        for output in outputs:
-            percentage = output.percentage
-            if not is_close(worst_percentage, percentage) and \
-                    percentage < worst_percentage:
-                worst_percentage = percentage
-        drained = drain(outputs)
-
-        if is_close(sum(clean_input), sum(drained)):
-            return True, worst_percentage
-        if worst_percentage < 100.0:
-            return False, worst_percentage
-        return True, worst_percentage
-
-    def throughput_sweep(self, extensive=False, verbose=False, **kwargs):
-        if extensive:
-            i_range = range(
-                1,
-                1 + min(
-                    len(self._input_belts),
-                    len(self._output_belts)))
-            nr_of_permutations = get_nr_of_permutations(
-                len(self._input_belts),
-                len(self._output_belts),
-                len(self._input_belts))
-        else:
-            i_range = range(1, 3)
-            nr_of_permutations = get_nr_of_permutations(
-                len(self._input_belts),
-                len(self._output_belts),
-                2)
-        bar = OptionalBar(
-            '   -- Progress', verbose=verbose, max=nr_of_permutations)
-
-        results = []
-
-        for i in i_range:
-            for inputs in combinations(self._input_belts, i):
-                for outputs in combinations(self._output_belts, i):
-                    results.append(
-                        self.test_throughput(inputs=inputs, outputs=outputs))
-                    bar.next()
-        bar.finish()
-        return results
-
-    def test_throughput_unlimited(self, **kwargs):
-        results = self.throughput_sweep(**kwargs)
-        limited = False
-        worst = 100.0
-        for unlimited, percentage in results:
-            if not unlimited:
-                limited = True
-                if not is_close(worst, percentage) and \
-                        percentage < worst:
-                    worst = percentage
-
-        return not limited, worst
-
-    def test(self, properties=None, verbose=False):
-        if properties is None:
-            properties = []
-
-        self.clear()
-        is_lane_balancer = self.has_sideloads
-        logger.info(
-            f"Testing a {len(self._input_belts)} - "
-            f"{len(self._output_belts)} "
-            f"{'lane ' if is_lane_balancer else ''}balancer.")
-
-        results = {
-            "lane_balancer": {
-                "result": is_lane_balancer,
-            }
-        }
-
-        if 'balance.output' in properties:
-            logger.info("  Testing balance.")
-            output_balanced = self.test_output_balance(verbose=verbose)
-            results['balance.output'] = {
-                "result": output_balanced,
-            }
-            logger.info(
-                f"   -- Output is {'' if output_balanced else 'NOT '}balanced.")
-
-        if 'balance.input' in properties:
-            input_balanced = self.test_input_balance(verbose=verbose)
-            results['balance.input'] = {
-                "result": input_balanced,
-            }
-            logger.info(
-                f"   -- Input is {'' if input_balanced else 'NOT '}balanced.")
-
-        if 'balance.output.trickle' in properties:
-            logger.info("  Testing balance using trickle.")
-            output_balanced = self.test_output_balance(
-                verbose=verbose, trickle=True)
-            results['balance.output.trickle'] = {
-                "result": output_balanced,
-            }
-            logger.info(
-                f"   -- Output is {'' if output_balanced else 'NOT '}"
-                f"balanced with a trickle.")
-        if 'balance.input.trickle' in properties:
-            input_balanced = self.test_input_balance(
-                verbose=verbose, trickle=True)
-            results['balance.input.trickle'] = {
-                "result": input_balanced,
-            }
-            logger.info(
-                f"   -- Input is {'' if input_balanced else 'NOT '}"
-                f"balanced with a trickle.")
-
-        if 'throughput.full' in properties:
-            full_throughput, worst = self.test_throughput(verbose=verbose)
-            logger.info("  Testing regular throughput.")
-            results['throughput.full'] = {
-                "result": full_throughput,
-            }
-            if full_throughput:
-                logger.info("   -- Full throughput on regular use")
-            else:
-                results['throughput.full']['message'] = worst
-                logger.info(
-                    f"   -- Limited throughput to {worst} on "
-                    f"regular use on at least one of the outputs.")
-
-        if 'throughput.unlimited.candidate' in properties \
-                or 'throughput.unlimited' in properties:
-            extensive = 'throughput.unlimited' in properties
-            logger.info(
-                f"  {'Extensive' if extensive else 'Regular'} "
-                f"throughput sweep")
-            unlimited, worst = self.test_throughput_unlimited(
-                extensive=extensive, verbose=verbose)
-            field = 'throughput.unlimited' if extensive \
-                else 'throughput.unlimited.candidate'
-            results[field] = {
-                "result": unlimited,
-            }
-
-            if not unlimited:
-                logger.info(
-                    f"   -- At least one bottleneck exists that "
-                    f"limits throughput to {worst}%.")
-                results[field]['message'] = worst
-            else:
-                logger.info(
-                    f"   -- No bottlenecks with any combinations of"
-                    f" {'any number of' if extensive else '1 or 2'} "
-                    f"inputs and outputs.")
-        return results
@@ -0,0 +1,146 @@
+import fnmatch
+import glob
+import json
+import logging
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from fractions import Fraction
+from py_factorio_blueprints.util import encode
+from factorio_balancers.balancer import Balancer
+from factorio_balancers.exceptions import IllegalConfigurations
+from factorio_balancers.prototypes import load_prototype_data
+
+
+logger = logging.getLogger("factorio_balancers.batch")
+
+
+def find_blueprints(paths, pattern='*.blueprint'):
+    """
+    The files to test, given a list of files, globs and directories.
+    Directories are searched recursively for files matching `pattern`.
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(fnmatch.filter(files, pattern)):
+                    yield os.path.join(root, name)
+        elif any(character in path for character in '*?['):
+            yield from sorted(glob.iglob(path, recursive=True))
+        else:
+            yield path
+
+
+def run_blueprint(path, properties, **options):
+    """
+    Tests the blueprint in a file, and returns a dict with its results, or
+    with the error that prevented testing it.
+    """
+    record = {'file': path}
+    try:
+        with open(path) as f:
+            string = f.read()
+    except OSError as e:
+        return _error(record, e)
+    return run_balancer(record, properties, string=string, **options)
+
+
+def run_balancer(record, properties, string=None, data=None,
+                 engine='object', order=None, graph_cache=None,
+                 result_cache=None, stats=False, fingerprint=False,
+                 **kwargs):
+    """
+    Tests the blueprint given as a `string` or decoded `data`, and adds its
+    results, or the error that prevented testing it, to `record`. With
+    `stats`, the results include the statistics of `Balancer.test`, and
+    with `fingerprint` the record includes the fingerprint of the balancer.
+    """
+    try:
+        if graph_cache is not None:
+            if string is None:
+                string = encode(data)
+            balancer = graph_cache.load(
+                string, engine=engine, order=order, data=data, stats=stats)
+        else:
+            balancer = Balancer(
+                string=string, data=data, engine=engine, order=order,
+                stats=stats)
+        record['inputs'] = balancer.nr_inputs
+        record['outputs'] = balancer.nr_outputs
+        if fingerprint:
+            record['fingerprint'] = balancer.fingerprint()
+        record['results'] = balancer.test(
+            properties=properties, cache=result_cache, stats=stats,
+            **kwargs)
+    except Exception as e:
+        _error(record, e)
+    return record
+
+
+def _error(record, e):
+    record['error'] = type(e).__name__
+    record['message'] = str(e)
+    if isinstance(e, IllegalConfigurations):
+        record['errors'] = [str(error) for error in e.args]
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"Failed to test {record}")
+    return record
+
+
+def _init_batch_worker(function, options):
+    global _batch_function, _batch_options
+    _batch_function = function
+    _batch_options = options
+    load_prototype_data(Balancer.prototype_data_file)
+
+
+def _run_batch_item(item):
+    return _batch_function(item, **_batch_options)
+
+
+def ordered_map(function, items, processes=None, **options):
+    """
+    Yields `function(item, **options)` for every item, in order. With more
+    than one process, the items are run by a process pool, and only a few
+    items per process are in flight, so the results of a large batch are
+    never all in memory at once.
+    """
+    if not processes or processes == 1:
+        for item in items:
+            yield function(item, **options)
+        return
+    with ProcessPoolExecutor(
+            max_workers=processes,
+            initializer=_init_batch_worker,
+            initargs=(function, options)) as executor:
+        pending = deque()
+        for item in items:
+            pending.append(executor.submit(_run_batch_item, item))
+            if len(pending) >= processes * 4:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def run_batch(paths, properties, processes=None, pattern='*.blueprint',
+              **options):
+    """
+    Tests every blueprint found by `find_blueprints`, on `processes`
+    processes, and yields the dict of `run_blueprint` for each of them in
+    the order they were found.
+    """
+    return ordered_map(
+        run_blueprint, find_blueprints(paths, pattern=pattern),
+        processes=processes, properties=properties, **options)
+
+
+def _json_default(value):
+    if isinstance(value, Fraction):
+        return float(value)
+    raise TypeError(
+        f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def to_json(record):
+    return json.dumps(record, default=_json_default)
@@ -0,0 +1,96 @@
+from py_factorio_blueprints.util import decode
+from factorio_balancers.balancer import Balancer
+from factorio_balancers.batch import ordered_map, run_balancer
+
+
+def _copy(data):
+    # Blueprint.load removes keys from the blueprint it is given, so every
+    # balancer gets its own copy and the decoded book stays unchanged
+    return dict(data, blueprint=dict(data['blueprint']))
+
+
+def _entries(data, path):
+    if 'blueprint_book' in data:
+        entries = data['blueprint_book'].get('blueprints', [])
+        for i, entry in enumerate(entries):
+            yield from _entries(entry, path + (entry.get('index', i),))
+    elif 'blueprint' in data:
+        yield path, data
+    # Other items in a book, like upgrade planners, are not balancers
+
+
+class BookEntry:
+    """
+    A blueprint in a blueprint book, with the indices of the books leading
+    to it as its `path`.
+    """
+    def __init__(self, path, data):
+        self.path = path
+        self.data = data
+
+    def __repr__(self):
+        return f"<BookEntry {self.path} {self.label!r}>"
+
+    @property
+    def label(self):
+        return self.data['blueprint'].get('label')
+
+    def balancer(self, **kwargs):
+        return Balancer(data=_copy(self.data), **kwargs)
+
+
+def _run_entry(entry, properties, **options):
+    path, data = entry
+    record = {
+        'entry': list(path),
+        'label': data['blueprint'].get('label'),
+    }
+    return run_balancer(record, properties, data=_copy(data), **options)
+
+
+class BalancerBook:
+    """
+    The blueprints in a blueprint book, including those in nested books.
+    The exchange string is only decoded once, and a Balancer is only built
+    for an entry when it is needed. A single blueprint is read as a book
+    with one entry.
+    """
+    def __init__(self, string=None, data=None):
+        if string is not None:
+            data = decode(string)
+        self.data = data
+
+    @property
+    def is_book(self):
+        return 'blueprint_book' in self.data
+
+    @property
+    def label(self):
+        return self.data.get('blueprint_book', {}).get('label')
+
+    def __iter__(self):
+        for path, data in _entries(self.data, ()):
+            yield BookEntry(path, data)
+
+    def __len__(self):
+        return sum(1 for _ in _entries(self.data, ()))
+
+    def balancers(self, compiled=False, **kwargs):
+        """
+        Yields the Balancer of every entry, or its CompiledBalancer when
+        `compiled` is set, so the blueprint can be freed right away.
+        """
+        for entry in self:
+            balancer = entry.balancer(**kwargs)
+            yield balancer.compile() if compiled else balancer
+
+    def test(self, properties, processes=None, **options):
+        """
+        Tests every entry for the given properties, on `processes`
+        processes, and yields a dict for each of them in order, with its
+        path and label, and its results or the error that prevented testing
+        it. Takes the same options as `factorio_balancers.batch.run_batch`.
+        """
+        return ordered_map(
+            _run_entry, _entries(self.data, ()), processes=processes,
+            properties=properties, **options)
@@ -0,0 +1,323 @@
+import copy
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+from collections import OrderedDict
+from factorio_balancers.compiled import CompiledBalancer
+from factorio_balancers.prototypes import DATA_FILE, prototype_data_digest
+from factorio_balancers.utils import timed
+
+
+logger = logging.getLogger("factorio_balancers.cache")
+
+# Bump this whenever the simulation graph built from a blueprint changes, so
+# graphs built by older versions are no longer used
+FORMAT = 1
+
+
+def _package_version():
+    """
+    The installed version of this package, followed by a hash of its
+    sources, so it also changes for a checkout or editable install whose
+    code changed without a new version.
+    """
+    try:
+        from importlib.metadata import version, PackageNotFoundError
+        try:
+            installed = version('factorio_balancers')
+        except PackageNotFoundError:
+            installed = 'unknown'
+    except ImportError:
+        installed = 'unknown'
+    sources = hashlib.sha256()
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for name in sorted(os.listdir(directory)):
+        if name.endswith('.py'):
+            sources.update(name.encode())
+            with open(os.path.join(directory, name), 'rb') as f:
+                sources.update(f.read())
+    return f"{installed}+{sources.hexdigest()[:16]}"
+
+
+VERSION = _package_version()
+
+
+def package_version():
+    return VERSION
+
+
+class DirectoryCache:
+    """
+    Pickled entries in a directory, one file per key. When the files take
+    up more than `max_size` bytes, the least recently used ones are removed.
+    The size of the files is kept as a running total, and the directory is
+    only scanned when that goes over `max_size`. Other processes sharing the
+    directory aren't counted until then.
+    """
+    suffix = '.pickle'
+
+    def __init__(self, directory, max_size=64 * 2**20, suffix=None):
+        if suffix is not None:
+            self.suffix = suffix
+        self.directory = directory
+        self.max_size = max_size
+        self._size = None
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}{self.suffix}")
+
+    def read(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, pickle.UnpicklingError, EOFError):
+            logger.warning(f"Removing unreadable cache entry {path}")
+            self._remove(path)
+            return None
+        # Marks the entry as recently used
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            # Evicted by another process in the meantime
+            pass
+        return value
+
+    def write(self, key, value):
+        # Written to a temporary file first, so processes sharing the cache
+        # never read a partial entry
+        path = self._path(key)
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(value, f, pickle.HIGHEST_PROTOCOL)
+                size = f.tell()
+            try:
+                size -= os.stat(path).st_size
+            except FileNotFoundError:
+                pass
+            os.replace(tmp, path)
+        except BaseException:
+            self._remove(tmp)
+            raise
+        if self._size is None:
+            self._size = self.size()
+        else:
+            self._size += size
+        if self._size > self.max_size:
+            self._evict()
+
+    def discard(self, key):
+        self._remove(self._path(key))
+
+    def entries(self):
+        """
+        The (modification time, size, path) of all entries, from least to
+        most recently used.
+        """
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(self.suffix):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+        entries.sort()
+        return entries
+
+    def size(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def _evict(self):
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_size:
+                break
+            self._remove(path)
+            total -= size
+        self._size = total
+
+    def _remove(self, path):
+        try:
+            size = os.stat(path).st_size
+            os.remove(path)
+        except FileNotFoundError:
+            return
+        if self._size is not None and path.endswith(self.suffix):
+            self._size -= size
+
+    def clear(self):
+        for _, _, path in self.entries():
+            self._remove(path)
+        self._size = 0
+
+
+class GraphCache(DirectoryCache):
+    """
+    A cache of compiled balancers in a directory, one file per blueprint
+    string. Entries are keyed by a hash of the blueprint string, the version
+    of this package and the prototype data it was built with.
+
+    Pass it to `Balancer(string=..., cache=cache)` to skip decoding the
+    blueprint and building the simulation graph, or use `load` to get a
+    compiled balancer.
+    """
+    suffix = '.graph'
+
+    def key(self, string, prototype_data_file=DATA_FILE):
+        key = hashlib.sha256()
+        for part in (
+                str(FORMAT), package_version(),
+                prototype_data_digest(prototype_data_file), string.strip()):
+            key.update(part.encode())
+            key.update(b'\0')
+        return key.hexdigest()
+
+    def get(self, string, engine='object', order=None,
+            prototype_data_file=DATA_FILE):
+        """
+        The compiled balancer of a blueprint string, or None when it isn't
+        in the cache.
+        """
+        state = self.read(self.key(string, prototype_data_file))
+        if state is None:
+            return None
+        state['engine'] = engine
+        state['order'] = order
+        return CompiledBalancer.from_state(state)
+
+    def put(self, string, balancer, prototype_data_file=DATA_FILE):
+        """
+        Stores the simulation graph of a balancer (or compiled balancer)
+        built from a blueprint string.
+        """
+        self.write(
+            self.key(string, prototype_data_file), balancer._graph_state())
+
+    def load(self, string, engine='object', order=None, data=None,
+             stats=False, **kwargs):
+        """
+        The compiled balancer of a blueprint string. On a miss the balancer
+        is built, from the decoded `data` of the string when it is given,
+        and stored. Other keyword arguments are passed to the Balancer.
+        With `stats`, the phases of loading or building it are stored in
+        its `construction_stats`.
+        """
+        from factorio_balancers.balancer import Balancer
+        phases = {} if stats else None
+        with timed(phases, 'cache'):
+            compiled = self.get(
+                string, engine, order, Balancer.prototype_data_file)
+        if compiled is None:
+            if data is None:
+                kwargs['string'] = string
+            else:
+                kwargs['data'] = data
+            balancer = Balancer(
+                engine=engine, order=order, stats=stats, **kwargs)
+            self.put(string, balancer, Balancer.prototype_data_file)
+            compiled = balancer.compile()
+            if stats:
+                phases.update(balancer.construction_stats)
+        compiled.construction_stats = phases
+        return compiled
+
+
+class ResultCache:
+    """
+    A cache of the results of `Balancer.test`, per property. Entries are
+    keyed by the hash of the simulation graph, the property and the
+    parameters that change its result, and kept in memory for the
+    `max_entries` most recently used ones. When `directory` is given,
+    they are stored there as well.
+
+    Every entry records the package version and engine that computed it.
+    Entries of a different package version are never used, and
+    `invalidate` removes entries by engine or version.
+    """
+    def __init__(self, directory=None, max_entries=1024, max_size=64 * 2**20):
+        self.max_entries = max_entries
+        self.memory = OrderedDict()
+        self.disk = None
+        if directory is not None:
+            self.disk = DirectoryCache(
+                directory, max_size=max_size, suffix='.result')
+
+    def key(self, graph_hash, property, **parameters):
+        key = hashlib.sha256()
+        key.update(f"{FORMAT}\0{graph_hash}\0{property}".encode())
+        for name, value in sorted(parameters.items()):
+            key.update(f"\0{name}={value!r}".encode())
+        return key.hexdigest()
+
+    def entry(self, key):
+        """
+        The entry stored under `key`: a dict with the `result`, and the
+        `version` and `engine` that computed it. None when there is no
+        usable entry.
+        """
+        entry = self.memory.get(key)
+        if entry is None and self.disk is not None:
+            entry = self.disk.read(key)
+        if entry is None:
+            return None
+        if entry['version'] != package_version():
+            self.discard(key)
+            return None
+        self._remember(key, entry)
+        return entry
+
+    def get(self, key):
+        entry = self.entry(key)
+        return None if entry is None else copy.deepcopy(entry['result'])
+
+    def put(self, key, result, engine):
+        entry = {
+            'result': copy.deepcopy(result),
+            'version': package_version(),
+            'engine': engine,
+        }
+        self._remember(key, entry)
+        if self.disk is not None:
+            self.disk.write(key, entry)
+
+    def _remember(self, key, entry):
+        self.memory[key] = entry
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+
+    def discard(self, key):
+        self.memory.pop(key, None)
+        if self.disk is not None:
+            self.disk.discard(key)
+
+    def invalidate(self, engine=None, version=None):
+        """
+        Removes the entries computed by `engine`, or by package `version`.
+        """
+        def matches(entry):
+            return (engine is not None and entry['engine'] == engine) \
+                or (version is not None and entry['version'] == version)
+
+        for key, entry in list(self.memory.items()):
+            if matches(entry):
+                del self.memory[key]
+        if self.disk is not None:
+            for _, _, path in self.disk.entries():
+                key = os.path.basename(path)[:-len(self.disk.suffix)]
+                entry = self.disk.read(key)
+                if entry is not None and matches(entry):
+                    self.disk.discard(key)
+
+    def clear(self):
+        self.memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
@@ -0,0 +1,935 @@
+import hashlib
+import logging
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from functools import wraps
+from itertools import combinations
+from progress.bar import Bar
+from fractions import Fraction
+from factorio_balancers.utils import (
+    chunked, get_nr_of_permutations, revolving_door, timed)
+from factorio_balancers.graph import Splitter, Belt
+from factorio_balancers.engines import get_engine
+from factorio_balancers.solver import LinearSolver, MaxFlowSolver
+from factorio_balancers.symmetry import ColoredGraph, Symmetries
+from factorio_balancers.exceptions import *
+
+
+logger = logging.getLogger("factorio_balancers.compiled")
+
+
+class MyBar(Bar):
+    def finish(self, clear=True):
+        if clear:
+            self.clearln()
+            print('\x1b[?25h', end='')
+        else:
+            super().finish()
+
+    @property
+    def eta_display(self):
+        return str(self.eta_td)
+
+
+class OptionalBar:
+    def __init__(self, *args, verbose, **kwargs):
+        self.verbose = verbose
+        if kwargs.get('suffix', None) is None:
+            kwargs['suffix'] = '%(percent)d%% - %(eta_display)s'
+        if self.verbose:
+            self.bar = MyBar(*args, **kwargs)
+
+    def finish(self, *args, **kwargs):
+        if self.verbose:
+            self.bar.finish(*args, **kwargs)
+
+    def next(self, *args, **kwargs):
+        if self.verbose:
+            self.bar.next(*args, **kwargs)
+
+
+def verified(test):
+    """
+    Lets a test method run on a different engine for a single call, and
+    re-runs it on the exact 'object' engine when an inexact engine reports
+    a decision that landed too close to its threshold.
+    """
+    @wraps(test)
+    def wrapper(self, *args, engine=None, margin=None, **kwargs):
+        with self.using_engine(engine, margin=margin) as simulation:
+            borderline = simulation.borderline
+            simulation.borderline = False
+            result = test(self, *args, **kwargs)
+            verify = simulation.borderline
+            simulation.borderline = borderline
+        if not verify:
+            return result
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                f"Borderline result for {test.__name__} using the "
+                f"{simulation.name} engine, verifying with exact fractions")
+        if self._trace is not None:
+            self._emit(
+                'borderline', test=test.__name__, engine=simulation.name)
+        with self.using_engine('object'):
+            return test(self, *args, **kwargs)
+    return wrapper
+
+
+_worker_balancer = None
+
+
+def _init_sweep_worker(compiled, margin):
+    global _worker_balancer
+    _worker_balancer = compiled
+    _worker_balancer._engine.margin = margin
+
+
+def _sweep_chunk(chunk, warm_start):
+    before = _worker_balancer.counters()
+    results = _worker_balancer._sweep(chunk, warm_start)
+    after = _worker_balancer.counters()
+    return results, (
+        after['cycles'] - before['cycles'],
+        after['iterations'] - before['iterations'])
+
+
+def uses_solver(solver, name):
+    if isinstance(solver, (list, tuple, set)):
+        return name in solver
+    return solver == name
+
+
+def solver_parameters(solver, name):
+    """
+    The ResultCache parameters of a property that is solved using the
+    solver `name` when it is given.
+    """
+    return {'solver': name} if uses_solver(solver, name) else {}
+
+
+class Simulation:
+    """
+    The tests that run on the simulation graph of a balancer, shared by
+    Balancer and CompiledBalancer.
+    """
+    _trace = None
+    # The wall and CPU time of every phase of building the balancer, when
+    # it was built with `stats=True`
+    construction_stats = None
+
+    def _load_graph(self, splitters, belts, input_belts, output_belts):
+        self._engines = {}
+        self._solvers = {}
+        self._symmetries = None
+        self._graph_hash = None
+        self._fingerprint = None
+        # What sweep workers ran, and the combinations sweeps tested
+        self._counters = {'cycles': 0, 'iterations': 0, 'combinations': 0}
+        self._splitters = splitters
+        self._belts = belts
+        self._input_belts = input_belts
+        self._output_belts = output_belts
+        self.nr_inputs_sim = len(input_belts)
+        self.nr_outputs_sim = len(output_belts)
+        self.set_engine(self._engine_name)
+
+    def _graph_state(self):
+        """
+        The simulation graph as flat lists. Every belt is described by its
+        capacity and the indices of its splitter and of the belt it leads
+        to, -1 when there is none. The first `nr_belts` belts are the ones
+        that transfer items.
+        """
+        index = {}
+        belts = []
+
+        def add(belt):
+            if belt is None:
+                return -1
+            if id(belt) not in index:
+                index[id(belt)] = len(belts)
+                belts.append(belt)
+            return index[id(belt)]
+
+        for belt in self._belts:
+            add(belt)
+        slots = [
+            (add(splitter.input_left), add(splitter.input_right),
+             add(splitter.output_left), add(splitter.output_right))
+            for splitter in self._splitters]
+        inputs = [add(belt) for belt in self._input_belts]
+        outputs = [add(belt) for belt in self._output_belts]
+        nodes = {
+            id(splitter): i for i, splitter in enumerate(self._splitters)}
+        return {
+            'splitters': [
+                (splitter.input_priority, splitter.output_priority)
+                for splitter in self._splitters],
+            'slots': slots,
+            'belts': [
+                (belt.capacity,
+                 nodes.get(id(belt.node), -1),
+                 index[id(belt.next)] if belt.next is not None else -1)
+                for belt in belts],
+            'nr_belts': len(self._belts),
+            'inputs': inputs,
+            'outputs': outputs,
+            'has_sideloads': self.has_sideloads,
+            'nr_inputs': self.nr_inputs,
+            'nr_outputs': self.nr_outputs,
+            'engine': self._engine_name,
+            'order': self._order,
+        }
+
+    def graph_hash(self):
+        """
+        A hash of the simulation graph, the same for every balancer built
+        from the same blueprint.
+        """
+        if self._graph_hash is None:
+            state = self._graph_state()
+            del state['engine'], state['order']
+            self._graph_hash = hashlib.sha256(
+                repr(sorted(state.items())).encode()).hexdigest()
+        return self._graph_hash
+
+    def fingerprint(self):
+        """
+        A hash of the simulation graph that doesn't depend on the layout of
+        the balancer. Balancers whose splitters, belt capacities and
+        priorities are connected the same way get the same fingerprint,
+        whatever the order of their inputs, outputs and splitters, and
+        whether they are mirrored.
+        """
+        if self._fingerprint is None:
+            form = ColoredGraph(
+                self._splitters, self._input_belts,
+                self._output_belts).canonical_form()
+            self._fingerprint = hashlib.sha256(
+                repr((self.has_sideloads, form)).encode()).hexdigest()
+        return self._fingerprint
+
+    def compile(self):
+        """
+        A CompiledBalancer with a copy of the simulation graph, that doesn't
+        refer to any of the entities it was built from.
+        """
+        return CompiledBalancer.from_state(self._graph_state())
+
+    def _emit(self, event, **fields):
+        """
+        Passes a diagnostic event to the trace callback, if there is one.
+        Callers check `self._trace` first, so the fields are only computed
+        when someone is listening.
+        """
+        if self._trace is not None:
+            self._trace({'event': event, **fields})
+
+    def set_engine(self, name):
+        """
+        Select the engine that runs the simulation. The 'object' engine
+        works directly on the graph objects using exact fractions, the
+        'float' engine does the same using floats, and the 'numpy' engine
+        compiles them into flat arrays of floats first. The 'dyadic' engine
+        uses exact integers, and the 'worklist' engine does the same while
+        only running the splitters and belts whose contents changed.
+        """
+        if name not in self._engines:
+            self._engines[name] = get_engine(name)(
+                self._splitters, self._belts,
+                self._input_belts, self._output_belts)
+        self._engine_name = name
+        self._engine = self._engines[name]
+        self._engine.order = self._order
+        self._engine.activate()
+
+    @property
+    def engine(self):
+        return self._engine.name
+
+    @contextmanager
+    def using_engine(self, name=None, margin=None):
+        previous = self._engine_name
+        if name is not None and name != previous:
+            self.set_engine(name)
+        if margin is not None:
+            previous_margin = self._engine.margin
+            self._engine.margin = margin
+        try:
+            yield self._engine
+        finally:
+            if margin is not None:
+                self._engine.margin = previous_margin
+            if self._engine_name != previous:
+                self.set_engine(previous)
+
+    def set_order(self, order):
+        """
+        The order in which a cycle runs the splitters: None runs them all at
+        the same time, 'flow' runs them in the order items flow through the
+        balancer and 'reverse' runs them against it. See ObjectEngine.
+        """
+        self._order = self._engine.order = order
+
+    @contextmanager
+    def in_lockstep(self):
+        """
+        Balance is tested by comparing exact amounts, and in a loop the
+        outputs only end up exactly equal when symmetric splitters are run
+        at the same time. So balance tests always run in lockstep.
+        """
+        previous = self._order
+        self.set_order(None)
+        try:
+            yield
+        finally:
+            self.set_order(previous)
+
+    def cycle(self):
+        self._engine.cycle()
+
+    def settle(self, max_cycles=None):
+        """
+        Cycles until none of the belts change anymore. The 'worklist' engine
+        only runs the parts of the balancer that are still moving.
+        """
+        return self._engine.settle(max_cycles)
+
+    def counters(self):
+        """
+        The number of cycles and splitter iterations run by all engines of
+        the balancer so far, including those run by sweep workers, and the
+        number of combinations tested by throughput sweeps.
+        """
+        counters = dict(self._counters)
+        for engine in self._engines.values():
+            counters['cycles'] += engine.cycles
+            counters['iterations'] += engine.iterations
+        return counters
+
+    def clear(self):
+        return self._engine.clear()
+
+    def fill(self):
+        return self._engine.fill()
+
+    def supply(self, *args, **kwargs):
+        return [
+            self._engine.supply(belt, *args, **kwargs)
+            for belt in self._input_belts]
+
+    def drain(self, **kwargs):
+        return [
+            self._engine.drain(belt, **kwargs)
+            for belt in self._output_belts]
+
+    def get_solver(self, solver_class):
+        if solver_class not in self._solvers:
+            try:
+                self._solvers[solver_class] = solver_class(
+                    self._splitters, self._input_belts, self._output_belts)
+            except NonLinearNetwork as e:
+                self._solvers[solver_class] = e
+        solver = self._solvers[solver_class]
+        if isinstance(solver, NonLinearNetwork):
+            raise solver
+        return solver
+
+    def linear_solver(self):
+        return self.get_solver(LinearSolver)
+
+    def max_flow_solver(self):
+        return self.get_solver(MaxFlowSolver)
+
+    def min_cut(self, inputs=None, outputs=None):
+        """
+        The belts that limit the throughput from the given inputs to the
+        given outputs the most.
+        """
+        _, cut = self.max_flow_solver().solve(
+            *self._belt_indices(inputs, outputs))
+        return cut
+
+    def symmetries(self):
+        """
+        The permutations of the inputs and outputs that map the balancer
+        onto itself.
+        """
+        if self._symmetries is None:
+            self._symmetries = Symmetries(
+                self._splitters, self._input_belts, self._output_belts)
+        return self._symmetries
+
+    def _belt_indices(self, inputs=None, outputs=None):
+        if inputs is None:
+            inputs = self._input_belts
+        if outputs is None:
+            outputs = self._output_belts
+        return (
+            [self._input_belts.index(belt) for belt in inputs],
+            [self._output_belts.index(belt) for belt in outputs])
+
+    def transfer_matrix(self):
+        """
+        The fraction of every input that ends up at every output, as long as
+        none of the belts get saturated.
+        """
+        return self.linear_solver().transfer_matrix()
+
+    def _linear_output_balance(self, trickle=False):
+        solver = self.linear_solver()
+        amount = Fraction(1, 4) if trickle else None
+        supplies = [
+            belt.capacity if amount is None or amount > belt.capacity
+            else amount
+            for belt in self._input_belts]
+        scenarios = []
+        for i in range(len(supplies)):
+            scenario = [0] * len(supplies)
+            scenario[i] = supplies[i]
+            scenarios.append(scenario)
+        scenarios.append(supplies)
+
+        for scenario in scenarios:
+            if len(set(solver.output_flows(scenario))) > 1:
+                return False
+        return True
+
+    @verified
+    def test_output_balance(
+            self, verbose=False, trickle=False, debug=False, solver=None,
+            **kwargs):
+        if uses_solver(solver, 'linear'):
+            try:
+                return self._linear_output_balance(trickle=trickle)
+            except NonLinearNetwork as e:
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug(
+                        f"Falling back to simulation for output balance: {e}")
+
+        with self.in_lockstep():
+            return self._output_balance(verbose, trickle)
+
+    def _output_balance(self, verbose=False, trickle=False):
+        bar = OptionalBar(
+            '   -- Progress',
+            verbose=verbose,
+            max=len(self._input_belts) + 1)
+
+        amount = Fraction(1, 4) if trickle else None
+        for input in self._input_belts:
+            self.clear()
+            drained = self.drain()
+            supplied = self._engine.supply(input, amount)
+            while not self._engine.is_close(sum(drained), supplied):
+                self.cycle()
+                drained = self.drain()
+                supplied = self._engine.supply(input, amount)
+
+            if not self._engine.all_equal(drained):
+                bar.finish()
+                return False
+            bar.next()
+
+        self.clear()
+        drained = self.drain()
+        supplied = self.supply(amount)
+        while not self._engine.is_close(sum(drained), sum(supplied)):
+            self.cycle()
+            drained = self.drain()
+            supplied = self.supply(amount)
+        bar.finish()
+        if not self._engine.all_equal(drained):
+            return False
+        return True
+
+    @verified
+    def test_input_balance(self, verbose=False, trickle=False, **kwargs):
+        with self.in_lockstep():
+            return self._input_balance(verbose, trickle)
+
+    def _input_balance(self, verbose=False, trickle=False):
+        bar = OptionalBar(
+            '   -- Progress',
+            verbose=verbose,
+            max=len(self._output_belts) + 1)
+
+        amount = Fraction(1, 4) if trickle else None
+        for output in self._output_belts:
+            self.fill()
+            drained = self._engine.drain(output, amount)
+            supplied = self.supply()
+            while not self._engine.is_close(drained, sum(supplied)):
+                self.cycle()
+                drained = self._engine.drain(output, amount)
+                supplied = self.supply()
+
+            if not self._engine.all_equal(supplied):
+                bar.finish()
+                return False
+            bar.next()
+
+        self.fill()
+        drained = self.drain(amount=amount)
+        supplied = self.supply()
+        while not self._engine.is_close(sum(drained), sum(supplied)):
+            self.cycle()
+            drained = self.drain(amount=amount)
+            supplied = self.supply()
+        bar.finish()
+        if not self._engine.all_equal(supplied):
+            return False
+        return True
+
+    @verified
+    def test_throughput(
+            self, inputs=None, outputs=None, verbose=False, clear=True,
+            **kwargs):
+        """
+        Supplies the inputs and drains the outputs until the throughput is
+        stable. Returns whether everything that is supplied gets drained (or
+        all outputs are full), and the percentage of the worst output.
+
+        With `clear=False` the simulation starts from the current contents
+        of the belts instead of empty belts. Items left over from before can
+        keep the throughput looking stable while parts of the balancer are
+        still filling up or emptying, so the contents of the belts have to
+        settle as well.
+
+        Use `min_cut` to find the belts that limit the throughput.
+        """
+        if inputs is None:
+            inputs = self._input_belts
+        if outputs is None:
+            outputs = self._output_belts
+
+        def drain(a):
+            return [self._engine.drain(b) for b in a]
+
+        def supply(a):
+            return [self._engine.supply(b) for b in a]
+
+        if clear:
+            self.clear()
+        drained = drain(outputs)
+        supplied = supply(inputs)
+        if clear:
+            clean_input = supplied
+        else:
+            clean_input = [
+                self._engine.number(belt.capacity) for belt in inputs]
+        previous = None
+        while True:
+            if self._engine.is_close(sum(drained), sum(supplied)) and (
+                    clear or previous is not None and
+                    self._engine.change(previous) <= 1e-6):
+                break
+            if not clear:
+                previous = self._engine.snapshot()
+            drained = drain(outputs)
+            self.cycle()
+            supplied = supply(inputs)
+
+        worst_percentage = 100.0
+        for output in outputs:
+            percentage = self._engine.percentage(output)
+            if not self._engine.is_close(worst_percentage, percentage) and \
+                    percentage < worst_percentage:
+                worst_percentage = percentage
+        drained = drain(outputs)
+
+        if self._engine.is_close(sum(clean_input), sum(drained)):
+            return True, worst_percentage
+        if not self._engine.is_close(worst_percentage, 100.0):
+            return False, worst_percentage
+        return True, worst_percentage
+
+    def throughput_sweep(
+            self, extensive=False, verbose=False, workers=None,
+            chunk_size=None, symmetry=False, warm_start=False, **kwargs):
+        """
+        Tests the throughput of every combination of the same number of
+        inputs and outputs: 1 or 2 of them, or any number when `extensive`.
+        With `workers` the combinations are divided into chunks of
+        `chunk_size` and tested on a pool of that many processes.
+        With `symmetry` only one combination is tested out of every set of
+        combinations that are mapped onto each other by a symmetry of the
+        balancer. The number of skipped combinations is stored in
+        `self.skipped_combinations`.
+        With `warm_start` the combinations are ordered so that consecutive
+        ones differ by a single input or output, and every combination
+        starts from the belt contents of the previous one. Splitters with an
+        output priority can settle into a different repeating pattern when
+        they don't start out empty, so those balancers always start from
+        empty belts.
+        """
+        if extensive:
+            max_nr = min(len(self._input_belts), len(self._output_belts))
+            nr_of_permutations = get_nr_of_permutations(
+                len(self._input_belts),
+                len(self._output_belts),
+                len(self._input_belts))
+        else:
+            max_nr = 2
+            nr_of_permutations = get_nr_of_permutations(
+                len(self._input_belts),
+                len(self._output_belts),
+                2)
+        bar = OptionalBar(
+            '   -- Progress', verbose=verbose, max=nr_of_permutations)
+
+        if warm_start and any(
+                splitter.output_priority for splitter in self._splitters):
+            logger.debug(
+                "Not warm starting the sweep, the balancer uses output "
+                "priorities")
+            warm_start = False
+        self.skipped_combinations = 0
+        combos = self._sweep_combinations(max_nr, ordered=warm_start)
+        if symmetry:
+            combos = self._unique_combinations(combos, bar)
+        if workers is not None and workers > 1:
+            results = self._parallel_sweep(
+                combos, bar, workers,
+                chunk_size or max(1, nr_of_permutations // (workers * 16)),
+                warm_start)
+        else:
+            results = self._sweep(combos, warm_start, bar)
+        self._counters['combinations'] += len(results)
+        bar.finish()
+        if symmetry:
+            logger.info(
+                f"   -- Skipped {self.skipped_combinations} of "
+                f"{nr_of_permutations} combinations using "
+                f"{len(self.symmetries())} symmetries")
+        return results
+
+    def _unique_combinations(self, combos, bar):
+        symmetries = self.symmetries()
+        for inputs, outputs in combos:
+            if symmetries.is_representative(inputs, outputs):
+                yield inputs, outputs
+            else:
+                self.skipped_combinations += 1
+                bar.next()
+
+    def _sweep(self, combos, warm_start=False, bar=None):
+        results = []
+        state = None
+        for inputs, outputs in combos:
+            if state is not None:
+                self._engine.restore(state)
+            results.append(
+                self.test_throughput(
+                    inputs=[self._input_belts[i] for i in inputs],
+                    outputs=[self._output_belts[i] for i in outputs],
+                    clear=state is None))
+            if warm_start:
+                state = self._engine.snapshot()
+            if bar is not None:
+                bar.next()
+        return results
+
+    def _sweep_combinations(self, max_nr, ordered=False):
+        """
+        With `ordered`, the combinations of every size are listed in
+        revolving door order, going back and forth through the outputs, so
+        consecutive combinations differ by a single input or output.
+        """
+        nr_inputs = len(self._input_belts)
+        nr_outputs = len(self._output_belts)
+        for i in range(1, max_nr + 1):
+            if not ordered:
+                for inputs in combinations(range(nr_inputs), i):
+                    for outputs in combinations(range(nr_outputs), i):
+                        yield inputs, outputs
+                continue
+            outputs_order = list(revolving_door(nr_outputs, i))
+            for inputs in revolving_door(nr_inputs, i):
+                for outputs in outputs_order:
+                    yield inputs, outputs
+                outputs_order.reverse()
+
+    def _parallel_sweep(
+            self, combos, bar, workers, chunk_size, warm_start):
+        results = []
+        with ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=_init_sweep_worker,
+                initargs=(self.compile(), self._engine.margin)) as executor:
+            # Only keep a few chunks per worker in flight, so the
+            # combinations are never all in memory at once.
+            pending = deque()
+            for chunk in chunked(combos, chunk_size):
+                pending.append(
+                    (len(chunk), executor.submit(
+                        _sweep_chunk, chunk, warm_start)))
+                if len(pending) >= workers * 4:
+                    size, future = pending.popleft()
+                    self._add_chunk(results, *future.result())
+                    bar.next(size)
+            for size, future in pending:
+                self._add_chunk(results, *future.result())
+                bar.next(size)
+        return results
+
+    def _add_chunk(self, results, chunk_results, counters):
+        results.extend(chunk_results)
+        cycles, iterations = counters
+        self._counters['cycles'] += cycles
+        self._counters['iterations'] += iterations
+
+    @verified
+    def test_throughput_unlimited(self, **kwargs):
+        results = self.throughput_sweep(**kwargs)
+        limited = False
+        worst = 100.0
+        for unlimited, percentage in results:
+            if not unlimited:
+                limited = True
+                if not self._engine.is_close(worst, percentage) and \
+                        percentage < worst:
+                    worst = percentage
+
+        return not limited, worst
+
+    def test(self, properties=None, verbose=False, engine=None, margin=None,
+             solver=None, workers=None, symmetry=False, warm_start=False,
+             cache=None, stats=False):
+        """
+        Test the balancer for the given properties. When `engine` is given,
+        the properties are tested using that engine instead of the current
+        one. Results of inexact engines that land within `margin` of a
+        decision threshold are verified using exact fractions.
+        With `solver='linear'` output balance is solved as a linear system
+        whenever possible.
+        Throughput sweeps are run on `workers` processes, and skip
+        combinations that are symmetric to one already tested when
+        `symmetry` is set. With `warm_start` every combination in a sweep
+        starts from the belt contents of the previous one.
+        Results are looked up in and stored to a ResultCache `cache`.
+        With `stats`, every result gets a `stats` dict with the wall and CPU
+        time it took, the cycles and splitter iterations it ran, the
+        combinations it tested and whether it was `cached`. When the
+        balancer was built with `stats=True`, the time of every phase of
+        building it is added to the 'lane_balancer' result.
+        """
+        with self.using_engine(engine, margin=margin):
+            return self._test(
+                properties=properties, verbose=verbose, solver=solver,
+                workers=workers, symmetry=symmetry, warm_start=warm_start,
+                cache=cache, stats=stats)
+
+    def _cached(self, cache, stats, property, compute, **parameters):
+        timings = {} if stats else None
+        before = self.counters() if stats else None
+        cached = False
+        with timed(timings, property):
+            if cache is None:
+                result = compute()
+            else:
+                key = cache.key(self.graph_hash(), property, **parameters)
+                result = cache.get(key)
+                if result is None:
+                    result = compute()
+                    cache.put(key, result, engine=self._engine_name)
+                else:
+                    cached = True
+                    logger.info(f"  Using the cached result of {property}.")
+        if stats:
+            after = self.counters()
+            result['stats'] = dict(
+                timings[property], cached=cached,
+                **{name: after[name] - before[name] for name in after})
+        return result
+
+    def _test(self, properties=None, verbose=False, solver=None,
+              workers=None, symmetry=False, warm_start=False, cache=None,
+              stats=False):
+        if properties is None:
+            properties = []
+
+        self.clear()
+        is_lane_balancer = self.has_sideloads
+        logger.info(
+            f"Testing a {len(self._input_belts)} - "
+            f"{len(self._output_belts)} "
+            f"{'lane ' if is_lane_balancer else ''}balancer.")
+
+        results = {
+            "lane_balancer": {
+                "result": is_lane_balancer,
+            }
+        }
+        if stats and self.construction_stats is not None:
+            results['lane_balancer']['stats'] = {
+                'phases': dict(self.construction_stats)}
+
+        if 'balance.output' in properties:
+            logger.info("  Testing balance.")
+            results['balance.output'] = self._cached(
+                cache, stats, 'balance.output', lambda: {
+                    "result": self.test_output_balance(
+                        verbose=verbose, solver=solver),
+                }, **solver_parameters(solver, 'linear'))
+            output_balanced = results['balance.output']['result']
+            logger.info(
+                f"   -- Output is {'' if output_balanced else 'NOT '}balanced.")
+
+        if 'balance.input' in properties:
+            results['balance.input'] = self._cached(
+                cache, stats, 'balance.input', lambda: {
+                    "result": self.test_input_balance(verbose=verbose),
+                })
+            input_balanced = results['balance.input']['result']
+            logger.info(
+                f"   -- Input is {'' if input_balanced else 'NOT '}balanced.")
+
+        if 'balance.output.trickle' in properties:
+            logger.info("  Testing balance using trickle.")
+            results['balance.output.trickle'] = self._cached(
+                cache, stats, 'balance.output.trickle', lambda: {
+                    "result": self.test_output_balance(
+                        verbose=verbose, trickle=True, solver=solver),
+                }, **solver_parameters(solver, 'linear'))
+            output_balanced = results['balance.output.trickle']['result']
+            logger.info(
+                f"   -- Output is {'' if output_balanced else 'NOT '}"
+                f"balanced with a trickle.")
+        if 'balance.input.trickle' in properties:
+            results['balance.input.trickle'] = self._cached(
+                cache, stats, 'balance.input.trickle', lambda: {
+                    "result": self.test_input_balance(
+                        verbose=verbose, trickle=True),
+                })
+            input_balanced = results['balance.input.trickle']['result']
+            logger.info(
+                f"   -- Input is {'' if input_balanced else 'NOT '}"
+                f"balanced with a trickle.")
+
+        if 'throughput.full' in properties:
+            logger.info("  Testing regular throughput.")
+            results['throughput.full'] = self._cached(
+                cache, stats, 'throughput.full',
+                lambda: self._throughput_full(verbose))
+            if results['throughput.full']['result']:
+                logger.info("   -- Full throughput on regular use")
+            else:
+                logger.info(
+                    f"   -- Limited throughput to "
+                    f"{results['throughput.full']['message']} on "
+                    f"regular use on at least one of the outputs.")
+
+        if 'throughput.unlimited.candidate' in properties \
+                or 'throughput.unlimited' in properties:
+            extensive = 'throughput.unlimited' in properties
+            logger.info(
+                f"  {'Extensive' if extensive else 'Regular'} "
+                f"throughput sweep")
+            field = 'throughput.unlimited' if extensive \
+                else 'throughput.unlimited.candidate'
+            results[field] = self._cached(
+                cache, stats, field, lambda: self._throughput_unlimited(
+                    extensive, verbose, workers, symmetry,
+                    warm_start),
+                symmetry=symmetry, warm_start=warm_start)
+
+            if not results[field]['result']:
+                logger.info(
+                    f"   -- At least one bottleneck exists that "
+                    f"limits throughput to {results[field]['message']}%.")
+            else:
+                logger.info(
+                    f"   -- No bottlenecks with any combinations of"
+                    f" {'any number of' if extensive else '1 or 2'} "
+                    f"inputs and outputs.")
+        return results
+
+    def _throughput_full(self, verbose):
+        full_throughput, worst = self.test_throughput(verbose=verbose)
+        result = {
+            "result": full_throughput,
+        }
+        if not full_throughput:
+            result['message'] = worst
+        return result
+
+    def _throughput_unlimited(
+            self, extensive, verbose, workers, symmetry, warm_start):
+        unlimited, worst = self.test_throughput_unlimited(
+            extensive=extensive, verbose=verbose,
+            workers=workers, symmetry=symmetry, warm_start=warm_start)
+        result = {
+            "result": unlimited,
+        }
+        if symmetry:
+            result['skipped'] = self.skipped_combinations
+        if not unlimited:
+            result['message'] = worst
+        return result
+
+
+class CompiledBalancer(Simulation):
+    """
+    The simulation graph of a balancer without the blueprint it was built
+    from: its splitters and belts, their capacities and priorities, and the
+    order of its inputs and outputs. It runs the same tests as a Balancer.
+
+    A compiled balancer pickles into the flat lists of `_graph_state`, and
+    is rebuilt from those when it is unpickled, so it is cheap to send to
+    other processes or to store.
+    """
+    def __init__(
+            self, splitters, belts, input_belts, output_belts,
+            has_sideloads=False, nr_inputs=None, nr_outputs=None,
+            engine='object', order=None):
+        self._engine_name = get_engine(engine).name
+        self._order = order
+        self.has_sideloads = has_sideloads
+        self.nr_inputs = len(input_belts) if nr_inputs is None else nr_inputs
+        self.nr_outputs = \
+            len(output_belts) if nr_outputs is None else nr_outputs
+        self._load_graph(splitters, belts, input_belts, output_belts)
+
+    @classmethod
+    def from_state(cls, state):
+        """
+        Builds a compiled balancer from the lists of `_graph_state`.
+        """
+        compiled = cls.__new__(cls)
+        compiled.__setstate__(state)
+        return compiled
+
+    def __getstate__(self):
+        return self._graph_state()
+
+    def __setstate__(self, state):
+        splitters = [
+            Splitter(
+                uid=i, input_priority=input_priority,
+                output_priority=output_priority)
+            for i, (input_priority, output_priority)
+            in enumerate(state['splitters'])]
+        belts = [
+            Belt(capacity=capacity, node=splitters[node] if node >= 0 else None)
+            for capacity, node, _ in state['belts']]
+        for belt, (_, _, next) in zip(belts, state['belts']):
+            if next >= 0:
+                belt.next = belts[next]
+
+        def get(i):
+            return belts[i] if i >= 0 else None
+
+        for splitter, slots in zip(splitters, state['slots']):
+            splitter.input_left, splitter.input_right, \
+                splitter.output_left, splitter.output_right = \
+                [get(i) for i in slots]
+        self.__init__(
+            splitters, belts[:state['nr_belts']],
+            [get(i) for i in state['inputs']],
+            [get(i) for i in state['outputs']],
+            has_sideloads=state['has_sideloads'],
+            nr_inputs=state['nr_inputs'], nr_outputs=state['nr_outputs'],
+            engine=state['engine'], order=state['order'])
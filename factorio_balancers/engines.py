@@ -0,0 +1,680 @@
+import importlib
+import math
+from fractions import Fraction
+from factorio_balancers.graph import Splitter
+from factorio_balancers.utils import is_close
+
+
+PRIORITY_CODES = {
+    Splitter.Priority.off.value: 0,
+    Splitter.Priority.left.value: 1,
+    Splitter.Priority.right.value: 2,
+}
+
+
+class CompiledGraph:
+    """
+    Flat representation of a simulation graph. Every belt gets an index into
+    `capacity`, splitters are described by the indices of their belts and
+    their priority codes, and `sources`/`targets` list every belt transfer.
+
+    A missing belt has index -1, which refers to a sentinel belt without
+    capacity at the end of `capacity`.
+    """
+    def __init__(self, splitters, belts, input_belts, output_belts):
+        self.index = {}
+        self.capacity = []
+
+        self.sources, self.targets = [], []
+        for belt in belts:
+            source = self.add(belt)
+            if belt.next is not None:
+                self.sources.append(source)
+                self.targets.append(self.add(belt.next))
+
+        self.in_left, self.in_right = [], []
+        self.out_left, self.out_right = [], []
+        self.in_priority, self.out_priority = [], []
+        for splitter in splitters:
+            self.in_left.append(self.add(splitter.input_left))
+            self.in_right.append(self.add(splitter.input_right))
+            self.out_left.append(self.add(splitter.output_left))
+            self.out_right.append(self.add(splitter.output_right))
+            self.in_priority.append(PRIORITY_CODES[splitter.input_priority])
+            self.out_priority.append(PRIORITY_CODES[splitter.output_priority])
+        for belt in input_belts + output_belts:
+            self.add(belt)
+        self.capacity.append(0)
+
+    def add(self, belt):
+        if belt is None:
+            return -1
+        if id(belt) not in self.index:
+            self.index[id(belt)] = len(self.capacity)
+            self.capacity.append(belt.capacity)
+        return self.index[id(belt)]
+
+    def __len__(self):
+        return len(self.capacity)
+
+    def _owners(self, left, right):
+        owners = {}
+        for i, belts in enumerate(zip(left, right)):
+            for belt in belts:
+                if belt != -1:
+                    owners[belt] = i
+        return owners
+
+    def components(self):
+        """
+        The strongly connected components of the graph of splitters, in
+        topological order, using Tarjan's algorithm.
+        """
+        owners = self._owners(self.in_left, self.in_right)
+        sources = self._owners(self.out_left, self.out_right)
+        successors = [set() for _ in self.in_left]
+        for source, target in zip(self.sources, self.targets):
+            if source in sources and target in owners:
+                successors[sources[source]].add(owners[target])
+
+        index, low = {}, {}
+        stack, on_stack = [], set()
+        components = []
+        for root in range(len(successors)):
+            if root in index:
+                continue
+            work = [(root, iter(sorted(successors[root])))]
+            index[root] = low[root] = len(index)
+            stack.append(root)
+            on_stack.add(root)
+            while work:
+                node, children = work[-1]
+                for child in children:
+                    if child not in index:
+                        index[child] = low[child] = len(index)
+                        stack.append(child)
+                        on_stack.add(child)
+                        work.append((child, iter(sorted(successors[child]))))
+                        break
+                    if child in on_stack:
+                        low[node] = min(low[node], index[child])
+                else:
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        low[parent] = min(low[parent], low[node])
+                    if low[node] == index[node]:
+                        component = []
+                        while True:
+                            member = stack.pop()
+                            on_stack.discard(member)
+                            component.append(member)
+                            if member == node:
+                                break
+                        components.append(sorted(component))
+        # Tarjan finds the components in reverse topological order
+        components.reverse()
+        return components
+
+    def flow_order(self):
+        """
+        The order in which items flow through the graph, as a list of steps
+        and the transfers that don't lead into a splitter. Every step is a
+        strongly connected component of splitters, with the transfers into
+        the component from the outside and the transfers within it.
+
+        The splitters within a component are updated at the same time, so
+        symmetric splitters in a loop stay exactly in step with each other.
+        """
+        owners = self._owners(self.in_left, self.in_right)
+        sources = self._owners(self.out_left, self.out_right)
+        components = self.components()
+        component_of = {}
+        for i, component in enumerate(components):
+            for splitter in component:
+                component_of[splitter] = i
+        incoming = [[] for _ in components]
+        internal = [[] for _ in components]
+        remaining = []
+        for i, (source, target) in enumerate(zip(self.sources, self.targets)):
+            if target not in owners:
+                remaining.append(i)
+                continue
+            component = component_of[owners[target]]
+            if component_of.get(sources.get(source)) == component:
+                internal[component].append(i)
+            else:
+                incoming[component].append(i)
+        schedule = list(zip(components, incoming, internal))
+        return schedule, remaining
+
+
+class ObjectEngine:
+    """
+    Runs the simulation directly on the graph.Splitter and graph.Belt
+    objects generated by the balancer, using exact fractions.
+
+    By default a cycle balances every splitter and then moves items along
+    every belt, so items move a single step per cycle. With `order` set to
+    'flow' the splitters are run in the order items flow through them, each
+    right after the belts leading into it, so items can travel through the
+    whole balancer in a single cycle. 'reverse' runs them the other way
+    around, which lets free space travel back from drained outputs.
+
+    `cycles` counts the cycles run so far, and `iterations` the number of
+    times a splitter moved items while balancing.
+    """
+    name = 'object'
+    number = Fraction
+    exact = True
+    margin = None
+
+    def __init__(self, splitters, belts, input_belts, output_belts):
+        self.splitters = splitters
+        self.belts = belts
+        self.input_belts = input_belts
+        self.output_belts = output_belts
+        self.borderline = False
+        self.order = None
+        self.cycles = 0
+        self.iterations = 0
+        self._all_belts = None
+        self._schedule = None
+
+    def get_schedule(self):
+        if self._schedule is None:
+            graph = CompiledGraph(
+                self.splitters, self.belts,
+                self.input_belts, self.output_belts)
+            schedule, remaining = graph.flow_order()
+            transfers = [belt for belt in self.belts if belt.next is not None]
+            self._schedule = (
+                [([self.splitters[i] for i in splitters],
+                  [transfers[i] for i in incoming],
+                  [transfers[i] for i in internal])
+                 for splitters, incoming, internal in schedule],
+                [transfers[i] for i in remaining])
+        return self._schedule
+
+    def get_all_belts(self):
+        result = {}
+        for belt in self.belts + self.input_belts + self.output_belts:
+            result[id(belt)] = belt
+            if belt.next is not None:
+                result[id(belt.next)] = belt.next
+        for splitter in self.splitters:
+            for belt in splitter.get_inputs() + splitter.get_outputs():
+                result[id(belt)] = belt
+        return list(result.values())
+
+    def activate(self):
+        """
+        Called when the balancer switches to this engine. The object engines
+        share the graph.Belt objects, so their number type is set here.
+        """
+        for belt in self.get_all_belts():
+            if belt.number is not self.number:
+                belt.number = self.number
+                belt.content = self.number(0)
+
+    def snapshot(self):
+        """
+        The contents of all belts, to be passed to `restore` later on.
+        """
+        if self._all_belts is None:
+            self._all_belts = self.get_all_belts()
+        return [belt.content for belt in self._all_belts]
+
+    def restore(self, state):
+        for belt, content in zip(self._all_belts, state):
+            belt.content = content
+
+    def change(self, state):
+        """
+        The largest difference in content of any belt since `state`.
+        """
+        return max(
+            (abs(belt.content - content)
+             for belt, content in zip(self._all_belts, state)),
+            default=0)
+
+    def cycle(self):
+        self.cycles += 1
+        if self.order is not None:
+            return self.ordered_cycle()
+        iterations = 0
+        for splitter in self.splitters:
+            iterations += splitter.balance()
+        self.iterations += iterations
+        for belt in self.belts:
+            belt.transfer()
+
+    def ordered_cycle(self):
+        schedule, remaining = self.get_schedule()
+        iterations = 0
+        if self.order == 'flow':
+            for splitters, incoming, internal in schedule:
+                for belt in incoming:
+                    belt.transfer()
+                for splitter in splitters:
+                    iterations += splitter.balance()
+                for belt in internal:
+                    belt.transfer()
+            for belt in remaining:
+                belt.transfer()
+        else:
+            for belt in remaining:
+                belt.transfer()
+            for splitters, incoming, internal in reversed(schedule):
+                for splitter in splitters:
+                    iterations += splitter.balance()
+                for belt in internal:
+                    belt.transfer()
+                for belt in incoming:
+                    belt.transfer()
+        self.iterations += iterations
+
+    def settle(self, max_cycles=None):
+        """
+        Cycles until nothing moves anymore, or for at most `max_cycles`.
+        Returns the number of cycles.
+        """
+        cycles = 0
+        while max_cycles is None or cycles < max_cycles:
+            state = self.snapshot()
+            self.cycle()
+            cycles += 1
+            if not self.change(state):
+                break
+        return cycles
+
+    def clear(self):
+        total = 0
+        for belt in self.belts:
+            total += belt.clear()
+            if belt.next:
+                total += belt.next.clear()
+        return total
+
+    def fill(self):
+        total = 0
+        for belt in self.belts:
+            total += belt.supply()
+            if belt.next:
+                total += belt.next.supply()
+        return total
+
+    def supply(self, belt, amount=None):
+        return belt.supply(amount)
+
+    def drain(self, belt, amount=None):
+        return belt.clear(amount)
+
+    def percentage(self, belt):
+        return belt.percentage
+
+    def all_equal(self, values):
+        return len(set(values)) <= 1
+
+    def is_close(self, a, b):
+        return is_close(a, b)
+
+
+class FloatEngine(ObjectEngine):
+    """
+    Runs the simulation on the graph objects using floats instead of
+    fractions.
+
+    Decisions that land within `margin` of their threshold are marked as
+    `borderline`, so the balancer can verify them with an exact engine.
+    Values that look equal are always borderline, even when they are
+    exactly equal, as rounding can make different amounts come out the
+    same within `ulps` units in the last place.
+    """
+    name = 'float'
+    number = float
+    exact = False
+    margin = 1e-9
+    ulps = 4
+
+    def all_equal(self, values):
+        values = [float(value) for value in values]
+        if not values:
+            return True
+        largest = max(abs(value) for value in values)
+        spread = max(values) - min(values)
+        tolerance = max(
+            self.margin * largest, self.ulps * math.ulp(largest))
+        if spread <= tolerance:
+            self.borderline = True
+            return True
+        return False
+
+    def is_close(self, a, b, rel_tol=1e-06):
+        a, b = float(a), float(b)
+        largest = max(abs(a), abs(b))
+        if abs(abs(a - b) - rel_tol * largest) <= self.margin * largest:
+            self.borderline = True
+        return is_close(a, b, rel_tol=rel_tol)
+
+
+class DyadicEngine(ObjectEngine):
+    """
+    Exact engine that stores every amount as a Python int, scaled by a shared
+    power of two: an amount of `units` stands for `units / 2 ** self.scale`.
+
+    Every amount in the simulation is dyadic: capacities are whole numbers,
+    the trickle amount is 1/4 and splitters only ever halve amounts. This
+    gives the same results as fractions without their gcd normalization.
+    The scale is only increased when an odd amount has to be halved, and is
+    reset whenever the belts are cleared or filled.
+    """
+    name = 'dyadic'
+
+    def __init__(self, splitters, belts, input_belts, output_belts):
+        super().__init__(splitters, belts, input_belts, output_belts)
+        graph = CompiledGraph(splitters, belts, input_belts, output_belts)
+        self.index = graph.index
+        self.base_capacity = graph.capacity
+        self.splitter_belts = list(zip(
+            graph.in_left, graph.in_right, graph.out_left, graph.out_right,
+            graph.in_priority, graph.out_priority))
+        self.transfers = list(zip(graph.sources, graph.targets))
+        self._schedule = graph.flow_order()
+        self.reset()
+
+    def activate(self):
+        pass
+
+    def reset(self, content=None):
+        self.scale = 0
+        self.capacity = list(self.base_capacity)
+        if content is None:
+            content = [0] * len(self.capacity)
+        self.content = content
+
+    def rescale(self, bits=1):
+        self.scale += bits
+        # Update in place, so references held by a running cycle stay valid
+        self.capacity[:] = [value << bits for value in self.capacity]
+        self.content[:] = [value << bits for value in self.content]
+
+    def to_units(self, amount):
+        amount = Fraction(amount)
+        bits = amount.denominator.bit_length() - 1
+        if amount.denominator != 1 << bits:
+            raise ValueError(
+                f"The dyadic engine can't represent an amount of {amount}")
+        if bits > self.scale:
+            self.rescale(bits - self.scale)
+        return amount.numerator << (self.scale - bits)
+
+    def from_units(self, units):
+        return Fraction(units, 1 << self.scale)
+
+    def snapshot(self):
+        return self.scale, list(self.capacity), list(self.content)
+
+    def restore(self, state):
+        scale, capacity, content = state
+        self.scale = scale
+        self.capacity = list(capacity)
+        self.content = list(content)
+
+    def change(self, state):
+        scale, _, content = state
+        bits = self.scale - scale
+        return self.from_units(max(
+            (abs(new - (old << bits))
+             for new, old in zip(self.content, content)),
+            default=0))
+
+    def balance(self):
+        self._balance(range(len(self.splitter_belts)))
+
+    def _balance(self, splitters):
+        """
+        Balances the given splitters, and returns the ones that moved any
+        items.
+        """
+        content = self.content
+        capacity = self.capacity
+        moved = []
+        iterations = 0
+        for i in splitters:
+            il, ir, ol, or_, ip, op = self.splitter_belts[i]
+            while True:
+                c_l, c_r = content[il], content[ir]
+                use_il = c_l > 0 and not (ip == 2 and c_r > 0)
+                use_ir = c_r > 0 and not (ip == 1 and c_l > 0)
+                a_l = capacity[ol] - content[ol]
+                a_r = capacity[or_] - content[or_]
+                use_ol = a_l > 0 and not (op == 2 and a_r > 0)
+                use_or = a_r > 0 and not (op == 1 and a_l > 0)
+                nr_in = use_il + use_ir
+                nr_out = use_ol + use_or
+                if not nr_in or not nr_out:
+                    break
+
+                if nr_in == 2:
+                    amount = min(c_l, c_r) * 2
+                else:
+                    amount = c_l if use_il else c_r
+                if nr_out == 2:
+                    amount = min(amount, min(a_l, a_r) * 2)
+                else:
+                    amount = min(amount, a_l if use_ol else a_r)
+                if amount & 1 and (nr_in == 2 or nr_out == 2):
+                    self.rescale()
+                    continue
+
+                iterations += 1
+                per_input = amount // nr_in
+                per_output = amount // nr_out
+                if use_il:
+                    content[il] -= per_input
+                if use_ir:
+                    content[ir] -= per_input
+                if use_ol:
+                    content[ol] += per_output
+                if use_or:
+                    content[or_] += per_output
+                if not moved or moved[-1] != i:
+                    moved.append(i)
+        self.iterations += iterations
+        return moved
+
+    def transfer(self):
+        self._transfer(range(len(self.transfers)))
+
+    def _transfer(self, transfers):
+        """
+        Moves items along the given transfers, and returns the ones that
+        moved any items.
+        """
+        content = self.content
+        capacity = self.capacity
+        moved = []
+        for i in transfers:
+            source, target = self.transfers[i]
+            if not content[source]:
+                continue
+            available = capacity[target] - content[target]
+            if not available:
+                continue
+            if available < content[source]:
+                content[source] -= available
+                content[target] = capacity[target]
+            else:
+                content[target] += content[source]
+                content[source] = 0
+            moved.append(i)
+        return moved
+
+    def cycle(self):
+        self.cycles += 1
+        if self.order is not None:
+            return self.ordered_cycle()
+        self.balance()
+        self.transfer()
+
+    def ordered_cycle(self):
+        schedule, remaining = self._schedule
+        if self.order == 'flow':
+            for splitters, incoming, internal in schedule:
+                self._transfer(incoming)
+                self._balance(splitters)
+                self._transfer(internal)
+            self._transfer(remaining)
+        else:
+            self._transfer(remaining)
+            for splitters, incoming, internal in reversed(schedule):
+                self._balance(splitters)
+                self._transfer(internal)
+                self._transfer(incoming)
+
+    def clear(self):
+        total = self.from_units(sum(self.content))
+        self.reset()
+        return total
+
+    def fill(self):
+        total = self.from_units(sum(self.capacity) - sum(self.content))
+        self.reset(list(self.base_capacity))
+        return total
+
+    def supply(self, belt, amount=None):
+        i = self.index[id(belt)]
+        if amount is None or amount > self.base_capacity[i]:
+            amount = self.base_capacity[i]
+        units = self.to_units(amount)
+        result = units - self.content[i]
+        self.content[i] = units
+        return self.from_units(result)
+
+    def drain(self, belt, amount=None):
+        i = self.index[id(belt)]
+        if amount is None:
+            units = self.content[i]
+        else:
+            units = self.to_units(amount)
+        self.content[i] -= units
+        return self.from_units(units)
+
+    def percentage(self, belt):
+        i = self.index[id(belt)]
+        return (self.content[i] / self.capacity[i]) * 100.0
+
+
+class WorklistEngine(DyadicEngine):
+    """
+    Dyadic engine that only runs the splitters and transfers next to a belt
+    whose content changed since they last ran.
+
+    A splitter balances until it can't move anything, and a transfer leaves
+    either an empty source or a full target, so running them again without
+    any change to their belts does nothing. Once a balancer is close to its
+    steady state, a cycle only costs work for the part that is still moving.
+    The worklist decides what runs, so `order` is ignored.
+    """
+    name = 'worklist'
+
+    def __init__(self, splitters, belts, input_belts, output_belts):
+        super().__init__(splitters, belts, input_belts, output_belts)
+        nr_belts = len(self.base_capacity)
+        self.belt_splitters = [set() for _ in range(nr_belts)]
+        self.belt_transfers = [set() for _ in range(nr_belts)]
+        for i, belts in enumerate(self.splitter_belts):
+            for belt in belts[:4]:
+                if belt != -1:
+                    self.belt_splitters[belt].add(i)
+        for i, (source, target) in enumerate(self.transfers):
+            self.belt_transfers[source].add(i)
+            self.belt_transfers[target].add(i)
+
+        # Everything that has to run again when a splitter or transfer
+        # moves items
+        self.splitter_neighbours = [
+            self._neighbours(belts[:4]) for belts in self.splitter_belts]
+        self.transfer_neighbours = [
+            self._neighbours(belts) for belts in self.transfers]
+
+    def _neighbours(self, belts):
+        splitters, transfers = set(), set()
+        for belt in belts:
+            if belt != -1:
+                splitters |= self.belt_splitters[belt]
+                transfers |= self.belt_transfers[belt]
+        return splitters, transfers
+
+    def mark_all(self):
+        self.dirty_splitters = set(range(len(self.splitter_belts)))
+        self.dirty_transfers = set(range(len(self.transfers)))
+
+    def mark(self, belt):
+        self.dirty_splitters |= self.belt_splitters[belt]
+        self.dirty_transfers |= self.belt_transfers[belt]
+
+    @property
+    def idle(self):
+        return not self.dirty_splitters and not self.dirty_transfers
+
+    def reset(self, content=None):
+        super().reset(content)
+        self.mark_all()
+
+    def restore(self, state):
+        super().restore(state)
+        self.mark_all()
+
+    def cycle(self):
+        self.cycles += 1
+        splitters, self.dirty_splitters = self.dirty_splitters, set()
+        for i in self._balance(splitters):
+            splitters, transfers = self.splitter_neighbours[i]
+            self.dirty_splitters |= splitters
+            self.dirty_transfers |= transfers
+
+        transfers, self.dirty_transfers = self.dirty_transfers, set()
+        for i in self._transfer(transfers):
+            splitters, transfers = self.transfer_neighbours[i]
+            self.dirty_splitters |= splitters
+            self.dirty_transfers |= transfers
+
+    def settle(self, max_cycles=None):
+        cycles = 0
+        while not self.idle and (max_cycles is None or cycles < max_cycles):
+            self.cycle()
+            cycles += 1
+        return cycles
+
+    def supply(self, belt, amount=None):
+        self.mark(self.index[id(belt)])
+        return super().supply(belt, amount)
+
+    def drain(self, belt, amount=None):
+        self.mark(self.index[id(belt)])
+        return super().drain(belt, amount)
+
+
+engines = {
+    'object': ObjectEngine,
+    'float': FloatEngine,
+    'dyadic': DyadicEngine,
+    'worklist': WorklistEngine,
+    'numpy': 'factorio_balancers.numpy_engine.NumpyEngine',
+}
+
+
+def get_engine(name):
+    try:
+        engine = engines[name]
+    except KeyError:
+        raise ValueError(
+            f"Unknown simulation engine '{name}', "
+            f"choose from: {', '.join(engines)}")
+    if isinstance(engine, str):
+        module, _, cls = engine.rpartition('.')
+        engine = getattr(importlib.import_module(module), cls)
+        engines[name] = engine
+    return engine
@@ -2,7 +2,13 @@ from py_factorio_blueprints.entity_mixins import BaseMixin
 from py_factorio_blueprints.util import Vector
 from factorio_balancers.exceptions import *
 from factorio_balancers.graph import Belt as GraphBelt
+from collections import defaultdict
 from enum import Enum
+from math import floor
+
+
+# Returned by a step of _trace_nodes that continues with the same belt
+_CONTINUE = object()
 
 
 class Connection:
@@ -77,14 +83,16 @@ class Connection:
 
 class BalancerEntity(BaseMixin):
     def input_belt_check(self):
-        if not self.forward.connected:
-            raise IllegalConfiguration(
-                self,
-                message="Entity has no forward partner")
-        elif self.forward.entity.has_sideloads:
-            return False
-        else:
-            return self.forward.entity.input_belt_check()
+        entity = self
+        while not isinstance(entity, Splitter):
+            if not entity.forward.connected:
+                raise IllegalConfiguration(
+                    entity,
+                    message="Entity has no forward partner")
+            entity = entity.forward.entity
+            if entity.has_sideloads:
+                return False
+        return True
 
     def side_from_position(self, position):
         rot_amount = self.direction // -2
@@ -101,34 +109,6 @@ class BalancerEntity(BaseMixin):
     def coordinates(self):
         return [self.position]
 
-    def pad_connection(self, inp=False, out=False):
-        if bool(inp) == bool(out):
-            raise ValueError(
-                "connection can't be input and output at the same time")
-        names = {
-            1: 'transport-belt',
-            2: 'fast-transport-belt',
-            3: 'express-transport-belt',
-        }
-        name = names[self.name.data['belt_speed']]
-
-        if inp:
-            new = self.blueprint.entities.make(
-                name=name,
-                position=self.position + self.direction.rotate(2).vector,
-                direction=self.direction)
-            connection1 = self.backward
-            connection2 = new.forward
-            connection1.connect(connection2)
-        if out:
-            new = self.blueprint.entities.make(
-                name=name,
-                position=self.position + self.direction.vector,
-                direction=self.direction)
-            connection1 = self.forward
-            connection2 = new.backward
-            connection1.connect(connection2)
-
     def strip_length(self, inp=False, out=False):
         if bool(inp) == bool(out):
             raise ValueError(
@@ -136,17 +116,48 @@ class BalancerEntity(BaseMixin):
         return 0
 
     def _trace_nodes(self, belt, position, lane=None):
+        """
+        Follows the belts from this entity, building the graph belts and
+        splitters they lead to. Returns `belt`, or None when it leads
+        straight to an output.
+
+        Every step returns the steps that follow it instead of calling them,
+        so long belts don't run into the recursion limit. The steps are run
+        depth first in the same order as a recursive traversal would.
+        """
+        result = None
+        stack = [(self, belt, position, lane, False, True)]
+        while stack:
+            entity, belt, position, lane, base, tail = stack.pop()
+            if base:
+                outcome, steps = BalancerEntity._trace_step(
+                    entity, belt, position, lane)
+            else:
+                outcome, steps = entity._trace_step(belt, position, lane)
+            if tail and outcome is not _CONTINUE:
+                result = outcome
+            tail = tail and outcome is _CONTINUE
+            stack.extend((*step, tail) for step in reversed(steps))
+        return result
+
+    def _trace_step(self, belt, position, lane=None):
         speed = self.name.data['belt_speed']
         if speed < belt.capacity:
             belt.capacity = speed
-        if isinstance(self.forward.entity, (Belt, Underground)):
-            return self.forward.entity._trace_nodes(belt, self.position, lane=lane)
-        elif isinstance(self.forward.entity, Splitter):
-            self.forward.entity._trace_nodes(belt, self.position, lane=lane)
-            return belt
-        elif self.forward.entity is None:
-            self.blueprint._belts.append(belt)
-            self.blueprint._output_belts.append(belt)
+        forward = self.forward.entity
+        if forward in self.blueprint._stripped:
+            forward = None
+        if isinstance(forward, (Belt, Underground)):
+            return _CONTINUE, [(forward, belt, self.position, lane, False)]
+        elif isinstance(forward, Splitter):
+            return belt, [(forward, belt, self.position, lane, False)]
+        elif forward is None:
+            self._add_output(belt)
+        return None, []
+
+    def _add_output(self, belt):
+        self.blueprint._belts.append(belt)
+        self.blueprint._output_belts.append(belt)
 
 
 class Belt(BalancerEntity):
@@ -155,9 +166,9 @@ class Belt(BalancerEntity):
         self.__forward = Connection(self, Connection.Type.OUTPUT)
         self.__backward = Connection(self, Connection.Type.INPUT)
 
-    def _trace_nodes(self, belt, position, lane=None):
+    def _trace_step(self, belt, position, lane=None):
         if lane is None or not getattr(self, '_has_node', False):
-            return super()._trace_nodes(belt, self.position, lane=lane)
+            return super()._trace_step(belt, self.position, lane=lane)
 
         def opposite(a):
             return {'left': 'right', 'right': 'left'}[a]
@@ -188,16 +199,14 @@ class Belt(BalancerEntity):
 
         lane_side = lane if side is None else side
         if getattr(self, f'_traversed_{lane_side}', False):
-            return belt
+            return belt, []
         setattr(self, f'_traversed_{lane_side}', True)
 
         node = getattr(self, f'_node_{lane_side}')
         field = f'output_{opposite(lane_side)}'
         setattr(node, field, GraphBelt(capacity=speed, node=node))
-        super()._trace_nodes(
-            getattr(node, field),
-            self.position, lane=lane_side)
-        return belt
+        return belt, [
+            (self, getattr(node, field), self.position, lane_side, True)]
 
     @property
     def forward(self):
@@ -230,7 +239,7 @@ class Belt(BalancerEntity):
 
     def setup_transport_lines(self):
         position = self.position + self.direction.vector
-        other = self.blueprint.entities[position]
+        other = self.blueprint.entity_grid[position]
         if not other:
             return
         elif len(other) > 1:
@@ -252,41 +261,22 @@ class Belt(BalancerEntity):
         if bool(inp) == bool(out):
             raise ValueError(
                 "connection can't be input and output at the same time")
-        if inp:
-            other = self.forward.entity
-            if isinstance(other, Belt) and \
-                    not other.has_sideloads and \
-                    self.direction == other.direction:
-                return 1 + other.strip_length(inp=inp, out=out)
+        length = 0
+        entity = self
+        while True:
+            if inp:
+                other = entity.forward.entity
             else:
-                return 0
-        elif out:
-            other = self.backward.entities[0]
+                other = entity.backward.entities[0]
             if isinstance(other, Belt) and \
                     not other.has_sideloads and \
-                    self.direction == other.direction:
-                return 1 + other.strip_length(inp=inp, out=out)
+                    entity.direction == other.direction:
+                length += 1
+                entity = other
+            elif out and entity.direction != other.direction:
+                return length - 1
             else:
-                if self.direction != other.direction:
-                    return -1
-                return 0
-
-    def strip_connection(self, length, inp=False, out=False):
-        if length == 0:
-            return
-        if bool(inp) == bool(out):
-            raise ValueError(
-                "connection can't be input and output at the same time")
-        if inp:
-            other = self.forward.entity
-            self.forward.disconnect(other.backward)
-            self.blueprint.entities.remove(self)
-            other.strip_connection(length - 1, inp=inp, out=out)
-        elif out:
-            other = self.backward.entities[0]
-            self.backward.disconnect(other.forward)
-            self.blueprint.entities.remove(self)
-            other.strip_connection(length - 1, inp=inp, out=out)
+                return length
 
 
 class Splitter(BalancerEntity):
@@ -365,7 +355,7 @@ class Splitter(BalancerEntity):
                      for coordinate in self.coordinates]
         dead_end = False
         for position in positions:
-            other = self.blueprint.entities[position]
+            other = self.blueprint.entity_grid[position]
             if not other:
                 continue
             elif len(other) > 1:
@@ -394,39 +384,7 @@ class Splitter(BalancerEntity):
                 position, Connection.Type.INPUT)
             connection1.connect(connection2)
 
-    def pad_connection(self, inp=False, out=False):
-        names = {
-            1: 'transport-belt',
-            2: 'fast-transport-belt',
-            3: 'express-transport-belt',
-        }
-        name = names[self.name.data['belt_speed']]
-
-        left, right = self.coordinates
-        if inp:
-            new_left = self.blueprint.entities.make(
-                name=name,
-                position=left + self.direction.rotate(2).vector,
-                direction=self.direction)
-            new_right = self.blueprint.entities.make(
-                name=name,
-                position=right + self.direction.rotate(2).vector,
-                direction=self.direction)
-            self.backward_left.connect(new_left.forward)
-            self.backward_right.connect(new_right.forward)
-        if out:
-            new_left = self.blueprint.entities.make(
-                name=name,
-                position=left + self.direction.vector,
-                direction=self.direction)
-            new_right = self.blueprint.entities.make(
-                name=name,
-                position=right + self.direction.vector,
-                direction=self.direction)
-            self.forward_left.connect(new_left.backward)
-            self.forward_right.connect(new_right.backward)
-
-    def _trace_nodes(self, belt, position, lane=None):
+    def _trace_step(self, belt, position, lane=None):
         side = self.side_from_position(position)
         node = getattr(self, f'_node{f"_{lane}" if lane is not None else ""}')
         if side == 'left':
@@ -450,23 +408,35 @@ class Splitter(BalancerEntity):
         self.blueprint._belts.append(belt)
 
         if getattr(self, f'_traversed{f"_{lane}" if lane else ""}', False):
-            return belt
+            return belt, []
         setattr(self, f'_traversed{f"_{lane}" if lane else ""}', True)
 
-        if self.forward_left.connected:
+        # An output splitter that would have been padded leads straight to
+        # an output on both sides
+        padded = self in self.blueprint._padded_outputs
+        steps = []
+        if self.forward_left.connected or padded:
             node.output_left = GraphBelt(
                 capacity=self.name.data['belt_speed'],
                 node=node)
-            self.forward_left.entity._trace_nodes(
-                node.output_left, self.coordinates[0], lane=lane)
-        if self.forward_right.connected:
+            if padded:
+                self._add_output(node.output_left)
+            else:
+                steps.append((
+                    self.forward_left.entity, node.output_left,
+                    self.coordinates[0], lane, False))
+        if self.forward_right.connected or padded:
             node.output_right = GraphBelt(
                 capacity=self.name.data['belt_speed'],
                 node=node)
-            self.forward_right.entity._trace_nodes(
-                node.output_right, self.coordinates[1], lane=lane)
+            if padded:
+                self._add_output(node.output_right)
+            else:
+                steps.append((
+                    self.forward_right.entity, node.output_right,
+                    self.coordinates[1], lane, False))
 
-        return belt
+        return belt, steps
 
 
 class Underground(BalancerEntity):
@@ -501,42 +471,45 @@ class Underground(BalancerEntity):
             return self.forward
 
     def find_partner(self):
-        max_distance = self.name.data['max_distance'] + 1
-        if self.type == 'output':
-            direction = self.direction.rotate(2)
-        else:
-            direction = self.direction
-        vector = direction.vector
-        for i in range(1, max_distance + 1):
-            entity = self.blueprint.entities[self.position + vector * i]
-            if not entity:
-                continue
-            elif len(entity) > 1:
-                raise IllegalConfiguration(
-                    self, entity,
-                    message="More than one entity occupying the same space")
-            entity = entity[0]
-            if entity.name != self.name:
-                continue
-            elif entity.direction == self.direction \
-                    and self.type == 'input' \
-                    and entity.type == 'input':
-                raise IllegalConfiguration(
-                    self, entity, message="Two underground inputs in a row")
-            elif entity.direction == self.direction.rotate(2) \
-                    and self.type == 'input':
-                raise IllegalConfiguration(
-                    self, entity,
-                    message="Two connected underground inputs")
-            elif entity.direction == self.direction.rotate(2) \
-                    and self.type == 'output' \
-                    and entity.type == 'output':
-                raise IllegalConfiguration(
-                    self, entity,
-                    message="Two connected underground outputs")
-            elif entity.direction == self.direction \
-                    and entity.type != self.type:
-                return entity
+        partner = self.blueprint.underground_partners.get(self)
+        if isinstance(partner, IllegalConfiguration):
+            raise partner
+        return partner
+
+    @property
+    def scan_sense(self):
+        """
+        The direction along its axis, -1 or 1, in which this underground
+        looks for its partner.
+        """
+        vector = self.direction.vector
+        sense = int(vector.x or vector.y)
+        return sense if self.type == 'input' else -sense
+
+    def _match(self, entity):
+        """
+        Whether `entity`, an underground of the same kind on the same axis,
+        is the partner of this one. Returns None if this one looks past it.
+        """
+        if entity.direction == self.direction \
+                and self.type == 'input' \
+                and entity.type == 'input':
+            raise IllegalConfiguration(
+                self, entity, message="Two underground inputs in a row")
+        elif entity.direction == self.direction.rotate(2) \
+                and self.type == 'input':
+            raise IllegalConfiguration(
+                self, entity,
+                message="Two connected underground inputs")
+        elif entity.direction == self.direction.rotate(2) \
+                and self.type == 'output' \
+                and entity.type == 'output':
+            raise IllegalConfiguration(
+                self, entity,
+                message="Two connected underground outputs")
+        elif entity.direction == self.direction \
+                and entity.type != self.type:
+            return entity
         return None
 
     @property
@@ -564,9 +537,9 @@ class Underground(BalancerEntity):
         if self.type == 'output':
             Belt.setup_transport_lines(self)
 
-    def _trace_nodes(self, belt, position, lane=None):
+    def _trace_step(self, belt, position, lane=None):
         if lane is None or not getattr(self, '_has_node', False):
-            return super()._trace_nodes(belt, self.position, lane=lane)
+            return super()._trace_step(belt, self.position, lane=lane)
 
         def opposite(a):
             return {'left': 'right', 'right': 'left'}[a]
@@ -590,7 +563,7 @@ class Underground(BalancerEntity):
             if self.type == 'output':
                 lane_check = opposite(lane)
             if side != lane_check:
-                return belt
+                return belt, []
             field = f'input_{side}'
             if getattr(node, field) is None:
                 setattr(node, field, GraphBelt(
@@ -603,16 +576,111 @@ class Underground(BalancerEntity):
 
         lane_side = lane if side is None else side
         if getattr(self, f'_traversed_{lane_side}', False):
-            return belt
+            return belt, []
         setattr(self, f'_traversed_{lane_side}', True)
 
         node = getattr(self, f'_node_{lane_side}')
         field = f'output_{opposite(lane_side)}'
         setattr(node, field, GraphBelt(capacity=speed, node=node))
-        super()._trace_nodes(
-            getattr(node, field),
-            self.position, lane=lane_side)
-        return belt
+        return belt, [
+            (self, getattr(node, field), self.position, lane_side, True)]
+
+
+def _closest(scanners, stoppers, sense):
+    """
+    Finds the closest stopper in direction `sense` of every scanner, in a
+    single sweep over both sorted by coordinate. Both are lists of
+    (coordinate, item) pairs. Returns the distance and the stopper for
+    every scanner, or None if there is none.
+    """
+    # Scanners come before stoppers on the same coordinate, so an
+    # underground never finds itself
+    events = sorted(
+        [(-sense * coordinate, 0, item) for coordinate, item in scanners] +
+        [(-sense * coordinate, 1, item) for coordinate, item in stoppers],
+        key=lambda event: event[:2])
+    closest = {}
+    last = None
+    for key, is_stopper, item in events:
+        if is_stopper:
+            last = (key, item)
+        else:
+            closest[item] = \
+                None if last is None else (key - last[0], last[1])
+    return closest
+
+
+def pair_undergrounds(undergrounds, grid):
+    """
+    Pairs all undergrounds with a single sweep along every row and column,
+    instead of letting every underground scan the tiles in front of it.
+
+    Returns a dict with the partner of every underground, None if it has
+    none, or the IllegalConfiguration it should raise. An underground stops
+    at the first tile with overlapping entities, or the first underground
+    of the same kind on its axis that it doesn't look past.
+    """
+    overlaps = defaultdict(list)
+    for (x, y), entities in grid.overlapping_tiles():
+        overlaps[(0, y)].append((x, entities))
+        overlaps[(1, x)].append((y, entities))
+
+    lines = defaultdict(list)
+    for underground in undergrounds:
+        x, y = floor(underground.position.x), floor(underground.position.y)
+        if underground.direction.vector.y == 0:
+            lines[(underground.name, 0, y)].append((x, underground))
+        else:
+            lines[(underground.name, 1, x)].append((y, underground))
+
+    result = {}
+    for (name, axis, line), members in lines.items():
+        max_distance = name.data['max_distance'] + 1
+        blocked = overlaps[(axis, line)]
+        # Undergrounds on a tile with overlapping entities are only seen
+        # as the overlap by the others
+        visible = [
+            (coordinate, underground) for coordinate, underground in members
+            if len(grid[underground.position]) == 1]
+        inputs = {
+            sense: [(c, u) for c, u in visible
+                    if u.type == 'input' and u.scan_sense == sense]
+            for sense in (-1, 1)}
+        outputs = {
+            sense: [(c, u) for c, u in visible
+                    if u.type == 'output' and u.scan_sense == sense]
+            for sense in (-1, 1)}
+        for sense in (-1, 1):
+            # Inputs stop at any underground on their axis, outputs look
+            # past outputs in the same direction and inputs facing them
+            scans = [
+                ([(c, u) for c, u in members
+                  if u.type == 'input' and u.scan_sense == sense],
+                 visible),
+                ([(c, u) for c, u in members
+                  if u.type == 'output' and u.scan_sense == sense],
+                 inputs[-sense] + outputs[-sense]),
+            ]
+            for scanners, stoppers in scans:
+                closest = _closest(scanners, stoppers + blocked, sense)
+                for underground, found in closest.items():
+                    result[underground] = _partner(
+                        underground, found, max_distance)
+    return result
+
+
+def _partner(underground, found, max_distance):
+    if found is None or found[0] > max_distance:
+        return None
+    stopper = found[1]
+    if isinstance(stopper, list):
+        return IllegalConfiguration(
+            underground, stopper,
+            message="More than one entity occupying the same space")
+    try:
+        return underground._match(stopper)
+    except IllegalConfiguration as e:
+        return e
 
 
 entity_prototypes = {
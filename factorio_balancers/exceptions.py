@@ -10,14 +10,14 @@ class EntityError(Exception):
         result = f"<{type(self).__name__} ("
         if self.message:
             result = f"{result}message={self.message}, "
-        result = f"{result}{', '.join(self.args)}"
+        result = f"{result}{', '.join(str(arg) for arg in self.args)}"
         return f"{result})>"
 
     def __str__(self):
         result = f"<{type(self).__name__} ("
         if self.message:
             result = f"{result}message={self.message}, "
-        result = f"{result}{', '.join(self.args)}"
+        result = f"{result}{', '.join(str(arg) for arg in self.args)}"
         return f"{result})>"
 
     def __eq__(self, other):
@@ -61,3 +61,7 @@ class IllegalConfigurations(EntityError):
             result += f"\n    {repr(exception)}"
         result += ")"
         return result
+
+
+class NonLinearNetwork(Exception):
+    pass
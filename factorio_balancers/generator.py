@@ -0,0 +1,198 @@
+from py_factorio_blueprints.util import encode
+
+
+NORTH, EAST, WEST = 0, 2, 6
+
+# The belt, underground belt and splitter of every tier
+TIERS = {
+    'basic': ('transport-belt', 'underground-belt', 'splitter'),
+    'fast': (
+        'fast-transport-belt', 'fast-underground-belt', 'fast-splitter'),
+    'express': (
+        'express-transport-belt', 'express-underground-belt',
+        'express-splitter'),
+}
+
+# A 1-1 lane balancer, as (kind, x, y, direction, underground type)
+# relative to its input lane. Its input is at the bottom (y=2) and its
+# output at the top (y=-3), both in column 0.
+LANE_BALANCER = [
+    ('belt', 0, 2, NORTH, None),
+    ('splitter', 0.5, 1, NORTH, None),
+    ('belt', 0, 0, WEST, None),
+    ('belt', 1, 0, NORTH, None),
+    ('underground', -1, 0, NORTH, 'input'),
+    ('belt', 1, -1, WEST, None),
+    ('underground', -1, -1, NORTH, 'output'),
+    ('underground', 0, -1, NORTH, 'output'),
+    ('splitter', -0.5, -2, NORTH, None),
+    ('belt', -1, -3, EAST, None),
+    ('belt', 0, -3, NORTH, None),
+]
+
+
+def stages(family, size):
+    """
+    The bits that the splitters of every stage of a network combine: a
+    splitter of the stage for bit `b` joins lanes `i` and `i ^ (1 << b)`.
+    """
+    bits = size.bit_length() - 1
+    if size < 2 or size != 1 << bits:
+        raise ValueError(f"The size must be a power of two, not {size}")
+    if family == 'butterfly':
+        return list(range(bits))
+    elif family == 'benes':
+        return list(range(bits)) + list(range(bits - 2, -1, -1))
+    raise ValueError(f"Unknown family {family}")
+
+
+class _Layout:
+    """
+    The entities of a balancer that is built from the bottom up, with items
+    flowing north. `self.y` is the row that was built last.
+    """
+    def __init__(self):
+        self.entities = {}
+        self.y = 0
+
+    def add(self, name, x, y, direction=NORTH, type=None):
+        entity = {
+            'name': name,
+            'position': {'x': x, 'y': y},
+            'direction': direction,
+        }
+        if type is not None:
+            entity['type'] = type
+        self.entities[(x, y)] = entity
+
+    def to_data(self, label):
+        entities = [
+            dict(entity, entity_number=i + 1)
+            for i, entity in enumerate(self.entities.values())]
+        return {'blueprint': {
+            'item': 'blueprint',
+            'label': label,
+            'icons': [{
+                'signal': {'type': 'item', 'name': 'splitter'},
+                'index': 1}],
+            'entities': entities,
+            'version': 77311770624,
+        }}
+
+
+def _straight(layout, columns, rows, belt):
+    for row in range(rows):
+        layout.y -= 1
+        for x in columns:
+            layout.add(belt, x, layout.y)
+
+
+def _lane_balancers(layout, columns, tier):
+    belt, underground, splitter = TIERS[tier]
+    names = {'belt': belt, 'underground': underground, 'splitter': splitter}
+    base = layout.y - 3
+    for x in columns:
+        for kind, dx, dy, direction, type in LANE_BALANCER:
+            layout.add(names[kind], x + dx, base + dy, direction, type)
+    layout.y = base - 3
+
+
+def _route(layout, columns, targets, tier):
+    """
+    Moves the lane in `columns[i]` to `targets[i]`, for all lanes one at a
+    time. The target columns must all be free. A lane moves sideways in the
+    middle row of a block of three rows, and every lane that it crosses
+    passes underneath it using an underground belt.
+    """
+    belt, underground, _ = TIERS[tier]
+    columns = list(columns)
+    for i, target in enumerate(targets):
+        source = columns[i]
+        below, middle, above = layout.y - 1, layout.y - 2, layout.y - 3
+        low, high = sorted((source, target))
+        direction = EAST if target > source else WEST
+        for x in columns:
+            if x == source:
+                layout.add(belt, x, below)
+                layout.add(belt, x, middle, direction)
+            elif low < x < high:
+                layout.add(underground, x, below, type='input')
+                layout.add(underground, x, above, type='output')
+            else:
+                for y in (below, middle, above):
+                    layout.add(belt, x, y)
+        for x in range(low + 1, high):
+            layout.add(belt, x, middle, direction)
+        layout.add(belt, target, middle)
+        layout.add(belt, target, above)
+        columns[i] = target
+        layout.y = above
+    return columns
+
+
+def generate(size, family='benes', tiers=('basic',), lane_balance=False,
+             label=None):
+    """
+    The decoded blueprint of a `size` x `size` balancer built from a
+    network of splitters. Every stage of the network is built with the next
+    tier in `tiers`, and with `lane_balance` every input first passes a
+    lane balancer.
+
+    The families are 'butterfly', where every input reaches every output
+    through a single path, and 'benes', a butterfly followed by its mirror
+    image. Between stages, the lanes are reordered by weaving them past each
+    other using underground belts.
+    """
+    network = stages(family, size)
+    layout = _Layout()
+    # order[i] is the lane in the i-th column of the current region
+    order = list(range(size))
+    belt = TIERS[tiers[0]][0]
+    if lane_balance:
+        columns = [3 * i + 1 for i in range(size)]
+        width = 3 * size
+    else:
+        columns = list(range(size))
+        width = size
+    for x in columns:
+        layout.add(belt, x, layout.y)
+    if lane_balance:
+        _lane_balancers(layout, columns, tiers[0])
+    # Lanes are moved back and forth between two regions of columns, so the
+    # columns they move to are always free
+    regions = [0, width]
+    region = 0
+
+    for stage, bit in enumerate(network):
+        tier = tiers[stage % len(tiers)]
+        belt, _, splitter = TIERS[tier]
+        desired = []
+        for lane in range(size):
+            if not lane & (1 << bit):
+                desired.extend([lane, lane | (1 << bit)])
+        if desired != order or columns != [
+                regions[region] + i for i in range(size)]:
+            region = 1 - region
+            position = {lane: i for i, lane in enumerate(desired)}
+            columns = _route(
+                layout, columns,
+                [regions[region] + position[lane] for lane in order],
+                tier)
+            columns = sorted(columns)
+            order = desired
+        _straight(layout, columns, 1, belt)
+        layout.y -= 1
+        for x in columns[::2]:
+            layout.add(splitter, x + 0.5, layout.y)
+    _straight(layout, columns, 1, belt)
+
+    if label is None:
+        label = f"{size}x{size} {family}"
+    return layout.to_data(label)
+
+
+def generate_string(size, family='benes', **kwargs):
+    """
+    The exchange string of a balancer made by `generate`.
+    """
+    return encode(generate(size, family, **kwargs))
@@ -1,13 +1,16 @@
 from enum import Enum, auto
 from fractions import Fraction
+from factorio_balancers.utils import is_close
 
 
 class Belt:
+    number = Fraction
+
     def __init__(self, capacity=1, next=None, node=None):
         self.next = next
         self.node = node
         self.capacity = capacity
-        self.__content = Fraction(0, 1)
+        self.__content = self.number(0)
 
     def __repr__(self):
         return f"<Belt( {self.__content} of {self.capacity} )>"
@@ -19,8 +22,12 @@ class Belt:
     @content.setter
     def content(self, value):
         if value > self.capacity:
-            raise ValueError(
-                f"Content can't exceed capacity: {value}/{self.capacity}")
+            if self.number is Fraction or \
+                    not is_close(value, self.capacity):
+                raise ValueError(
+                    f"Content can't exceed capacity: {value}/{self.capacity}")
+            # Rounding error of an inexact number type
+            value = self.number(self.capacity)
         self.__content = value
 
     @property
@@ -42,8 +49,8 @@ class Belt:
     def supply(self, amount=None):
         if amount is None or amount > self.capacity:
             amount = self.capacity
-        if not isinstance(amount, Fraction):
-            amount = Fraction(amount)
+        if not isinstance(amount, self.number):
+            amount = self.number(amount)
         result = amount - self.content
         self.content = amount
         return result
@@ -141,9 +148,12 @@ class Splitter:
         return outputs
 
     def balance(self):
+        # Returns the number of times items were moved
+        iterations = 0
         inputs = self.get_available_inputs()
         outputs = self.get_available_outputs()
         while inputs and outputs:
+            iterations += 1
             available_space = min(
                 [output.available for output in outputs]) * len(outputs)
             available_content = min(
@@ -158,6 +168,7 @@ class Splitter:
                 output.content += amount / len(outputs)
             inputs = self.get_available_inputs()
             outputs = self.get_available_outputs()
+        return iterations
 
     @property
     def percentage(self):
@@ -165,7 +176,8 @@ class Splitter:
         total = sum([input.available for input in inputs])
         return total / len(inputs)
 
-    def make_networkx_graph(self, g, parent_name, node_colors, edge_colors):
+    def make_networkx_graph(
+            self, g, parent_name, node_colors, edge_colors, output_belts):
         outputs = self.get_outputs()
         node_name = f'{self.uid}'
         if parent_name:
@@ -174,9 +186,9 @@ class Splitter:
         for belt in outputs:
             if belt.next:
                 belt.next.node.make_networkx_graph(
-                    g, node_name, node_colors, edge_colors)
-            elif belt in self.entity.blueprint._output_belts:
-                for i, output in enumerate(self.entity.blueprint._output_belts):
+                    g, node_name, node_colors, edge_colors, output_belts)
+            elif belt in output_belts:
+                for i, output in enumerate(output_belts):
                     if belt == output:
                         edge_colors[(node_name, f'output {i}')] = self.percentage / 100.0
                         g.add_edges_from([(node_name, f'output {i}')])
@@ -0,0 +1,70 @@
+from array import array
+from math import floor
+
+
+class GridIndex:
+    """
+    Maps every tile within the bounding box of a blueprint to the id of the
+    entity on it, using a flat array. Tiles that are covered by more than
+    one entity are kept separately, so overlaps can still be reported.
+
+    Indexing with a position returns a list of entities, just like indexing
+    the entities of a blueprint.
+    """
+    EMPTY = -1
+    OVERLAP = -2
+
+    def __init__(self, entities):
+        self.entities = list(entities)
+        tiles = [
+            [(floor(coordinate.x), floor(coordinate.y))
+             for coordinate in entity.coordinates]
+            for entity in self.entities]
+        xs = [x for coordinates in tiles for x, _ in coordinates]
+        ys = [y for coordinates in tiles for _, y in coordinates]
+        # Blueprint.maximum_values truncates towards zero, which cuts off
+        # the tiles of splitters at negative coordinates
+        self.minx = min(xs, default=0)
+        self.miny = min(ys, default=0)
+        self.width = max(xs, default=-1) - self.minx + 1
+        self.height = max(ys, default=-1) - self.miny + 1
+        self.tiles = array('l', [self.EMPTY]) * (self.width * self.height)
+        self.overlaps = {}
+
+        for uid, (entity, coordinates) in enumerate(zip(self.entities, tiles)):
+            for x, y in coordinates:
+                index = (y - self.miny) * self.width + x - self.minx
+                current = self.tiles[index]
+                if current == self.EMPTY:
+                    self.tiles[index] = uid
+                elif current == self.OVERLAP:
+                    self.overlaps[index].append(entity)
+                else:
+                    self.tiles[index] = self.OVERLAP
+                    self.overlaps[index] = [self.entities[current], entity]
+
+    def _index(self, position):
+        x = floor(position.x) - self.minx
+        y = floor(position.y) - self.miny
+        if 0 <= x < self.width and 0 <= y < self.height:
+            return y * self.width + x
+        return None
+
+    def __getitem__(self, position):
+        index = self._index(position)
+        if index is None:
+            return []
+        uid = self.tiles[index]
+        if uid == self.EMPTY:
+            return []
+        elif uid == self.OVERLAP:
+            return list(self.overlaps[index])
+        return [self.entities[uid]]
+
+    def overlapping_tiles(self):
+        """
+        The tiles covered by more than one entity, with those entities.
+        """
+        for index, entities in self.overlaps.items():
+            y, x = divmod(index, self.width)
+            yield (x + self.minx, y + self.miny), list(entities)
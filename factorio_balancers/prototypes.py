@@ -0,0 +1,74 @@
+import hashlib
+import json
+import os
+from functools import lru_cache
+from py_factorio_blueprints import Blueprint
+
+
+DATA_FILE = f"{os.path.dirname(__file__)}/entity_data.json"
+
+# The fields used by this package (belt_speed, max_distance, ascii), and by
+# py_factorio_blueprints to place entities (type, selection_box)
+ENTITY_FIELDS = (
+    'name', 'type', 'selection_box', 'belt_speed', 'max_distance', 'ascii')
+SIGNAL_FIELDS = ('name', 'type')
+
+
+def _compact(prototypes, fields):
+    return {
+        name: {
+            field: prototype[field]
+            for field in fields if field in prototype}
+        for name, prototype in prototypes.items()}
+
+
+@lru_cache(maxsize=None)
+def read_prototype_data(filename=DATA_FILE):
+    """
+    Reads a prototype data file once, keeping only the fields that are
+    used.
+    """
+    with open(filename) as f:
+        data = json.load(f)
+    return {
+        'entity': _compact(data['entity'], ENTITY_FIELDS),
+        'recipe': _compact(data['recipe'], ('name',)),
+        'item': _compact(data['item'], ('name',)),
+        'signal': _compact(data['signal'], SIGNAL_FIELDS),
+        'tile': _compact(data['tile'], ('name',)),
+    }
+
+
+@lru_cache(maxsize=None)
+def prototype_data_digest(filename=DATA_FILE):
+    """
+    A hash of the contents of a prototype data file, used to tell versions
+    of the data apart.
+    """
+    with open(filename, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def load_prototype_data(filename=DATA_FILE):
+    """
+    Makes sure the prototype data of `filename` is the one used by
+    Blueprint. The file is only read the first time, after that this only
+    restores the data if something else replaced it.
+    """
+    data = read_prototype_data(filename)
+    if Blueprint.entity_prototypes is data['entity']:
+        return
+    Blueprint.set_entity_prototype_data(data['entity'])
+    Blueprint.set_recipe_prototype_data(data['recipe'])
+    Blueprint.set_item_prototype_data(data['item'])
+    Blueprint.set_signal_prototype_data(data['signal'])
+    Blueprint.set_tile_prototype_data(data['tile'])
+
+
+def reload_prototype_data(filename=DATA_FILE):
+    """
+    Reads the prototype data again, for when a (modded) data file changed.
+    """
+    read_prototype_data.cache_clear()
+    prototype_data_digest.cache_clear()
+    load_prototype_data(filename)
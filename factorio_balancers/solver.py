@@ -0,0 +1,282 @@
+from fractions import Fraction
+from factorio_balancers.exceptions import NonLinearNetwork
+
+
+def get_edges(splitters, input_belts, output_belts):
+    """
+    The belts of a simulation graph as edges between splitters, inputs and
+    outputs. Every edge is a tuple of
+    (source kind, source index, target kind, target index, capacity, belt),
+    where a kind is 'input', 'splitter', 'output' or 'dead end'.
+    Also returns the number of outputs of every splitter.
+    """
+    nodes = {id(splitter): i for i, splitter in enumerate(splitters)}
+    outputs = {id(belt): i for i, belt in enumerate(output_belts)}
+
+    def target(belt):
+        if belt.next is not None:
+            return 'splitter', nodes[id(belt.next.node)]
+        elif id(belt) in outputs:
+            return 'output', outputs[id(belt)]
+        # A belt that doesn't lead anywhere, like a lane that is blocked by
+        # an underground.
+        return 'dead end', None
+
+    def capacity(belt):
+        if belt.next is not None:
+            return min(belt.capacity, belt.next.capacity)
+        return belt.capacity
+
+    edges = []
+    nr_splitter_outputs = []
+    for i, splitter in enumerate(splitters):
+        splitter_outputs = splitter.get_outputs()
+        nr_splitter_outputs.append(len(splitter_outputs))
+        for belt in splitter_outputs:
+            edges.append(
+                ('splitter', i, *target(belt), capacity(belt), belt))
+    for i, belt in enumerate(input_belts):
+        edges.append(('input', i, *target(belt), capacity(belt), belt))
+    return edges, nr_splitter_outputs
+
+
+class LinearSolver:
+    """
+    Solves the steady state of a balancer as a linear system.
+
+    As long as no belt is saturated and no splitter uses an output priority,
+    every splitter divides the flow that enters it evenly over its outputs.
+    The flow x_s entering splitter s then satisfies
+
+        x_s = sum(x_t / nr_outputs(t) for every belt from t to s) + supply_s
+
+    which is solved once, exactly, for every input at the same time. The
+    result is the fraction of each input that ends up at each output.
+    Scenarios that saturate a belt raise NonLinearNetwork, as the linear
+    model doesn't hold for them.
+    """
+    def __init__(self, splitters, input_belts, output_belts):
+        self.nr_inputs = len(input_belts)
+        self.nr_outputs = len(output_belts)
+        self.edges, self.nr_splitter_outputs = get_edges(
+            splitters, input_belts, output_belts)
+        for i, splitter in enumerate(splitters):
+            if splitter.output_priority is not None \
+                    and self.nr_splitter_outputs[i] > 1:
+                raise NonLinearNetwork(
+                    "Output priority splitters don't split linearly")
+
+        self.flows = self._solve(len(splitters))
+
+    def _solve(self, size):
+        # Sparse rows of (I - P), and the supply of each input as right
+        # hand side.
+        rows = [{i: Fraction(1)} for i in range(size)]
+        rhs = [{} for _ in range(size)]
+        for source_kind, source, target_kind, target, _, _ in self.edges:
+            if target_kind != 'splitter':
+                continue
+            if source_kind == 'input':
+                rhs[target][source] = rhs[target].get(source, 0) + 1
+            else:
+                share = Fraction(1, self.nr_splitter_outputs[source])
+                rows[target][source] = rows[target].get(source, 0) - share
+        columns = [set() for _ in range(size)]
+        for i, row in enumerate(rows):
+            for j in row:
+                columns[j].add(i)
+
+        for k in range(size):
+            pivot = rows[k].get(k, 0)
+            if pivot == 0:
+                raise NonLinearNetwork(
+                    "Flow gets trapped in a loop without an exit")
+            for i in sorted(columns[k]):
+                if i <= k:
+                    continue
+                factor = rows[i][k] / pivot
+                for j, value in rows[k].items():
+                    result = rows[i].get(j, 0) - factor * value
+                    if result == 0:
+                        rows[i].pop(j, None)
+                        columns[j].discard(i)
+                    else:
+                        rows[i][j] = result
+                        columns[j].add(i)
+                for j, value in rhs[k].items():
+                    result = rhs[i].get(j, 0) - factor * value
+                    if result == 0:
+                        rhs[i].pop(j, None)
+                    else:
+                        rhs[i][j] = result
+
+        flows = [None] * size
+        for k in reversed(range(size)):
+            result = dict(rhs[k])
+            for j, value in rows[k].items():
+                if j == k:
+                    continue
+                for input, flow in flows[j].items():
+                    result[input] = result.get(input, 0) - value * flow
+            pivot = rows[k][k]
+            flows[k] = {
+                input: value / pivot
+                for input, value in result.items() if value != 0}
+        return flows
+
+    def _edge_flow(self, source_kind, source, supplies):
+        if source_kind == 'input':
+            return supplies[source]
+        flow = sum(
+            value * supplies[input]
+            for input, value in self.flows[source].items())
+        return flow / self.nr_splitter_outputs[source]
+
+    def output_flows(self, supplies):
+        """
+        The flow arriving at every output when every input i is supplied
+        with supplies[i] items per cycle.
+        """
+        for i, nr_outputs in enumerate(self.nr_splitter_outputs):
+            if nr_outputs == 0 and any(
+                    supplies[input] for input in self.flows[i]):
+                raise NonLinearNetwork("Flow reaches a dead end")
+        result = [Fraction(0)] * self.nr_outputs
+        for source_kind, source, target_kind, target, capacity, _ in \
+                self.edges:
+            flow = self._edge_flow(source_kind, source, supplies)
+            if flow > capacity:
+                raise NonLinearNetwork("A belt is saturated")
+            if target_kind == 'dead end' and flow > 0:
+                raise NonLinearNetwork("Flow reaches a dead end")
+            if target_kind == 'output':
+                result[target] += flow
+        return result
+
+    def transfer_matrix(self):
+        """
+        The fraction of every input that ends up at every output, regardless
+        of belt capacities.
+        """
+        result = [[Fraction(0)] * self.nr_outputs
+                  for _ in range(self.nr_inputs)]
+        for source_kind, source, target_kind, target, _, _ in self.edges:
+            if target_kind != 'output':
+                continue
+            for input in range(self.nr_inputs):
+                supplies = [0] * self.nr_inputs
+                supplies[input] = 1
+                result[input][target] += self._edge_flow(
+                    source_kind, source, supplies)
+        return result
+
+
+class MaxFlowSolver:
+    """
+    Finds the maximum throughput between a set of inputs and outputs as a
+    maximum flow problem (using Dinic's algorithm), with the belts as edges
+    and their capacities as edge capacities.
+
+    Splitters divide items evenly instead of routing them along the best
+    path, so the simulated throughput can be lower than the maximum flow.
+    The maximum flow is an exact upper bound: when it can't carry the full
+    supply, the bottleneck is structural and the simulation is limited too.
+    Priorities are not supported, as they decide where items go on their
+    own.
+    """
+    def __init__(self, splitters, input_belts, output_belts):
+        for splitter in splitters:
+            if splitter.input_priority is not None \
+                    or splitter.output_priority is not None:
+                raise NonLinearNetwork(
+                    "Priority splitters don't maximize the flow")
+        self.nr_splitters = len(splitters)
+        self.edges, _ = get_edges(splitters, input_belts, output_belts)
+
+    def _build(self, inputs, outputs):
+        # Node 0 is the source, node 1 the sink and the splitters follow.
+        size = self.nr_splitters + 2
+        graph = [[] for _ in range(size)]
+        belts = []
+
+        def node(kind, index):
+            if kind == 'input':
+                return 0 if index in inputs else None
+            elif kind == 'output':
+                return 1 if index in outputs else None
+            elif kind == 'splitter':
+                return index + 2
+            return None
+
+        for source_kind, source, target_kind, target, capacity, belt in \
+                self.edges:
+            u = node(source_kind, source)
+            v = node(target_kind, target)
+            if u is None or v is None:
+                continue
+            # Edges are lists of [target, capacity, index of reverse edge]
+            graph[u].append([v, capacity, len(graph[v])])
+            graph[v].append([u, 0, len(graph[u]) - 1])
+            belts.append((u, len(graph[u]) - 1, belt))
+        return graph, belts
+
+    def _levels(self, graph):
+        levels = [-1] * len(graph)
+        levels[0] = 0
+        queue = [0]
+        for u in queue:
+            for v, capacity, _ in graph[u]:
+                if capacity > 0 and levels[v] < 0:
+                    levels[v] = levels[u] + 1
+                    queue.append(v)
+        return levels
+
+    def _augment(self, graph, levels, pointers):
+        # Searches a path from the source to the sink along the levels, one
+        # node at a time, so long chains of belts don't hit the recursion
+        # limit. Dead ends are skipped for the rest of the phase.
+        path = [0]
+        while path:
+            u = path[-1]
+            if u == 1:
+                edges = [graph[w][pointers[w]] for w in path[:-1]]
+                pushed = min(edge[1] for edge in edges)
+                for edge in edges:
+                    edge[1] -= pushed
+                    graph[edge[0]][edge[2]][1] += pushed
+                return pushed
+            while pointers[u] < len(graph[u]):
+                v, capacity, _ = graph[u][pointers[u]]
+                if capacity > 0 and levels[v] == levels[u] + 1:
+                    path.append(v)
+                    break
+                pointers[u] += 1
+            else:
+                path.pop()
+                if path:
+                    pointers[path[-1]] += 1
+        return 0
+
+    def solve(self, inputs, outputs):
+        """
+        The maximum flow from the given input indices to the given output
+        indices, and the belts that form a minimum cut between them.
+        """
+        inputs, outputs = set(inputs), set(outputs)
+        graph, belts = self._build(inputs, outputs)
+        flow = 0
+        while True:
+            levels = self._levels(graph)
+            if levels[1] < 0:
+                break
+            pointers = [0] * len(graph)
+            while True:
+                pushed = self._augment(graph, levels, pointers)
+                if pushed == 0:
+                    break
+                flow += pushed
+
+        cut = [
+            belt for u, i, belt in belts
+            if levels[u] >= 0 and levels[graph[u][i][0]] < 0]
+        return flow, cut
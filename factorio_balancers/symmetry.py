@@ -0,0 +1,319 @@
+from collections import Counter
+from factorio_balancers.solver import get_edges
+
+
+def _ranks(values):
+    order = {value: i for i, value in enumerate(sorted(set(values), key=repr))}
+    return [order[value] for value in values]
+
+
+class ColoredGraph:
+    """
+    The simulation graph as a directed graph with colored nodes and edges,
+    used to find its symmetries.
+
+    Nodes are the inputs, followed by the outputs, the splitters and any
+    belts that lead nowhere. Edges are colored by the capacities of their
+    belts, and by whether they connect to the priority side of a splitter.
+    Which side that is doesn't matter, so a mirrored balancer gives the same
+    colors.
+    """
+    def __init__(self, splitters, input_belts, output_belts):
+        self.nr_inputs = len(input_belts)
+        self.nr_outputs = len(output_belts)
+        offsets = {
+            'input': 0,
+            'output': self.nr_inputs,
+            'splitter': self.nr_inputs + self.nr_outputs,
+        }
+        colors = (
+            [('input',)] * self.nr_inputs +
+            [('output',)] * self.nr_outputs +
+            [('splitter',
+              splitter.input_priority is not None,
+              splitter.output_priority is not None)
+             for splitter in splitters])
+
+        edges = []
+        edge_colors = []
+        dead_ends = len(colors)
+        for source_kind, source, target_kind, target, _, belt in get_edges(
+                splitters, input_belts, output_belts)[0]:
+            u = offsets[source_kind] + source
+            if target_kind == 'dead end':
+                v = dead_ends
+                dead_ends += 1
+                colors.append(('dead end',))
+            else:
+                v = offsets[target_kind] + target
+            out_side = in_side = None
+            if source_kind == 'splitter':
+                splitter = splitters[source]
+                if splitter.output_priority is not None:
+                    side = 'left' if belt is splitter.output_left else 'right'
+                    out_side = side == splitter.output_priority
+            if target_kind == 'splitter':
+                splitter = splitters[target]
+                if splitter.input_priority is not None:
+                    side = \
+                        'left' if belt.next is splitter.input_left else 'right'
+                    in_side = side == splitter.input_priority
+            edges.append((u, v))
+            edge_colors.append((
+                belt.capacity,
+                belt.next.capacity if belt.next is not None else None,
+                out_side, in_side))
+
+        self.size = len(colors)
+        self.color_values = sorted(set(colors), key=repr)
+        self.edge_color_values = sorted(set(edge_colors), key=repr)
+        self.colors = _ranks(colors)
+        self.outgoing = [[] for _ in range(self.size)]
+        self.incoming = [[] for _ in range(self.size)]
+        self.edges = Counter()
+        for (u, v), color in zip(edges, _ranks(edge_colors)):
+            self.outgoing[u].append((color, v))
+            self.incoming[v].append((color, u))
+            self.edges[(u, v, color)] += 1
+
+    @property
+    def terminals(self):
+        return range(self.nr_inputs + self.nr_outputs)
+
+    def signatures(self, colors):
+        return [
+            (colors[v],
+             tuple(sorted((c, colors[w]) for c, w in self.outgoing[v])),
+             tuple(sorted((c, colors[u]) for c, u in self.incoming[v])))
+            for v in range(self.size)]
+
+    def refine(self, *colorings):
+        """
+        Refines one or more colorings at the same time (1-dimensional
+        Weisfeiler-Leman), using the same labels for all of them. Returns
+        None when the colorings stop being compatible.
+        """
+        nr_colors = None
+        while True:
+            signatures = [self.signatures(colors) for colors in colorings]
+            counts = Counter(signatures[0])
+            for other in signatures[1:]:
+                if Counter(other) != counts:
+                    return None
+            order = {
+                signature: i
+                for i, signature in enumerate(sorted(counts))}
+            colorings = [
+                [order[signature] for signature in colors]
+                for colors in signatures]
+            if len(order) == nr_colors:
+                return colorings
+            nr_colors = len(order)
+
+    def is_automorphism(self, mapping):
+        if [self.colors[mapping[v]] for v in range(self.size)] != \
+                self.colors:
+            return False
+        return all(
+            self.edges[(mapping[u], mapping[v], c)] == count
+            for (u, v, c), count in self.edges.items())
+
+    def _individualize(self, colors, node):
+        colors = list(colors)
+        colors[node] = max(colors) + 1
+        return colors
+
+    def _search(self, left, right):
+        result = self.refine(left, right)
+        if result is None:
+            return None
+        left, right = result
+        cells = Counter(left)
+        cell = min(
+            (color for color, size in cells.items() if size > 1),
+            default=None)
+        if cell is None:
+            mapping = [None] * self.size
+            position = {color: v for v, color in enumerate(right)}
+            for v, color in enumerate(left):
+                mapping[v] = position[color]
+            return mapping if self.is_automorphism(mapping) else None
+        v = left.index(cell)
+        for w in (w for w, color in enumerate(right) if color == cell):
+            mapping = self._search(
+                self._individualize(left, v),
+                self._individualize(right, w))
+            if mapping is not None:
+                return mapping
+        return None
+
+    def find_automorphism(self, pairs):
+        """
+        An automorphism that maps every node a to b for all (a, b) in pairs,
+        or None if there is none.
+        """
+        left, right = list(self.colors), list(self.colors)
+        for a, b in pairs:
+            left = self._individualize(left, a)
+            right = self._individualize(right, b)
+        return self._search(left, right)
+
+    def generators(self):
+        """
+        Automorphisms that generate every symmetry of the graph, as far as
+        the inputs and outputs are concerned.
+        """
+        generators = []
+        fixed = []
+        for point in self.terminals:
+            colors = self.refine(self._fix(fixed))[0]
+            candidates = [
+                v for v in self.terminals
+                if colors[v] == colors[point] and v != point]
+            level = []
+            orbit = {point}
+            for candidate in candidates:
+                if candidate in orbit:
+                    continue
+                mapping = self.find_automorphism(
+                    [(v, v) for v in fixed] + [(point, candidate)])
+                if mapping is None:
+                    continue
+                level.append(mapping)
+                orbit = self._orbit(point, level)
+            generators.extend(level)
+            fixed.append(point)
+        return generators
+
+    def canonical_form(self, max_size=128):
+        """
+        The graph with its nodes numbered in a canonical order, so every
+        graph that is isomorphic to this one gives the same form.
+        The colors are refined and, while nodes still share a color, one
+        node of the smallest shared color is individualized. Every choice
+        is tried, except for nodes that an automorphism maps onto one that
+        was already tried, and the smallest form is used.
+        Finding the automorphisms takes long for large graphs with many
+        symmetries, so graphs with more than `max_size` nodes use the
+        `invariant_form` instead.
+        """
+        colors = (repr(self.color_values), repr(self.edge_color_values))
+        if self.size > max_size:
+            return colors + (self.invariant_form(),)
+        return colors + (self._canonical(self.colors, []),)
+
+    def invariant_form(self):
+        """
+        How many nodes and edges there are of every refined color. Graphs
+        that are isomorphic give the same form, but so can some that aren't.
+        """
+        colors = self.refine(self.colors)[0]
+        edges = Counter()
+        for (u, v, color), count in self.edges.items():
+            edges[(colors[u], colors[v], color)] += count
+        return (
+            'invariant', tuple(sorted(Counter(colors).items())),
+            tuple(sorted(edges.items())))
+
+    def _canonical(self, colors, path):
+        colors = self.refine(colors)[0]
+        cell = min(
+            (color for color, size in Counter(colors).items() if size > 1),
+            default=None)
+        if cell is None:
+            return self._encode(colors)
+        best = None
+        tried = []
+        for v in (v for v, color in enumerate(colors) if color == cell):
+            fixed = [(u, u) for u in path]
+            if any(self.find_automorphism(fixed + [(w, v)]) is not None
+                   for w in tried):
+                continue
+            tried.append(v)
+            form = self._canonical(
+                self._individualize(colors, v), path + [v])
+            if best is None or form < best:
+                best = form
+        return best
+
+    def _encode(self, labels):
+        nodes = [None] * self.size
+        for v, label in enumerate(labels):
+            nodes[label] = self.colors[v]
+        edges = sorted(
+            (labels[u], labels[v], color, count)
+            for (u, v, color), count in self.edges.items())
+        return tuple(nodes), tuple(edges)
+
+    def _fix(self, fixed):
+        colors = list(self.colors)
+        for v in fixed:
+            colors = self._individualize(colors, v)
+        return colors
+
+    def _orbit(self, point, generators):
+        orbit = {point}
+        queue = [point]
+        for v in queue:
+            for mapping in generators:
+                if mapping[v] not in orbit:
+                    orbit.add(mapping[v])
+                    queue.append(mapping[v])
+        return orbit
+
+
+class Symmetries:
+    """
+    The symmetries of a balancer, as permutations of its inputs and
+    outputs. Combinations of inputs and outputs that are mapped onto each
+    other by a symmetry behave exactly the same.
+
+    At most `limit` permutations are generated. Any subset of the symmetries
+    is enough to skip combinations safely, a larger one just skips more.
+    """
+    def __init__(self, splitters, input_belts, output_belts, limit=1024):
+        graph = ColoredGraph(splitters, input_belts, output_belts)
+        nr_inputs = graph.nr_inputs
+        generators = {
+            self._restrict(mapping, nr_inputs, graph.nr_outputs)
+            for mapping in graph.generators()}
+        identity = (
+            tuple(range(nr_inputs)), tuple(range(graph.nr_outputs)))
+        generators.discard(identity)
+        self.generators = list(generators)
+
+        elements = {identity}
+        queue = [identity]
+        for element in queue:
+            for generator in self.generators:
+                product = (
+                    tuple(generator[0][i] for i in element[0]),
+                    tuple(generator[1][i] for i in element[1]))
+                if product not in elements and len(elements) < limit:
+                    elements.add(product)
+                    queue.append(product)
+        self.elements = list(elements)
+
+    @staticmethod
+    def _restrict(mapping, nr_inputs, nr_outputs):
+        return (
+            tuple(mapping[i] for i in range(nr_inputs)),
+            tuple(mapping[nr_inputs + i] - nr_inputs
+                  for i in range(nr_outputs)))
+
+    def __len__(self):
+        return len(self.elements)
+
+    def is_representative(self, inputs, outputs):
+        """
+        Whether this combination of input and output indices is the
+        smallest one it can be mapped to.
+        """
+        combination = (tuple(inputs), tuple(outputs))
+        for input_map, output_map in self.elements:
+            image = (
+                tuple(sorted(input_map[i] for i in inputs)),
+                tuple(sorted(output_map[i] for i in outputs)))
+            if image < combination:
+                return False
+        return True
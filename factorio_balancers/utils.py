@@ -1,5 +1,8 @@
+import time
+from contextlib import contextmanager
 from functools import reduce
 from fractions import Fraction
+from itertools import islice
 from operator import mul
 
 
@@ -29,6 +32,10 @@ def catch(func, *args, handle=lambda e: e, exceptions=(Exception,), **kwargs):
         return handle(e)
 
 
+def is_close(a, b, rel_tol=1e-06, abs_tol=0.0):
+    return abs(a - b) <= max(rel_tol * max(abs(a), abs(b)), abs_tol)
+
+
 def get_nr_of_permutations(nr_inputs, nr_outputs, max_nr):
     def nCk(n, k):
         return int(reduce(mul, (Fraction(n - i, i + 1) for i in range(k)), 1))
@@ -41,3 +48,49 @@ def get_nr_of_permutations(nr_inputs, nr_outputs, max_nr):
     for i in range(1, max_nr + 1):
         perms += nCk(nr_inputs, i) * nCk(nr_outputs, i)
     return perms
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def revolving_door(n, k):
+    """
+    All k-combinations of range(n), ordered so that consecutive combinations
+    differ by swapping a single element.
+    """
+    if k == 0:
+        yield ()
+        return
+    if k > n:
+        return
+    if k == n:
+        yield tuple(range(n))
+        return
+    yield from revolving_door(n - 1, k)
+    for combination in reversed(list(revolving_door(n - 1, k - 1))):
+        yield combination + (n - 1,)
+
+
+@contextmanager
+def timed(timings, name):
+    """
+    Stores the wall and CPU time spent in the `with` block in
+    `timings[name]`, in seconds. Does nothing when `timings` is None.
+    """
+    if timings is None:
+        yield
+        return
+    wall, cpu = time.perf_counter(), time.process_time()
+    try:
+        yield
+    finally:
+        timings[name] = {
+            'wall': time.perf_counter() - wall,
+            'cpu': time.process_time() - cpu,
+        }
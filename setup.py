@@ -20,6 +20,9 @@ setup(
         'py_factorio_blueprints>=0.2.5',
         'progress',
     ],
+    extras_require={
+        'numpy': ['numpy'],
+    },
     classifiers=[
         'Development Status :: 3 - Alpha',
         'Intended Audience :: Developers',
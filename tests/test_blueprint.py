@@ -1,9 +1,19 @@
+import json
 import unittest
 import logging
+from unittest import mock
 
 
+from py_factorio_blueprints import Blueprint
+from py_factorio_blueprints.util import Vector, decode, encode
 from py_factorio_blueprints.exceptions import UnknownEntity
 from factorio_balancers.balancer import Balancer
+from factorio_balancers.batch import find_blueprints, run_batch, to_json
+from factorio_balancers.book import BalancerBook
+from factorio_balancers.grid import GridIndex
+from factorio_balancers.prototypes import (
+    DATA_FILE, load_prototype_data, read_prototype_data,
+    reload_prototype_data)
 from factorio_balancers.exceptions import *
 
 
@@ -59,7 +69,249 @@ class TestBlueprint(TestBase):
             string = f.read()
         balancer = Balancer(string=string)
 
+    def test_blueprint_unchanged(self):
+        cases = [
+            ('blueprint_strings/4x4_balancer_pad_and_strip.blueprint', 4),
+            ('blueprint_strings/4x4_balancer_strip_test.blueprint', 4),
+            ('blueprint_strings/1x1_lane_balancer_input.blueprint', 1),
+        ]
+        for string, size in cases:
+            with open(string) as f:
+                string = f.read()
+            balancer = Balancer(string=string)
+            self.assertEqual(
+                balancer.to_string(), Blueprint(string=string).to_string())
+            self.assertEqual(
+                (balancer.nr_inputs, balancer.nr_outputs), (size, size))
+
     def test_import(self):
         with open('blueprint_strings/4x4_balancer.blueprint') as f:
             string = f.read()
         balancer = Balancer(string=string)
+
+    def test_prototype_data_loaded_once(self):
+        string = 'blueprint_strings/4x4_balancer.blueprint'
+        with open(string) as f:
+            string = f.read()
+        reload_prototype_data()
+        Balancer(string=string)
+        Balancer(string=string)
+        self.assertEqual(read_prototype_data.cache_info().misses, 1)
+
+        data = Blueprint.entity_prototypes
+        self.assertEqual(data['transport-belt']['belt_speed'], 1)
+        self.assertNotIn('localised_name', data['transport-belt'])
+
+        Blueprint.import_prototype_data(DATA_FILE)
+        Balancer(string=string)
+        self.assertIs(Blueprint.entity_prototypes, data)
+        self.assertEqual(read_prototype_data.cache_info().misses, 1)
+
+    def test_diagnostics_only_when_enabled(self):
+        with open('blueprint_strings/4x4_balancer.blueprint') as f:
+            string = f.read()
+        level = logger.level
+        logger.setLevel(logging.WARNING)
+        try:
+            with mock.patch.object(
+                    Balancer, 'render2d', autospec=True) as render2d:
+                Balancer(string=string)
+            self.assertEqual(render2d.call_count, 0)
+        finally:
+            logger.setLevel(level)
+
+        events = []
+        balancer = Balancer(string=string, trace=events.append)
+        kinds = [event['event'] for event in events]
+        self.assertEqual(
+            kinds, ['layout', 'padding', 'connections', 'simulation'])
+        self.assertEqual(events[0]['rows'], balancer.render2d())
+        self.assertEqual(len(events[2]['inputs']), balancer.nr_inputs)
+        self.assertEqual(events[3]['splitters'], len(balancer._splitters))
+
+    def test_entity_grid(self):
+        with open('blueprint_strings/4x4_balancer.blueprint') as f:
+            string = f.read()
+        balancer = Balancer(string=string)
+        grid = balancer.entity_grid
+        for entity in balancer.entities:
+            for coordinate in entity.coordinates:
+                for offset in [(0, 0), (1, 0), (0, 1), (-1, 0), (0, -1)]:
+                    position = coordinate + Vector(offset)
+                    self.assertEqual(
+                        grid[position], balancer.entities[position])
+
+        belt = next(
+            entity for entity in balancer.entities
+            if entity.name == 'transport-belt')
+        grid = GridIndex([belt, belt])
+        self.assertEqual(grid[belt.position], [belt, belt])
+        self.assertEqual(grid[belt.position + Vector(1, 0)], [])
+        self.assertEqual(GridIndex([])[belt.position], [])
+
+    def test_underground_pairing_errors(self):
+        cases = [
+            ('blueprint_strings/illegal_underground_configuration1.blueprint',
+             "Two underground inputs in a row"),
+            ('blueprint_strings/illegal_underground_configuration2.blueprint',
+             "Lone underground input"),
+        ]
+        for string, message in cases:
+            with open(string) as f:
+                string = f.read()
+            with self.assertRaises(IllegalConfigurations) as context:
+                Balancer(string=string)
+            self.assertEqual(
+                [e.message for e in context.exception.args], [message])
+
+    def test_no_inputs_or_outputs(self):
+        # A loop of belts has no inputs or outputs to trace
+        load_prototype_data()
+        loop = Blueprint()
+        for position, direction in [
+                ((0, 0), 2), ((1, 0), 4), ((1, 1), 6), ((0, 1), 0)]:
+            loop.entities.make(
+                name='transport-belt', position=position,
+                direction=direction)
+        with self.assertRaises(IllegalConfiguration) as context:
+            Balancer(string=loop.to_string())
+        self.assertEqual(
+            context.exception.message, "The balancer has no inputs")
+
+    def test_long_belts(self):
+        # A splitter whose left output runs further than the recursion
+        # limit, turning at the end so it isn't stripped
+        length = 1500
+        load_prototype_data()
+        blueprint = Blueprint()
+        for x in (0, 1):
+            for y in (1, 2):
+                blueprint.entities.make(
+                    name='transport-belt', position=(x, y), direction=0)
+        blueprint.entities.make(
+            name='splitter', position=(0.5, 0), direction=0)
+        blueprint.entities.make(
+            name='transport-belt', position=(1, -1), direction=0)
+        for y in range(1, length + 1):
+            blueprint.entities.make(
+                name='transport-belt', position=(0, -y), direction=0)
+        blueprint.entities.make(
+            name='transport-belt', position=(0, -length - 1), direction=6)
+
+        balancer = Balancer(string=blueprint.to_string())
+        self.assertEqual((balancer.nr_inputs, balancer.nr_outputs), (2, 2))
+        self.assertTrue(balancer.test_output_balance())
+
+
+class TestBatch(TestBase):
+    paths = [
+        'blueprint_strings/illegal_*',
+        'blueprint_strings/splitter.blueprint',
+        'blueprint_strings/missing.blueprint']
+
+    def test_find_blueprints(self):
+        found = list(find_blueprints(['blueprint_strings']))
+        self.assertIn('blueprint_strings/4x4_balancer.blueprint', found)
+        self.assertEqual(found, sorted(found))
+        found = list(find_blueprints(self.paths))
+        self.assertEqual(len(found), 8)
+        self.assertEqual(found[-1], 'blueprint_strings/missing.blueprint')
+
+    def test_errors(self):
+        records = {
+            record['file']: record
+            for record in run_batch(self.paths, ['balance.output'])}
+        self.assertEqual(
+            records['blueprint_strings/illegal_entities.blueprint']['error'],
+            'UnknownEntity')
+        illegal = records[
+            'blueprint_strings/illegal_splitter_configuration1.blueprint']
+        self.assertEqual(illegal['error'], 'IllegalConfigurations')
+        self.assertEqual(len(illegal['errors']), 1)
+        self.assertEqual(
+            records['blueprint_strings/missing.blueprint']['error'],
+            'FileNotFoundError')
+        splitter = records['blueprint_strings/splitter.blueprint']
+        self.assertTrue(splitter['results']['balance.output']['result'])
+        for record in records.values():
+            self.assertEqual(json.loads(to_json(record)), record)
+
+    def test_fingerprint(self):
+        paths = ['blueprint_strings/splitter.blueprint']
+        record, = run_batch(paths, ['balance.output'])
+        self.assertNotIn('fingerprint', record)
+        record, = run_batch(paths, [], fingerprint=True)
+        with open(paths[0]) as f:
+            balancer = Balancer(string=f.read())
+        self.assertEqual(record['fingerprint'], balancer.fingerprint())
+
+    def test_processes(self):
+        properties = ['balance.output', 'throughput.full']
+        self.assertEqual(
+            list(run_batch(['blueprint_strings'], properties, processes=2)),
+            list(run_batch(['blueprint_strings'], properties)))
+
+
+class TestBook(TestBase):
+    def book(self, *entries):
+        blueprints = []
+        for i, entry in enumerate(entries):
+            if isinstance(entry, tuple):
+                data = {'blueprint_book': self.book(*entry)}
+            else:
+                with open(f'blueprint_strings/{entry}.blueprint') as f:
+                    data = decode(f.read())
+            data['index'] = i
+            blueprints.append(data)
+        return {'item': 'blueprint-book', 'blueprints': blueprints}
+
+    def setUp(self):
+        self.string = encode({'blueprint_book': self.book(
+            'splitter', ('3x3_balancer', 'illegal_splitter_configuration1'),
+            '4x4_balancer')})
+
+    def test_entries(self):
+        book = BalancerBook(self.string)
+        self.assertTrue(book.is_book)
+        self.assertEqual(
+            [entry.path for entry in book], [(0,), (1, 0), (1, 1), (2,)])
+        with open('blueprint_strings/4x4_balancer.blueprint') as f:
+            string = f.read()
+        self.assertEqual(
+            list(book)[-1].balancer().to_string(),
+            Balancer(string=string).to_string())
+
+        single = BalancerBook(string)
+        self.assertFalse(single.is_book)
+        self.assertEqual(len(single), 1)
+
+    def test_unchanged(self):
+        data = {'blueprint_book': self.book('splitter', ('3x3_balancer',))}
+        for entry in data['blueprint_book']['blueprints']:
+            if 'blueprint' in entry:
+                entry['blueprint']['schedules'] = []
+        book = BalancerBook(data=data)
+        string = encode(data)
+        for _ in range(2):
+            list(book.balancers())
+            list(book.test(['balance.output']))
+            self.assertEqual(encode(book.data), string)
+
+    def test_balancers(self):
+        book = BalancerBook(encode({'blueprint_book': self.book(
+            'splitter', ('3x3_balancer',))}))
+        self.assertEqual(
+            [balancer.nr_inputs
+             for balancer in book.balancers(compiled=True)],
+            [2, 3])
+
+    def test_results(self):
+        book = BalancerBook(self.string)
+        properties = ['balance.output', 'throughput.full']
+        records = list(book.test(properties))
+        self.assertEqual(records, list(book.test(properties, processes=2)))
+        self.assertEqual(
+            [record['entry'] for record in records],
+            [[0], [1, 0], [1, 1], [2]])
+        self.assertEqual(records[2]['error'], 'IllegalConfigurations')
+        self.assertTrue(records[3]['results']['balance.output']['result'])
@@ -1,7 +1,20 @@
+import os
+import pickle
 import random
+import sys
+import tempfile
+from unittest import mock
+from itertools import combinations
 from fractions import Fraction
+from py_factorio_blueprints.util import decode
 from factorio_balancers.graph import Splitter, Belt
-from factorio_balancers import Balancer
+from factorio_balancers.cache import GraphCache, ResultCache, package_version
+from factorio_balancers import Balancer, CompiledBalancer
+from factorio_balancers.exceptions import NonLinearNetwork
+from factorio_balancers.solver import MaxFlowSolver
+from factorio_balancers.symmetry import ColoredGraph
+from factorio_balancers.utils import get_nr_of_permutations, revolving_door
+from factorio_balancers.generator import generate, generate_string, stages
 
 
 from tests.test_blueprint import TestBase
@@ -47,67 +60,59 @@ def random_splitter():
 
 
 class TestBalancerBase(TestBase):
-
-    def assertOutputBalance(self, string, **kwargs):
+    def loadBalancer(self, string, **kwargs):
         with open(string) as f:
             string = f.read()
-        balancer = Balancer(string=string, verbose=kwargs.get('verbose', False))
+        return Balancer(
+            string=string,
+            verbose=kwargs.get('verbose', False),
+            engine=kwargs.get('engine', 'object'),
+            order=kwargs.get('order', None))
+
+    def assertOutputBalance(self, string, **kwargs):
+        balancer = self.loadBalancer(string, **kwargs)
         is_output_balanced = balancer.test_output_balance(**kwargs)
         if not is_output_balanced:
             raise AssertionError('Balancer is not output balanced')
 
     def assertNoOutputBalance(self, string, **kwargs):
-        with open(string) as f:
-            string = f.read()
-        balancer = Balancer(string=string, verbose=kwargs.get('verbose', False))
+        balancer = self.loadBalancer(string, **kwargs)
         is_output_balanced = balancer.test_output_balance(**kwargs)
         if is_output_balanced:
             raise AssertionError('Balancer is output balanced')
 
     def assertInputBalance(self, string, **kwargs):
-        with open(string) as f:
-            string = f.read()
-        balancer = Balancer(string=string, verbose=kwargs.get('verbose', False))
+        balancer = self.loadBalancer(string, **kwargs)
         is_input_balanced = balancer.test_input_balance(**kwargs)
         if not is_input_balanced:
             raise AssertionError('Balancer is not input balanced')
 
     def assertNoInputBalance(self, string, **kwargs):
-        with open(string) as f:
-            string = f.read()
-        balancer = Balancer(string=string, verbose=kwargs.get('verbose', False))
+        balancer = self.loadBalancer(string, **kwargs)
         is_input_balanced = balancer.test_input_balance(**kwargs)
         if is_input_balanced:
             raise AssertionError('Balancer is input balanced')
 
     def assertFullThroughput(self, string, **kwargs):
-        with open(string) as f:
-            string = f.read()
-        balancer = Balancer(string=string, verbose=kwargs.get('verbose', False))
+        balancer = self.loadBalancer(string, **kwargs)
         has_full_throughput, worst = balancer.test_throughput(**kwargs)
         if not has_full_throughput:
             raise AssertionError('Balancer does not have full throughput')
 
     def assertNoFullThroughput(self, string, **kwargs):
-        with open(string) as f:
-            string = f.read()
-        balancer = Balancer(string=string, verbose=kwargs.get('verbose', False))
+        balancer = self.loadBalancer(string, **kwargs)
         has_full_throughput, worst = balancer.test_throughput(**kwargs)
         if has_full_throughput:
             raise AssertionError('Balancer has full throughput')
 
     def assertThroughputUnlimited(self, string, **kwargs):
-        with open(string) as f:
-            string = f.read()
-        balancer = Balancer(string=string, verbose=kwargs.get('verbose', False))
+        balancer = self.loadBalancer(string, **kwargs)
         unlimited, worst = balancer.test_throughput_unlimited(**kwargs)
         if not unlimited:
             raise AssertionError('Balancer is throughput limited')
 
     def assertThroughputLimited(self, string, **kwargs):
-        with open(string) as f:
-            string = f.read()
-        balancer = Balancer(string=string, verbose=kwargs.get('verbose', False))
+        balancer = self.loadBalancer(string, **kwargs)
         unlimited, worst = balancer.test_throughput_unlimited(**kwargs)
         if unlimited:
             raise AssertionError('Balancer is throughput unlimited')
@@ -292,6 +297,829 @@ class TestBalancerSimulation(TestBalancerBase):
         self.assertThroughputLimited(string)
 
 
+class TestNumpyEngine(TestBalancerBase):
+    def test_same_state_as_object_engine(self):
+        string = 'blueprint_strings/4x4_balancer_using_priority.blueprint'
+        balancer = self.loadBalancer(string)
+        numpy_balancer = self.loadBalancer(string, engine='numpy')
+        engine = numpy_balancer._engine
+        for _ in range(20):
+            balancer.supply(Fraction(1, 2))
+            numpy_balancer.supply(Fraction(1, 2))
+            balancer.drain(amount=Fraction(1, 4))
+            numpy_balancer.drain(amount=Fraction(1, 4))
+            balancer.cycle()
+            numpy_balancer.cycle()
+            for belt, numpy_belt in zip(
+                    balancer._belts, numpy_balancer._belts):
+                self.assertAlmostEqual(
+                    float(belt.content),
+                    engine.content[engine.index[id(numpy_belt)]])
+
+    def test_properties(self):
+        for string in [
+                'blueprint_strings/4x4_balancer.blueprint',
+                'blueprint_strings/3x3_not_balanced.blueprint',
+                'blueprint_strings/4x4_balancer_using_priority.blueprint',
+                'blueprint_strings/1x1_lane_balancer_input.blueprint']:
+            balancer = self.loadBalancer(string)
+            numpy_balancer = self.loadBalancer(string, engine='numpy')
+            self.assertEqual(
+                balancer.test_output_balance(),
+                numpy_balancer.test_output_balance())
+            self.assertEqual(
+                balancer.test_input_balance(trickle=True),
+                numpy_balancer.test_input_balance(trickle=True))
+            self.assertEqual(
+                balancer.test_throughput_unlimited(),
+                numpy_balancer.test_throughput_unlimited())
+
+
+class TestFloatEngine(TestBalancerBase):
+    def test_properties(self):
+        string = 'blueprint_strings/4x4_balancer_using_priority.blueprint'
+        self.assertOutputBalance(string, engine='float')
+        self.assertNoInputBalance(string, engine='float')
+        self.assertFullThroughput(string, engine='float')
+        self.assertThroughputLimited(string, engine='float')
+
+    def test_borderline_verification(self):
+        string = 'blueprint_strings/3x3_not_balanced.blueprint'
+        balancer = self.loadBalancer(string)
+        # Every decision is borderline with a margin this large, so the
+        # wrong float verdict is replaced by the exact one.
+        self.assertFalse(
+            balancer.test_output_balance(engine='float', margin=1))
+        self.assertEqual(balancer.engine, 'object')
+
+    def test_results(self):
+        string = 'blueprint_strings/3x3_balancer.blueprint'
+        balancer = self.loadBalancer(string)
+        properties = [
+            'balance.output', 'balance.input', 'throughput.full',
+            'throughput.unlimited.candidate']
+        self.assertEqual(
+            balancer.test(properties=properties),
+            balancer.test(properties=properties, engine='float'))
+
+    def test_borderline_throughput(self):
+        for string in [
+                'blueprint_strings/4x4_balancer.blueprint',
+                'blueprint_strings/4x4_limited_balancer.blueprint']:
+            events = []
+            with open(string) as f:
+                balancer = Balancer(string=f.read(), trace=events.append)
+            exact = balancer.test_throughput()
+            # The verdict is borderline with a margin this large, so it is
+            # verified using exact fractions
+            self.assertEqual(
+                balancer.test_throughput(engine='float', margin=1), exact)
+            self.assertIn(
+                {'event': 'borderline', 'test': 'test_throughput',
+                 'engine': 'float'},
+                events)
+
+
+    def test_equal_values_are_borderline(self):
+        balancer = self.loadBalancer(
+            'blueprint_strings/splitter.blueprint', engine='float')
+        engine = balancer._engine
+        for values, equal in [
+                ([1.0, 1.0], True), ([1.0, 1.0 + 2 ** -52], True),
+                ([0.0, 0.0], True), ([1.0, 1.5], False)]:
+            engine.borderline = False
+            self.assertEqual(engine.all_equal(values), equal)
+            self.assertEqual(engine.borderline, equal)
+
+
+class TestDyadicEngine(TestBalancerBase):
+    def test_same_state_as_object_engine(self):
+        string = 'blueprint_strings/3x3_balancer.blueprint'
+        balancer = self.loadBalancer(string)
+        dyadic_balancer = self.loadBalancer(string, engine='dyadic')
+        engine = dyadic_balancer._engine
+        for _ in range(50):
+            self.assertEqual(
+                balancer.supply(Fraction(1, 4)),
+                dyadic_balancer.supply(Fraction(1, 4)))
+            self.assertEqual(balancer.drain(), dyadic_balancer.drain())
+            balancer.cycle()
+            dyadic_balancer.cycle()
+        for belt, dyadic_belt in zip(
+                balancer._belts, dyadic_balancer._belts):
+            i = engine.index[id(dyadic_belt)]
+            self.assertEqual(belt.content, engine.from_units(engine.content[i]))
+
+    def test_properties(self):
+        string = 'blueprint_strings/4x4_balancer_using_priority.blueprint'
+        self.assertOutputBalance(string, engine='dyadic')
+        self.assertNoInputBalance(string, engine='dyadic')
+        self.assertFullThroughput(string, engine='dyadic')
+        self.assertThroughputLimited(string, engine='dyadic')
+        string = 'blueprint_strings/1x3_different_speeds.blueprint'
+        self.assertNoOutputBalance(string, engine='dyadic', trickle=True)
+
+    def test_non_dyadic_amount(self):
+        string = 'blueprint_strings/splitter.blueprint'
+        balancer = self.loadBalancer(string, engine='dyadic')
+        with self.assertRaises(ValueError):
+            balancer.supply(Fraction(1, 3))
+
+
+class TestWorklistEngine(TestBalancerBase):
+    PROPERTIES = [
+        'balance.output', 'balance.input',
+        'balance.output.trickle', 'balance.input.trickle',
+        'throughput.full', 'throughput.unlimited']
+
+    def test_same_results(self):
+        for string in [
+                'blueprint_strings/3x3_balancer.blueprint',
+                'blueprint_strings/4x4_balancer_using_priority.blueprint',
+                'blueprint_strings/1x1_lane_balancer_input.blueprint']:
+            balancer = self.loadBalancer(string, engine='dyadic')
+            self.assertEqual(
+                balancer.test(self.PROPERTIES),
+                balancer.test(self.PROPERTIES, engine='worklist'))
+
+    def test_settle(self):
+        string = 'blueprint_strings/4x4_balancer.blueprint'
+        balancer = self.loadBalancer(string, engine='worklist')
+        balancer.clear()
+        balancer.supply()
+        cycles = balancer.settle()
+        self.assertGreater(cycles, 0)
+        self.assertTrue(balancer._engine.idle)
+        self.assertEqual(balancer.settle(), 0)
+
+        balancer.set_engine('dyadic')
+        balancer.clear()
+        balancer.supply()
+        self.assertEqual(balancer.settle(), cycles)
+
+
+class TestFlowOrder(TestBalancerBase):
+    PROPERTIES = [
+        'balance.output', 'balance.input',
+        'throughput.full', 'throughput.unlimited']
+
+    def test_components(self):
+        balancer = self.loadBalancer(
+            'blueprint_strings/3x3_balancer.blueprint', engine='dyadic')
+        schedule, _ = balancer._engine._schedule
+        self.assertEqual(
+            sorted(len(splitters) for splitters, _, _ in schedule),
+            [1, 1, 2])
+        for splitters, incoming, internal in schedule:
+            self.assertEqual(len(internal) > 0, len(splitters) > 1)
+
+        balancer = self.loadBalancer(
+            'blueprint_strings/4x4_balancer.blueprint', engine='dyadic')
+        schedule, _ = balancer._engine._schedule
+        self.assertEqual(
+            [len(splitters) for splitters, _, _ in schedule],
+            [1] * len(balancer._splitters))
+
+    def test_same_results(self):
+        for string in [
+                'blueprint_strings/3x3_balancer.blueprint',
+                'blueprint_strings/4x3_balancer_splitter_underground.blueprint',
+                'blueprint_strings/4x4_balancer_using_priority.blueprint',
+                'blueprint_strings/1x1_lane_balancer_input.blueprint']:
+            for engine in ['object', 'dyadic']:
+                expected = self.loadBalancer(
+                    string, engine=engine).test(self.PROPERTIES)
+                for order in ['flow', 'reverse']:
+                    balancer = self.loadBalancer(
+                        string, engine=engine, order=order)
+                    self.assertEqual(
+                        balancer.test(self.PROPERTIES), expected)
+                    self.assertEqual(balancer._engine.order, order)
+
+    def test_fewer_cycles(self):
+        string = 'blueprint_strings/4x4_balancer.blueprint'
+        cycles = {}
+        for order in [None, 'flow']:
+            balancer = self.loadBalancer(string, engine='dyadic', order=order)
+            balancer.clear()
+            balancer.supply()
+            cycles[order] = balancer.settle()
+        self.assertLess(cycles['flow'], cycles[None])
+
+
+class TestLinearSolver(TestBalancerBase):
+    def test_transfer_matrix(self):
+        string = 'blueprint_strings/4x4_balancer.blueprint'
+        balancer = self.loadBalancer(string)
+        for row in balancer.transfer_matrix():
+            self.assertEqual(row, [Fraction(1, 4)] * 4)
+        string = 'blueprint_strings/3x3_balancer.blueprint'
+        balancer = self.loadBalancer(string)
+        for row in balancer.transfer_matrix():
+            self.assertEqual(row, [Fraction(1, 3)] * 3)
+
+    def test_output_balance(self):
+        self.assertOutputBalance(
+            'blueprint_strings/3x3_balancer.blueprint', solver='linear')
+        self.assertNoOutputBalance(
+            'blueprint_strings/3x3_not_balanced.blueprint', solver='linear')
+        self.assertNoOutputBalance(
+            'blueprint_strings/4x4_splitter_block.blueprint',
+            solver='linear')
+        self.assertOutputBalance(
+            'blueprint_strings/1x1_lane_balancer_output.blueprint',
+            solver='linear')
+
+    def test_non_linear(self):
+        string = 'blueprint_strings/splitter_output_priority.blueprint'
+        balancer = self.loadBalancer(string)
+        with self.assertRaises(NonLinearNetwork):
+            balancer.linear_solver()
+        self.assertNoOutputBalance(string, solver='linear')
+        string = 'blueprint_strings/1x3_different_speeds.blueprint'
+        self.assertOutputBalance(string, solver='linear')
+        self.assertNoOutputBalance(string, solver='linear', trickle=True)
+
+
+class TestMaxFlowSolver(TestBalancerBase):
+    def test_min_cut(self):
+        string = 'blueprint_strings/4x4_limited_balancer.blueprint'
+        balancer = self.loadBalancer(string)
+        inputs = balancer._input_belts[:2]
+        outputs = balancer._output_belts[:2]
+        self.assertFalse(
+            balancer.test_throughput(inputs=inputs, outputs=outputs)[0])
+        cut = balancer.min_cut(inputs=inputs, outputs=outputs)
+        self.assertEqual(sum(belt.capacity for belt in cut), 1)
+        self.assertFalse(balancer.test_throughput()[0])
+        cut = balancer.min_cut()
+        self.assertEqual(sum(belt.capacity for belt in cut), 2)
+
+    def test_min_cut_unlimited(self):
+        string = 'blueprint_strings/4x4_balancer.blueprint'
+        balancer = self.loadBalancer(string)
+        cut = balancer.min_cut()
+        self.assertEqual(sum(belt.capacity for belt in cut), 4)
+
+    def test_long_path(self):
+        # A path longer than the recursion limit
+        solver = MaxFlowSolver.__new__(MaxFlowSolver)
+        length = sys.getrecursionlimit() * 2
+        graph = [[] for _ in range(length + 2)]
+        path = [0] + list(range(2, length + 2)) + [1]
+        for u, v in zip(path, path[1:]):
+            graph[u].append([v, 1, len(graph[v])])
+            graph[v].append([u, 0, len(graph[u]) - 1])
+        levels = solver._levels(graph)
+        pointers = [0] * len(graph)
+        self.assertEqual(solver._augment(graph, levels, pointers), 1)
+        self.assertEqual(solver._augment(graph, levels, pointers), 0)
+
+
+class TestParallelSweep(TestBalancerBase):
+    def test_same_results(self):
+        string = 'blueprint_strings/4x4_splitter_block.blueprint'
+        balancer = self.loadBalancer(string)
+        self.assertEqual(
+            balancer.throughput_sweep(extensive=True),
+            balancer.throughput_sweep(
+                extensive=True, workers=2, chunk_size=5))
+
+    def test_throughput_unlimited(self):
+        self.assertThroughputLimited(
+            'blueprint_strings/4x4_balancer_throughput_limited.blueprint',
+            workers=2)
+        self.assertThroughputUnlimited(
+            'blueprint_strings/4x4_balancer.blueprint',
+            engine='dyadic', extensive=True, workers=2)
+
+
+class TestCompiledBalancer(TestBalancerBase):
+    properties = [
+        'balance.output', 'balance.input', 'balance.output.trickle',
+        'throughput.unlimited']
+
+    def test_same_results(self):
+        for string in [
+                'blueprint_strings/3x3_balancer.blueprint',
+                'blueprint_strings/4x4_balancer_using_priority.blueprint',
+                'blueprint_strings/1x1_lane_balancer_input.blueprint']:
+            balancer = self.loadBalancer(string, engine='dyadic')
+            compiled = pickle.loads(pickle.dumps(balancer.compile()))
+            self.assertIsInstance(compiled, CompiledBalancer)
+            self.assertEqual(
+                compiled.nr_inputs_sim, balancer.nr_inputs_sim)
+            self.assertEqual(
+                compiled.test(properties=self.properties),
+                balancer.test(properties=self.properties))
+
+    def test_pickle_balancer(self):
+        balancer = self.loadBalancer(
+            'blueprint_strings/4x4_balancer.blueprint', order='flow')
+        copy = pickle.loads(pickle.dumps(balancer))
+        self.assertEqual(copy.to_string(), balancer.to_string())
+        self.assertEqual(copy._order, 'flow')
+        self.assertEqual(
+            copy.compile().__getstate__(), balancer.compile().__getstate__())
+
+    def test_parallel_sweep(self):
+        compiled = self.loadBalancer(
+            'blueprint_strings/4x4_splitter_block.blueprint').compile()
+        self.assertEqual(
+            compiled.throughput_sweep(extensive=True),
+            compiled.throughput_sweep(extensive=True, workers=2))
+
+
+class TestGraphCache(TestBalancerBase):
+    properties = ['balance.output', 'throughput.unlimited']
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = GraphCache(self.directory.name)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def readString(self, string):
+        with open(string) as f:
+            return f.read()
+
+    def test_hit(self):
+        for string in [
+                'blueprint_strings/4x4_balancer.blueprint',
+                'blueprint_strings/1x1_lane_balancer_input.blueprint']:
+            string = self.readString(string)
+            balancer = Balancer(string=string, cache=self.cache)
+            with mock.patch.object(Balancer, 'recompile_entities') as build:
+                cached = Balancer(string=string, cache=self.cache)
+                build.assert_not_called()
+            self.assertEqual(list(cached.entities), [])
+            self.assertEqual(
+                (cached.nr_inputs, cached.nr_outputs),
+                (balancer.nr_inputs, balancer.nr_outputs))
+            self.assertEqual(
+                cached.test(properties=self.properties),
+                balancer.test(properties=self.properties))
+            self.assertEqual(
+                self.cache.load(string, engine='dyadic').test(
+                    properties=self.properties),
+                balancer.test(properties=self.properties))
+        self.assertEqual(len(self.cache.entries()), 2)
+
+    def test_key(self):
+        string = self.readString('blueprint_strings/splitter.blueprint')
+        self.assertEqual(
+            self.cache.key(string), self.cache.key(string + '\n'))
+        with tempfile.NamedTemporaryFile('w', suffix='.json') as f:
+            f.write('{}')
+            f.flush()
+            self.assertNotEqual(
+                self.cache.key(string), self.cache.key(string, f.name))
+
+    def test_load_stats(self):
+        string = self.readString('blueprint_strings/3x3_balancer.blueprint')
+        compiled = self.cache.load(string, data=decode(string), stats=True)
+        self.assertEqual(
+            list(compiled.construction_stats),
+            ['cache', 'parse', 'recompile_entities', 'pad_and_strip',
+             'nodes', 'generate_simulation'])
+        compiled = self.cache.load(string, stats=True)
+        self.assertEqual(list(compiled.construction_stats), ['cache'])
+        results = compiled.test(properties=['balance.output'], stats=True)
+        self.assertEqual(
+            results['lane_balancer']['stats']['phases'],
+            compiled.construction_stats)
+        self.assertIsNone(self.cache.load(string).construction_stats)
+
+    def test_source_version(self):
+        string = self.readString('blueprint_strings/splitter.blueprint')
+        key = self.cache.key(string)
+        # Changing the sources of the package changes its version
+        version = 'unknown+0123456789abcdef'
+        with mock.patch('factorio_balancers.cache.VERSION', version):
+            self.assertNotEqual(self.cache.key(string), key)
+        self.assertRegex(package_version(), r'\+[0-9a-f]{16}$')
+
+    def test_eviction(self):
+        strings = [
+            self.readString(f'blueprint_strings/{name}.blueprint')
+            for name in ['splitter', '3x3_balancer', '4x4_balancer']]
+        for string in strings:
+            self.cache.load(string)
+        # The first entry becomes the least recently used one
+        for i, string in enumerate(strings):
+            path = self.cache._path(self.cache.key(string))
+            os.utime(path, (i, i))
+        self.cache.max_size = self.cache.size() - 1
+        self.cache._evict()
+        self.assertEqual(len(self.cache.entries()), 2)
+        self.assertIsNone(self.cache.get(strings[0]))
+        self.assertIsNotNone(self.cache.get(strings[1]))
+
+    def test_running_size(self):
+        strings = [
+            self.readString(f'blueprint_strings/{name}.blueprint')
+            for name in ['splitter', '4x4_balancer']]
+        self.cache.load(strings[0])
+        # The directory isn't scanned while it is below the limit
+        with mock.patch.object(GraphCache, 'entries') as entries:
+            self.cache.load(strings[1])
+            entries.assert_not_called()
+        self.assertEqual(self.cache._size, self.cache.size())
+        self.cache.discard(self.cache.key(strings[0]))
+        self.assertEqual(self.cache._size, self.cache.size())
+        self.cache.max_size = self.cache.size()
+        os.utime(self.cache._path(self.cache.key(strings[1])), (0, 0))
+        self.cache.load(strings[0])
+        self.assertEqual(len(self.cache.entries()), 1)
+        self.assertIsNotNone(self.cache.get(strings[0]))
+        self.assertEqual(self.cache._size, self.cache.size())
+
+    def test_evicted_while_reading(self):
+        string = self.readString('blueprint_strings/splitter.blueprint')
+        self.cache.load(string)
+        with mock.patch('os.utime', side_effect=FileNotFoundError):
+            self.assertIsNotNone(self.cache.get(string))
+
+    def test_unreadable_entry(self):
+        string = self.readString('blueprint_strings/splitter.blueprint')
+        self.cache.load(string)
+        _, _, path = self.cache.entries()[0]
+        with open(path, 'wb') as f:
+            f.write(b'broken')
+        self.assertIsNone(self.cache.get(string))
+        self.assertEqual(self.cache.entries(), [])
+
+
+class TestResultCache(TestBalancerBase):
+    properties = [
+        'balance.output', 'balance.input.trickle', 'throughput.full',
+        'throughput.unlimited.candidate']
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_graph_hash(self):
+        balancer = self.loadBalancer(
+            'blueprint_strings/4x4_balancer.blueprint')
+        self.assertEqual(
+            balancer.graph_hash(),
+            self.loadBalancer(
+                'blueprint_strings/4x4_balancer.blueprint',
+                engine='dyadic', order='flow').graph_hash())
+        self.assertEqual(
+            balancer.graph_hash(), balancer.compile().graph_hash())
+        self.assertNotEqual(
+            balancer.graph_hash(),
+            self.loadBalancer(
+                'blueprint_strings/4x4_balancer_using_priority.blueprint'
+            ).graph_hash())
+
+    def test_same_results(self):
+        cache = ResultCache(self.directory.name)
+        for string in [
+                'blueprint_strings/4x4_balancer_throughput_limited.blueprint',
+                'blueprint_strings/1x1_lane_balancer_input.blueprint']:
+            balancer = self.loadBalancer(string)
+            results = balancer.test(properties=self.properties)
+            self.assertEqual(
+                balancer.test(properties=self.properties, cache=cache),
+                results)
+            # From memory, and from disk in a new cache
+            for cache in [cache, ResultCache(self.directory.name)]:
+                with mock.patch.object(
+                        Balancer, 'test_output_balance') as compute:
+                    self.assertEqual(
+                        balancer.test(
+                            properties=self.properties, cache=cache),
+                        results)
+                    compute.assert_not_called()
+
+    def test_parameters(self):
+        cache = ResultCache()
+        balancer = self.loadBalancer(
+            'blueprint_strings/4x4_balancer.blueprint')
+        properties = ['throughput.unlimited.candidate']
+        balancer.test(properties=properties, cache=cache)
+        results = balancer.test(
+            properties=properties, cache=cache, symmetry=True)
+        self.assertIn('skipped', results[properties[0]])
+        self.assertEqual(len(cache.memory), 2)
+
+    def test_solver(self):
+        cache = ResultCache()
+        balancer = self.loadBalancer(
+            'blueprint_strings/4x4_limited_balancer.blueprint')
+        properties = [
+            'balance.output', 'throughput.full', 'throughput.unlimited']
+        results = balancer.test(properties=properties)
+        balancer.test(properties=properties, cache=cache, solver='linear')
+        with mock.patch.object(Balancer, 'test_output_balance') as compute:
+            balancer.test(
+                properties=properties, cache=cache, solver='linear')
+            compute.assert_not_called()
+        self.assertEqual(
+            balancer.test(properties=properties, cache=cache), results)
+        self.assertEqual(len(cache.memory), 4)
+
+    def test_provenance(self):
+        cache = ResultCache(self.directory.name, max_entries=2)
+        balancer = self.loadBalancer(
+            'blueprint_strings/splitter.blueprint', engine='dyadic')
+        balancer.test(properties=self.properties, cache=cache)
+        self.assertEqual(len(cache.memory), 2)
+        self.assertEqual(len(cache.disk.entries()), 4)
+        key = cache.key(balancer.graph_hash(), 'balance.output')
+        self.assertEqual(cache.entry(key)['engine'], 'dyadic')
+
+        cache.invalidate(engine='object')
+        self.assertEqual(len(cache.disk.entries()), 4)
+        cache.invalidate(engine='dyadic')
+        self.assertEqual(len(cache.disk.entries()), 0)
+        self.assertEqual(len(cache.memory), 0)
+
+        balancer.test(properties=self.properties, cache=cache)
+        with mock.patch(
+                'factorio_balancers.cache.package_version',
+                return_value='other'):
+            self.assertIsNone(cache.get(key))
+        self.assertEqual(len(cache.disk.entries()), 3)
+
+
+class TestFingerprint(TestBalancerBase):
+    def mirrored(self, compiled):
+        # Reverses the order of the splitters, inputs and outputs, and
+        # swaps the left and right side of every splitter
+        state = compiled.__getstate__()
+        last = len(state['splitters']) - 1
+        flip = {'left': 'right', 'right': 'left', None: None}
+        state['splitters'] = [
+            (flip[input_priority], flip[output_priority])
+            for input_priority, output_priority
+            in reversed(state['splitters'])]
+        state['slots'] = [
+            (input_right, input_left, output_right, output_left)
+            for input_left, input_right, output_left, output_right
+            in reversed(state['slots'])]
+        state['belts'] = [
+            (capacity, last - node if node >= 0 else -1, next)
+            for capacity, node, next in state['belts']]
+        state['inputs'] = state['inputs'][::-1]
+        state['outputs'] = state['outputs'][::-1]
+        return CompiledBalancer.from_state(state)
+
+    def test_same_graph(self):
+        fingerprints = {
+            self.loadBalancer(string).fingerprint()
+            for string in [
+                'blueprint_strings/4x4_balancer_belt_weave.blueprint',
+                'blueprint_strings/4x4_balancer_pad_and_strip.blueprint',
+                'blueprint_strings/4x4_balancer_throughput_limited.blueprint']}
+        self.assertEqual(len(fingerprints), 1)
+        self.assertNotIn(
+            self.loadBalancer(
+                'blueprint_strings/4x4_balancer.blueprint').fingerprint(),
+            fingerprints)
+
+    def test_mirrored(self):
+        for string in [
+                'blueprint_strings/3x3_balancer.blueprint',
+                'blueprint_strings/4x4_balancer_using_priority.blueprint',
+                'blueprint_strings/splitter_output_priority.blueprint',
+                'blueprint_strings/1x1_lane_balancer_input.blueprint']:
+            compiled = self.loadBalancer(string).compile()
+            mirrored = self.mirrored(compiled)
+            self.assertNotEqual(mirrored.graph_hash(), compiled.graph_hash())
+            self.assertEqual(mirrored.fingerprint(), compiled.fingerprint())
+
+    def test_invariant_form(self):
+        string = 'blueprint_strings/4x4_balancer_using_priority.blueprint'
+        compiled = self.loadBalancer(string).compile()
+        graphs = [
+            ColoredGraph(
+                balancer._splitters, balancer._input_belts,
+                balancer._output_belts)
+            for balancer in [compiled, self.mirrored(compiled)]]
+        forms = {graph.canonical_form(max_size=0) for graph in graphs}
+        self.assertEqual(len(forms), 1)
+        self.assertNotIn(graphs[0].canonical_form(), forms)
+
+    def test_priorities_and_capacities(self):
+        fingerprints = {
+            self.loadBalancer(string).fingerprint()
+            for string in [
+                'blueprint_strings/splitter.blueprint',
+                'blueprint_strings/splitter_input_priority.blueprint',
+                'blueprint_strings/splitter_output_priority.blueprint',
+                'blueprint_strings/1x3_different_speeds.blueprint',
+                'blueprint_strings/3x1_different_speeds.blueprint']}
+        self.assertEqual(len(fingerprints), 5)
+
+
+class TestGenerator(TestBalancerBase):
+    def test_stages(self):
+        self.assertEqual(stages('butterfly', 8), [0, 1, 2])
+        self.assertEqual(stages('benes', 8), [0, 1, 2, 1, 0])
+        with self.assertRaises(ValueError):
+            stages('benes', 6)
+        with self.assertRaises(ValueError):
+            stages('omega', 8)
+
+    def test_balanced(self):
+        for size in [2, 4, 8]:
+            for family in ['butterfly', 'benes']:
+                for kwargs in [
+                        {},
+                        {'tiers': ('basic', 'fast', 'express')},
+                        {'lane_balance': True}]:
+                    balancer = Balancer(
+                        string=generate_string(size, family, **kwargs))
+                    self.assertEqual(balancer.nr_inputs, size)
+                    self.assertEqual(balancer.nr_outputs, size)
+                    self.assertTrue(balancer.test_output_balance())
+                    self.assertTrue(balancer.test_input_balance())
+
+    def test_throughput(self):
+        unlimited, _ = Balancer(
+            string=generate_string(4, 'benes')).test_throughput_unlimited()
+        self.assertTrue(unlimited)
+        unlimited, _ = Balancer(
+            string=generate_string(4, 'butterfly')).test_throughput_unlimited()
+        self.assertFalse(unlimited)
+
+    def test_lane_balancer(self):
+        balancer = Balancer(data=generate(4, 'butterfly', lane_balance=True))
+        results = balancer.test(properties=['balance.output'])
+        self.assertTrue(results['lane_balancer']['result'])
+
+
+class TestStats(TestBalancerBase):
+    properties = [
+        'balance.output', 'balance.input', 'throughput.full',
+        'throughput.unlimited.candidate']
+
+    def load(self, string, **kwargs):
+        with open(string) as f:
+            return Balancer(string=f.read(), **kwargs)
+
+    def test_construction_phases(self):
+        string = 'blueprint_strings/4x4_balancer.blueprint'
+        self.assertIsNone(self.load(string).construction_stats)
+        balancer = self.load(string, stats=True)
+        self.assertEqual(
+            list(balancer.construction_stats),
+            ['parse', 'recompile_entities', 'pad_and_strip', 'nodes',
+             'generate_simulation'])
+        results = balancer.test(properties=['balance.output'], stats=True)
+        phases = results['lane_balancer']['stats']['phases']
+        self.assertEqual(phases, balancer.construction_stats)
+        for times in phases.values():
+            self.assertGreaterEqual(times['wall'], 0)
+            self.assertGreaterEqual(times['cpu'], 0)
+
+    def test_results(self):
+        balancer = self.load('blueprint_strings/3x3_balancer.blueprint')
+        results = balancer.test(properties=self.properties)
+        for result in results.values():
+            self.assertNotIn('stats', result)
+
+        results = balancer.test(properties=self.properties, stats=True)
+        self.assertNotIn('stats', results['lane_balancer'])
+        for property in self.properties:
+            stats = results[property]['stats']
+            self.assertFalse(stats['cached'])
+            self.assertGreater(stats['cycles'], 0)
+            self.assertGreater(stats['iterations'], 0)
+        self.assertEqual(results['balance.output']['stats']['combinations'], 0)
+        self.assertEqual(
+            results['throughput.unlimited.candidate']['stats']['combinations'],
+            get_nr_of_permutations(3, 3, 2))
+
+    def test_engines(self):
+        string = 'blueprint_strings/4x4_balancer.blueprint'
+        for engine in ['object', 'float', 'dyadic', 'worklist', 'numpy']:
+            results = self.loadBalancer(string).test(
+                properties=['throughput.full'], engine=engine, stats=True)
+            stats = results['throughput.full']['stats']
+            self.assertGreater(stats['cycles'], 0)
+            self.assertGreater(stats['iterations'], 0)
+
+    def test_workers(self):
+        balancer = self.loadBalancer(
+            'blueprint_strings/4x4_splitter_block.blueprint')
+        before = balancer.counters()
+        balancer.throughput_sweep()
+        middle = balancer.counters()
+        balancer.throughput_sweep(workers=2, chunk_size=5)
+        after = balancer.counters()
+        for name in ['cycles', 'iterations', 'combinations']:
+            self.assertGreater(middle[name], before[name])
+            self.assertEqual(
+                after[name] - middle[name], middle[name] - before[name])
+
+    def test_cached(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = ResultCache(directory)
+            balancer = self.loadBalancer(
+                'blueprint_strings/4x4_balancer.blueprint')
+            balancer.test(properties=self.properties, cache=cache, stats=True)
+            results = balancer.test(
+                properties=self.properties, cache=cache, stats=True)
+            for property in self.properties:
+                stats = results[property]['stats']
+                self.assertTrue(stats['cached'])
+                self.assertEqual(stats['cycles'], 0)
+            for entry in cache.memory.values():
+                self.assertNotIn('stats', entry['result'])
+
+
+class TestSymmetry(TestBalancerBase):
+    def test_symmetries_preserve_throughput(self):
+        for string in [
+                'blueprint_strings/3x3_balancer.blueprint',
+                'blueprint_strings/4x4_balancer_using_priority.blueprint',
+                'blueprint_strings/4x4_splitter_block.blueprint',
+                'blueprint_strings/4x4_splitter_block_priority.blueprint']:
+            balancer = self.loadBalancer(string, engine='dyadic')
+            inputs, outputs = balancer._input_belts, balancer._output_belts
+            for input_map, output_map in balancer.symmetries().elements:
+                for i in range(len(inputs)):
+                    for o in range(len(outputs)):
+                        self.assertEqual(
+                            balancer.test_throughput(
+                                inputs=[inputs[i]], outputs=[outputs[o]]),
+                            balancer.test_throughput(
+                                inputs=[inputs[input_map[i]]],
+                                outputs=[outputs[output_map[o]]]))
+
+    def test_priority_breaks_symmetry(self):
+        balancer = self.loadBalancer(
+            'blueprint_strings/splitter_output_priority.blueprint')
+        self.assertEqual(len(balancer.symmetries()), 2)
+        balancer = self.loadBalancer(
+            'blueprint_strings/splitter.blueprint')
+        self.assertEqual(len(balancer.symmetries()), 4)
+
+    def test_same_results(self):
+        string = 'blueprint_strings/4x4_splitter_block.blueprint'
+        balancer = self.loadBalancer(string, engine='dyadic')
+        self.assertEqual(
+            balancer.test_throughput_unlimited(extensive=True),
+            balancer.test_throughput_unlimited(
+                extensive=True, symmetry=True))
+        self.assertGreater(balancer.skipped_combinations, 0)
+
+        results = self.loadBalancer(
+            'blueprint_strings/4x4_balancer.blueprint').test(
+                properties=['throughput.unlimited.candidate'],
+                symmetry=True)
+        self.assertTrue(results['throughput.unlimited.candidate']['result'])
+        self.assertGreater(
+            results['throughput.unlimited.candidate']['skipped'], 0)
+
+
+class TestWarmStartSweep(TestBalancerBase):
+    def test_revolving_door(self):
+        for n in range(1, 7):
+            for k in range(n + 2):
+                order = list(revolving_door(n, k))
+                self.assertEqual(
+                    sorted(order), list(combinations(range(n), k)))
+                for previous, current in zip(order, order[1:]):
+                    self.assertEqual(len(set(previous) - set(current)), 1)
+
+    def test_same_results(self):
+        for string in [
+                'blueprint_strings/3x3_balancer.blueprint',
+                'blueprint_strings/4x4_splitter_block.blueprint',
+                'blueprint_strings/1x1_lane_balancer_input.blueprint']:
+            for engine in ['object', 'dyadic', 'numpy']:
+                balancer = self.loadBalancer(string, engine=engine)
+                cold = dict(zip(
+                    balancer._sweep_combinations(4),
+                    balancer.throughput_sweep(extensive=True)))
+                warm = dict(zip(
+                    balancer._sweep_combinations(4, ordered=True),
+                    balancer.throughput_sweep(
+                        extensive=True, warm_start=True)))
+                self.assertEqual(cold.keys(), warm.keys())
+                for combination, (unlimited, percentage) in cold.items():
+                    self.assertEqual(warm[combination][0], unlimited)
+                    self.assertAlmostEqual(
+                        warm[combination][1], percentage, places=4)
+
+    def test_throughput_unlimited(self):
+        self.assertThroughputLimited(
+            'blueprint_strings/4x4_balancer_using_priority.blueprint',
+            warm_start=True)
+        self.assertThroughputUnlimited(
+            'blueprint_strings/4x4_balancer.blueprint',
+            extensive=True, warm_start=True, workers=2)
+
+
 class TestNetworkxGraph(TestBalancerBase):
     def test_4x4_balancer(self):
         string = 'blueprint_strings/4x4_balancer.blueprint'